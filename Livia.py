@@ -1,21 +1,33 @@
 # Livia.py - Chatbot da agência Live para Slack
 # Assistente de IA que responde em DMs, canais e threads quando mencionada
 
+import time
+import_started_at = time.perf_counter()  # início da importação, para os tempos de inicialização
+
 import os
+import sys
 import re
 import json
 import csv
+import sqlite3
+import socket
 import logging
 import threading
-import time
+import math
+import random
+import hashlib
+import asyncio
+import contextlib
 from datetime import datetime
 from dotenv import load_dotenv
-from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack_sdk.errors import SlackApiError
-from openai import OpenAI
 from threading import Thread, Lock
 import queue
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from uso_analytics import UsageStore
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # Configuração de logs
 logging.basicConfig(level=logging.CRITICAL)
@@ -36,17 +48,901 @@ if not SLACK_BOT_TOKEN:
 if not SLACK_APP_TOKEN:
     print("❌ SLACK_APP_TOKEN não encontrada. Use: export SLACK_APP_TOKEN=seu_token")
 
+# Endereços das APIs (sobrescritos para apontar para servidores locais, ex.: bench/benchmark.py)
+SLACK_API_URL = os.getenv("LIVIA_SLACK_API_URL", "https://slack.com/api/")
+OPENAI_BASE_URL = os.getenv("LIVIA_OPENAI_BASE_URL") or None  # None usa o endereço padrão da OpenAI
+
+# Cache de nomes de usuários e canais (users_info / conversations_info)
+DIRECTORY_CACHE_TTL = int(os.getenv("LIVIA_DIRETORIO_TTL", "3600"))  # segundos
+DIRECTORY_CACHE_MAX = int(os.getenv("LIVIA_DIRETORIO_MAX", "5000"))  # entradas por cache
+DIRECTORY_PREFILL = os.getenv("LIVIA_DIRETORIO_PREFILL", "0") == "1"  # pré-carrega na inicialização
+
+# Cache de histórico das threads (conversations_replies)
+THREAD_CACHE_MAX = int(os.getenv("LIVIA_THREADS_MAX", "500"))    # threads mantidas em memória
+THREAD_CACHE_TTL = int(os.getenv("LIVIA_THREADS_TTL", "1800"))   # segundos sem uso antes de descartar
+
+# Índice de threads em que a Livia participa (decide respostas em thread sem chamar a API)
+THREAD_INDEX_FILE = os.getenv("LIVIA_THREADS_ARQUIVO", "livia_threads.json")
+THREAD_INDEX_MAX_AGE = int(os.getenv("LIVIA_THREADS_INDICE_DIAS", "30")) * 86400  # segundos sem atividade
+
+# Janela de contexto enviada ao modelo
+CONTEXT_TOKEN_BUDGET = int(os.getenv("LIVIA_CONTEXTO_TOKENS", "64000"))  # tokens de entrada (prompt + histórico)
+SUMMARY_RESERVE_TOKENS = 2000   # espaço reservado para o resumo das mensagens antigas
+SUMMARY_RECOMPUTE_THRESHOLD = int(os.getenv("LIVIA_RESUMO_LIMIAR", "10"))  # mensagens novas antes de refazer o resumo
+
+# Registro de uso (CSV gravado em lotes por um único thread)
+USAGE_LOG_FILE = os.getenv("LIVIA_USO_ARQUIVO", "registro_uso.csv")
+USAGE_FLUSH_ROWS = int(os.getenv("LIVIA_USO_LOTE", "50"))             # linhas por gravação
+USAGE_FLUSH_INTERVAL = float(os.getenv("LIVIA_USO_INTERVALO", "5"))   # segundos máximos entre gravações
+USAGE_ROTATE_BYTES = int(os.getenv("LIVIA_USO_MAX_BYTES", str(10 * 1024 * 1024)))  # tamanho para rotacionar
+USAGE_DB_FILE = os.getenv("LIVIA_USO_DB", "registro_uso.db")  # base indexada para relatórios ("" desativa)
+USAGE_FIELDS = ['user_id', 'user_name', 'channel_name', 'timestamp', 'prompt_type',
+                'latency_ms', 'prompt_tokens', 'completion_tokens', 'reasoning_tokens']
+
+# Modo de execução: "threads" (padrão) ou "asyncio" (também com --async na linha de comando)
+RUNTIME = "asyncio" if "--async" in sys.argv else os.getenv("LIVIA_RUNTIME", "threads")
+
+# Limites de taxa aplicados no cliente (chamadas por minuto)
+SLACK_METHOD_LIMITS = {
+    "chat.postMessage": 60,        # especial: ~1 por segundo
+    "chat.update": 50,             # Tier 3
+    "chat.delete": 50,             # Tier 3
+    "conversations.replies": 50,   # Tier 3
+    "conversations.info": 50,      # Tier 3
+    "users.info": 100,             # Tier 4
+    "users.list": 20,              # Tier 2
+    "conversations.list": 20,      # Tier 2
+    "auth.test": 100,              # Tier 4
+}
+OPENAI_RPM = int(os.getenv("LIVIA_OPENAI_RPM", "500"))        # requisições por minuto
+OPENAI_TPM = int(os.getenv("LIVIA_OPENAI_TPM", "200000"))     # tokens por minuto
+RATE_LIMIT_RETRIES = 3  # tentativas após um 429 antes de desistir
+
+# Gateway do modelo: retries, circuit breaker e fallback por latência
+MODEL_RETRIES = int(os.getenv("LIVIA_MODELO_RETRIES", "2"))                 # novas tentativas em erros transitórios
+MODEL_P95_TARGET = float(os.getenv("LIVIA_MODELO_P95_ALVO", "25"))          # segundos; acima disso usa o fallback
+MODEL_FALLBACK = os.getenv("LIVIA_MODELO_FALLBACK", "gpt-4o-mini")          # modelo rápido ("" desativa)
+MODEL_LATENCY_WINDOW = 300       # segundos de amostras usadas no p95
+MODEL_LATENCY_MIN_SAMPLES = 10   # amostras mínimas para decidir pelo p95
+BREAKER_FAILURES = 5             # falhas seguidas que abrem o circuito
+BREAKER_OPEN_SECONDS = 30        # tempo com o circuito aberto antes de testar de novo
+MODEL_TIMEOUTS = {"low": 30, "medium": 60, "high": 120}  # segundos por reasoning_effort
+MODEL_TIMEOUT_DEFAULT = 30       # modelos sem reasoning_effort (fallback)
+
+# Configuração por canal (prompt, modelo, esforço, limites, cooldown e "aguarde") em JSON, recarregada a quente
+CHANNEL_CONFIG_FILE = os.getenv("LIVIA_CANAIS_ARQUIVO", "livia_canais.json")
+CHANNEL_CONFIG_RELOAD = float(os.getenv("LIVIA_CANAIS_RECARGA", "5"))  # segundos entre checagens do arquivo
+MODEL_ROUTING = os.getenv("LIVIA_ROTEAMENTO", "1") == "1"  # mensagens curtas vão para o modelo rápido
+
+# Cache de respostas para perguntas avulsas repetidas (fora de threads); desativado por padrão
+RESPONSE_CACHE = os.getenv("LIVIA_CACHE_RESPOSTAS", "0") == "1"              # padrão dos canais (o canal pode mudar)
+RESPONSE_CACHE_TTL = float(os.getenv("LIVIA_CACHE_RESPOSTAS_TTL", "86400"))  # segundos que uma resposta vale
+RESPONSE_CACHE_MAX = int(os.getenv("LIVIA_CACHE_RESPOSTAS_MAX", "1000"))     # respostas guardadas (LRU)
+RESPONSE_CACHE_FILE = os.getenv("LIVIA_CACHE_RESPOSTAS_ARQUIVO", "")         # SQLite para sobreviver a reinícios ("" só memória)
+
+# Métricas no formato Prometheus servidas localmente em /metrics
+METRICS_PORT = int(os.getenv("LIVIA_METRICS_PORTA", "9464"))     # 0 desativa o endpoint
+METRICS_HOST = os.getenv("LIVIA_METRICS_HOST", "127.0.0.1")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# Despacho de eventos e chamadas ao modelo
+EVENT_WORKERS = int(os.getenv("LIVIA_EVENT_WORKERS", "4"))    # workers de entrada de eventos
+MODEL_WORKERS = int(os.getenv("LIVIA_MODEL_WORKERS", "8"))    # chamadas simultâneas ao modelo
+MAX_QUEUE_DEPTH = int(os.getenv("LIVIA_MAX_FILA", "200"))     # eventos/respostas pendentes antes de recusar
+BUSY_MESSAGE = ":no_entry: Estou atendendo muitas mensagens agora. Tente novamente em instantes."
+
+# Respostas em streaming (a mensagem de "aguarde" é editada conforme o texto chega)
+STREAMING = os.getenv("LIVIA_STREAMING", "1") == "1"
+STREAM_UPDATE_INTERVAL = float(os.getenv("LIVIA_STREAM_INTERVALO", "1.5"))  # segundos entre edições
+STREAM_UPDATE_MIN_CHARS = int(os.getenv("LIVIA_STREAM_MIN_CHARS", "200"))  # adianta a edição com esse volume novo
+SLACK_MESSAGE_LIMIT = 3900  # caracteres por mensagem antes de continuar numa nova
+
+# Mensagens muito longas: divididas em partes processadas em paralelo e combinadas numa chamada final
+LONG_INPUT_TOKENS = int(os.getenv("LIVIA_LONGO_TOKENS", "12000"))           # acima disso usa o modo em partes (0 desativa)
+LONG_INPUT_CHUNK_TOKENS = int(os.getenv("LIVIA_LONGO_PARTE_TOKENS", "4000"))  # tamanho alvo de cada parte
+LONG_INPUT_MAX_CHUNKS = int(os.getenv("LIVIA_LONGO_MAX_PARTES", "16"))       # partes maiores em vez de mais partes
+LONG_INPUT_WORKERS = int(os.getenv("LIVIA_LONGO_WORKERS", "4"))              # chamadas simultâneas das partes
+LONG_INPUT_PART_MAX_TOKENS = 1500  # tokens de resposta por parte
+
 # Controle de concorrência para evitar respostas duplicadas
-processing_lock = threading.Lock()
-processing_messages = {}  # {message_key: timestamp}
-message_cooldown = 2  # segundos entre mensagens do mesmo usuário
-
-# Inicialização dos clientes
-app = App(
-    token=SLACK_BOT_TOKEN,
-    process_before_response=True
-)
-client = OpenAI(api_key=OPENAI_API_KEY)
+MESSAGE_COOLDOWN = float(os.getenv("LIVIA_COOLDOWN", "2"))  # segundos entre mensagens do mesmo usuário
+PROCESSING_MAX_AGE = 300  # segundos antes de uma mensagem "em processamento" expirar
+EVENT_MAX_AGE = float(os.getenv("LIVIA_EVENTO_IDADE_MAX", "30"))  # eventos mais velhos que isso são ignorados
+
+# Várias instâncias: cada mensagem é reivindicada (com lease) num backend compartilhado
+CLAIM_BACKEND = os.getenv("LIVIA_COORDENACAO", "local")                        # local, sqlite ou redis
+CLAIM_SQLITE_FILE = os.getenv("LIVIA_COORDENACAO_ARQUIVO", "livia_coordenacao.db")
+CLAIM_REDIS_URL = os.getenv("LIVIA_REDIS_URL", "redis://127.0.0.1:6379/0")
+INSTANCE_ID = os.getenv("LIVIA_INSTANCIA") or f"{socket.gethostname()}:{os.getpid()}"
+
+# Journal de eventos em SQLite (WAL): eventos confirmados ao Slack são gravados antes de entrar na fila
+EVENT_JOURNAL_FILE = os.getenv("LIVIA_JOURNAL_ARQUIVO", "livia_eventos.db")  # "" desativa
+EVENT_REPLAY_WINDOW = float(os.getenv("LIVIA_JOURNAL_JANELA", "900"))        # segundos: eventos reprocessados ao iniciar
+EVENT_JOURNAL_RETENTION = int(os.getenv("LIVIA_JOURNAL_DIAS", "7")) * 86400   # segundos mantidos no arquivo
+EVENT_JOURNAL_BATCH = int(os.getenv("LIVIA_JOURNAL_LOTE", "200"))              # gravações por transação
+
+# Clientes do Slack e da OpenAI, criados por create_app() (nada se conecta durante a importação)
+app = None
+client = None
+
+# Identidade do bot: resolvida uma vez e compartilhada entre os handlers
+bot_identity_lock = threading.Lock()
+bot_identity = {"user_id": None, "resolvido_em": 0.0}
+identity_stats = {"auth_test_evitados": 0, "refresh_ok": 0, "refresh_falhas": 0}
+
+class TTLCache:
+    """Cache em memória com expiração por TTL, despejo LRU e estatísticas de acerto"""
+
+    def __init__(self, maxsize=1000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # {chave: (expira_em, valor)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "despejos": self.evictions,
+                "expirados": self.expirations,
+            }
+
+user_name_cache = TTLCache(maxsize=DIRECTORY_CACHE_MAX, ttl=DIRECTORY_CACHE_TTL)     # {user_id: real_name}
+channel_name_cache = TTLCache(maxsize=DIRECTORY_CACHE_MAX, ttl=DIRECTORY_CACHE_TTL)  # {channel_id: nome}
+
+class Metrics:
+    """Registro mínimo de contadores, gauges e histogramas no formato de texto do Prometheus.
+
+    Estatísticas que já existem nos componentes (caches, admissão, baldes...) entram por
+    coletores chamados no momento da leitura, sem duplicar contagens.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._samples = {}     # {(nome, rótulos): valor} para contadores e gauges
+        self._histograms = {}  # {(nome, rótulos): [contagens por bucket, soma, total]}
+        self._types = {}       # {nome: (tipo, ajuda)}
+        self._collectors = []
+
+    def describe(self, name, kind, help_text):
+        self._types[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._samples[key] = self._samples.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._samples[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def collector(self, function):
+        # function() retorna tuplas (nome, rótulos, valor); os tipos vêm de describe()
+        self._collectors.append(function)
+        return function
+
+    def render(self):
+        lines = {}
+        with self._lock:
+            samples = list(self._samples.items())
+            histograms = [(key, [list(h[0]), h[1], h[2]]) for key, h in self._histograms.items()]
+        for function in self._collectors:
+            try:
+                samples.extend(((name, tuple(sorted(labels.items()))), value) for name, labels, value in function())
+            except Exception as e:
+                samples.append((("livia_erros_total", (("local", "metricas"), ("tipo", type(e).__name__))), 1))
+        for (name, labels), value in samples:
+            lines.setdefault(name, []).append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), (counts, total, count) in histograms:
+            out = lines.setdefault(name, [])
+            for bound, bucket_count in zip(self.buckets, counts):
+                out.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {bucket_count}")
+            out.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            out.append(f"{name}_sum{format_labels(labels)} {total}")
+            out.append(f"{name}_count{format_labels(labels)} {count}")
+        text = []
+        for name in sorted(lines):
+            kind, help_text = self._types.get(name, ("untyped", name))
+            text.append(f"# HELP {name} {help_text}")
+            text.append(f"# TYPE {name} {kind}")
+            text.extend(lines[name])
+        return "\n".join(text) + "\n"
+
+def _escape_label(value):
+    # Escapa barras e aspas do valor de um rótulo; quebras de linha viram espaço
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+def format_labels(labels):
+    # Formata rótulos do Prometheus
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+
+metrics = Metrics(LATENCY_BUCKETS)
+for _name, _kind, _help in [
+    ("livia_fila_eventos_espera_segundos", "histogram", "Tempo entre o ack do evento e o início do processamento"),
+    ("livia_slack_api_segundos", "histogram", "Duração das chamadas à Web API do Slack por método"),
+    ("livia_slack_api_erros_total", "counter", "Erros retornados pela Web API do Slack por método"),
+    ("livia_historico_segundos", "histogram", "Tempo para obter o histórico de uma thread"),
+    ("livia_modelo_primeiro_token_segundos", "histogram", "Tempo até o primeiro token do modelo"),
+    ("livia_modelo_total_segundos", "histogram", "Tempo total da chamada ao modelo"),
+    ("livia_etapa_segundos", "histogram", "Duração de cada etapa do pipeline de roteamento"),
+    ("livia_erros_total", "counter", "Exceções capturadas por local e tipo"),
+    ("livia_auth_test_segundos", "gauge", "Latência da última verificação auth_test do monitor de saúde"),
+    ("livia_auth_test_ok", "gauge", "1 se a última verificação auth_test do monitor de saúde funcionou"),
+]:
+    metrics.describe(_name, _kind, _help)
+
+class TokenBucket:
+    """Balde de tokens com reabastecimento contínuo.
+
+    reserve() desconta a quantidade pedida, limitada à capacidade (o saldo pode ficar negativo), e
+    devolve quanto tempo o chamador deve esperar e quanto foi descontado, o que enfileira as chamadas
+    em vez de fazê-las falhar. acquire() espera e retorna o que foi descontado, base para o refund().
+    try_acquire() é a versão sem espera, para chamadas que podem ser puladas (edições parciais).
+    penalize() aplica o Retry-After de um 429 ao balde inteiro.
+    """
+
+    def __init__(self, name, per_minute, burst=None):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1.0, per_minute / 6.0)
+        self.tokens = self.capacity
+        self.blocked_until = 0.0
+        self._updated = time.time()
+        self._lock = threading.Lock()
+        self.stats = {"esperas": 0, "tempo_espera": 0.0, "429": 0, "pulos": 0}
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount=1):
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            self.tokens -= amount
+            wait = max(0.0, -self.tokens / self.rate, self.blocked_until - now)
+            if wait:
+                self.stats["esperas"] += 1
+                self.stats["tempo_espera"] += wait
+            return wait, amount
+
+    def try_acquire(self, amount=1, keep=0.0):
+        """Desconta sem esperar se sobrarem ao menos keep tokens; senão não desconta e retorna False"""
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            if now < self.blocked_until or self.tokens - amount < keep:
+                self.stats["pulos"] += 1
+                return False
+            self.tokens -= amount
+            return True
+
+    def acquire(self, amount=1):
+        wait, amount = self.reserve(amount)
+        if wait:
+            time.sleep(wait)
+        return amount
+
+    async def acquire_async(self, amount=1):
+        wait, amount = self.reserve(amount)
+        if wait:
+            await asyncio.sleep(wait)
+        return amount
+
+    def refund(self, amount):
+        # Devolve tokens reservados a mais (ex.: estimativa maior que o uso real)
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def penalize(self, retry_after):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.time() + retry_after)
+            self.tokens = min(self.tokens, 0.0)
+            self.stats["429"] += 1
+
+    def level(self):
+        with self._lock:
+            self._refill(time.time())
+            return self.tokens
+
+slack_buckets = {method: TokenBucket(method, per_minute) for method, per_minute in SLACK_METHOD_LIMITS.items()}
+openai_request_bucket = TokenBucket("openai.requests", OPENAI_RPM)
+openai_token_bucket = TokenBucket("openai.tokens", OPENAI_TPM)
+
+def rate_limiter_levels():
+    # Nível atual de cada balde, para monitoramento
+    buckets = list(slack_buckets.values()) + [openai_request_bucket, openai_token_bucket]
+    return {bucket.name: bucket.level() for bucket in buckets}
+
+def slack_retry_after(e):
+    # Segundos de Retry-After de um SlackApiError 429, ou None se não for limite de taxa
+    response = getattr(e, "response", None)
+    if response is None or getattr(response, "status_code", None) != 429:
+        return None
+    headers = {key.lower(): value for key, value in (response.headers or {}).items()}
+    retry_after = headers.get("retry-after", 1)
+    if isinstance(retry_after, list):
+        retry_after = retry_after[0]
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return 1.0
+
+def slack_backoff(method, bucket, e, attempt):
+    """Decide o que fazer com o SlackApiError de uma tentativa: retorna quantos segundos esperar antes
+    de repetir (0 quando o Retry-After foi aplicado ao balde) ou None se o erro deve subir"""
+    metrics.inc("livia_slack_api_erros_total", metodo=method, erro=e.response.get("error", "desconhecido"))
+    retry_after = slack_retry_after(e)
+    if retry_after is None or attempt == RATE_LIMIT_RETRIES:
+        return None
+    if bucket:
+        bucket.penalize(retry_after)
+        return 0
+    return retry_after
+
+def slack_call(method, acquired=False, **kwargs):
+    """Chama um método da Web API do Slack respeitando o balde do seu tier e o Retry-After dos 429
+    (acquired: o chamador já descontou o token da primeira tentativa com try_acquire)"""
+    bucket = slack_buckets.get(method)
+    api_method = getattr(app.client, method.replace(".", "_"))
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        if bucket and not (acquired and attempt == 0):
+            bucket.acquire()
+        started_at = time.perf_counter()
+        try:
+            return api_method(**kwargs)
+        except SlackApiError as e:
+            wait = slack_backoff(method, bucket, e, attempt)
+            if wait is None:
+                raise
+            if wait:
+                time.sleep(wait)
+        finally:
+            metrics.observe("livia_slack_api_segundos", time.perf_counter() - started_at, metodo=method)
+
+async def slack_call_async(method, acquired=False, **kwargs):
+    """Versão assíncrona de slack_call (AsyncWebClient)"""
+    bucket = slack_buckets.get(method)
+    api_method = getattr(async_app.client, method.replace(".", "_"))
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        if bucket and not (acquired and attempt == 0):
+            await bucket.acquire_async()
+        started_at = time.perf_counter()
+        try:
+            return await api_method(**kwargs)
+        except SlackApiError as e:
+            wait = slack_backoff(method, bucket, e, attempt)
+            if wait is None:
+                raise
+            if wait:
+                await asyncio.sleep(wait)
+        finally:
+            metrics.observe("livia_slack_api_segundos", time.perf_counter() - started_at, metodo=method)
+
+def openai_request_tokens(request_payload):
+    # Estimativa de tokens que a OpenAI contabiliza: prompt + máximo de tokens da resposta
+    prompt_tokens = sum(count_tokens(msg["content"]) + 4 for msg in request_payload["messages"])
+    return prompt_tokens + request_payload.get("max_completion_tokens", 0)
+
+def openai_retry_after(e):
+    # Segundos de espera de um 429 de limite de taxa da OpenAI (cota esgotada não é repetida)
+    if getattr(e, "status_code", None) != 429 or "quota" in str(e).lower():
+        return None
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers.get("retry-after", 1))
+    except (TypeError, ValueError):
+        return 1.0
+
+def openai_backoff(e, attempt):
+    # Aplica o Retry-After de um 429 de taxa aos baldes da OpenAI; retorna False se o erro deve subir
+    retry_after = openai_retry_after(e)
+    if retry_after is None or attempt == RATE_LIMIT_RETRIES:
+        return False
+    openai_request_bucket.penalize(retry_after)
+    openai_token_bucket.penalize(retry_after)
+    return True
+
+def settle_openai_tokens(reserved, usage):
+    # Devolve ao balde de tokens a diferença entre o que foi descontado e o uso real
+    if usage and usage.get("prompt_tokens") is not None and usage.get("completion_tokens") is not None:
+        openai_token_bucket.refund(max(0, reserved - usage["prompt_tokens"] - usage["completion_tokens"]))
+
+def create_completion(request_payload):
+    """Chama chat.completions.create respeitando RPM/TPM; 429 de taxa esperam e tentam de novo.
+    Retorna (resposta, tokens descontados do balde)"""
+    estimate = openai_request_tokens(request_payload)
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        openai_request_bucket.acquire()
+        reserved = openai_token_bucket.acquire(estimate)
+        try:
+            return client.chat.completions.create(**request_payload), reserved
+        except Exception as e:
+            if not openai_backoff(e, attempt):
+                raise
+
+async def create_completion_async(request_payload):
+    """Versão assíncrona de create_completion (AsyncOpenAI)"""
+    estimate = openai_request_tokens(request_payload)
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        await openai_request_bucket.acquire_async()
+        reserved = await openai_token_bucket.acquire_async(estimate)
+        try:
+            return await async_client.chat.completions.create(**request_payload), reserved
+        except Exception as e:
+            if not openai_backoff(e, attempt):
+                raise
+
+class CircuitOpenError(Exception):
+    """Todas as rotas do modelo estão com o circuito aberto"""
+
+class CircuitBreaker:
+    """Circuit breaker simples: abre após falhas seguidas e libera uma tentativa depois do intervalo.
+
+    available() só consulta o estado; allow() consome a tentativa do meio-aberto e deve ser chamado
+    apenas para a rota que será usada.
+    """
+
+    def __init__(self, failures, open_seconds):
+        self.max_failures = failures
+        self.open_seconds = open_seconds
+        self.state = "fechado"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+
+    def available(self):
+        if self.state == "fechado":
+            return True
+        if self.state == "aberto":
+            return time.time() - self.opened_at >= self.open_seconds
+        return not self._trial
+
+    def allow(self):
+        if self.state == "fechado":
+            return True
+        if self.state == "aberto" and time.time() - self.opened_at >= self.open_seconds:
+            self.state = "meio-aberto"
+            self._trial = False
+        if self.state == "meio-aberto" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def release_trial(self):
+        # Devolve a tentativa do meio-aberto quando a chamada não diz nada sobre a saúde da rota
+        self._trial = False
+
+    def success(self):
+        self.state = "fechado"
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.state == "meio-aberto" or self.failures >= self.max_failures:
+            self.state = "aberto"
+            self.opened_at = time.time()
+
+class ModelGateway:
+    """Chamadas ao modelo com retries com jitter, circuit breaker por rota e fallback por latência.
+
+    Uma rota é (modelo, reasoning_effort). A rota pedida é usada enquanto o circuito estiver fechado
+    e o p95 recente estiver abaixo de MODEL_P95_TARGET; caso contrário a chamada cai para esforço
+    "low" e depois para MODEL_FALLBACK.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers = {}   # {rota: CircuitBreaker}
+        self._latencies = {}  # {rota: deque de (instante, segundos)}
+        self.stats = {}       # {rota: {"sucessos", "falhas", "fallbacks"}}
+
+    def _route_state(self, route):
+        if route not in self._breakers:
+            self._breakers[route] = CircuitBreaker(BREAKER_FAILURES, BREAKER_OPEN_SECONDS)
+            self._latencies[route] = deque(maxlen=200)
+            self.stats[route] = {"sucessos": 0, "falhas": 0, "fallbacks": 0}
+        return self._breakers[route]
+
+    def p95(self, route):
+        cutoff = time.time() - MODEL_LATENCY_WINDOW
+        with self._lock:
+            samples = sorted(latency for at, latency in self._latencies.get(route, ()) if at >= cutoff)
+        if len(samples) < MODEL_LATENCY_MIN_SAMPLES:
+            return None
+        return samples[math.ceil(0.95 * len(samples)) - 1]  # nearest-rank
+
+    def routes_for(self, model, effort):
+        routes = [(model, effort)]
+        if effort and effort != "low":
+            routes.append((model, "low"))
+        if MODEL_FALLBACK and MODEL_FALLBACK != model:
+            routes.append((MODEL_FALLBACK, None))
+        return routes
+
+    def choose_route(self, model, effort, failed=()):
+        """Escolhe a primeira rota saudável (circuito fechado e p95 dentro da meta),
+        evitando as rotas que já falharam nesta chamada enquanto houver alternativa"""
+        routes = self.routes_for(model, effort)
+        if any(route not in failed for route in routes):
+            routes_to_try = [route for route in routes if route not in failed]
+        else:
+            routes_to_try = routes
+        allowed = []
+        for route in routes_to_try:
+            with self._lock:
+                if not self._route_state(route).available():
+                    continue
+            p95 = self.p95(route)
+            if p95 is None or p95 <= MODEL_P95_TARGET:
+                with self._lock:
+                    # A tentativa do meio-aberto só é consumida pela rota escolhida
+                    if not self._breakers[route].allow():
+                        continue
+                    if route != routes[0]:
+                        self.stats[routes[0]]["fallbacks"] += 1
+                return route
+            allowed.append(route)
+        for route in reversed(allowed):  # todas lentas: usa a mais barata liberada
+            with self._lock:
+                if self._breakers[route].allow():
+                    return route
+        raise CircuitOpenError("modelo indisponível")
+
+    def record(self, route, started_at, ok, transient=True):
+        # Registra o resultado de uma chamada (no streaming, ao fim do stream). Só falhas transitórias
+        # contam para o circuito; erros do pedido (400, cota...) não dizem que a rota está fora do ar
+        elapsed = time.perf_counter() - started_at
+        with self._lock:
+            breaker = self._route_state(route)
+            if ok:
+                breaker.success()
+                self._latencies[route].append((time.time(), elapsed))
+                self.stats[route]["sucessos"] += 1
+            else:
+                self.stats[route]["falhas"] += 1
+                if transient:
+                    breaker.failure()
+                else:
+                    breaker.release_trial()
+
+    def _retry_after_failure(self, route, started_at, e, failed, attempt):
+        # Registra a falha de uma tentativa; só erros transitórios são repetidos, até MODEL_RETRIES vezes
+        retryable = is_retryable_model_error(e)
+        self.record(route, started_at, ok=False, transient=retryable)
+        failed.add(route)
+        return retryable and attempt < MODEL_RETRIES
+
+    def _payload_for(self, request_payload, route):
+        model, effort = route
+        payload = dict(request_payload, model=model, timeout=model_timeout(effort))
+        if effort:
+            payload["reasoning_effort"] = effort
+        else:
+            payload.pop("reasoning_effort", None)
+        return payload
+
+    def complete(self, request_payload, stream=False):
+        """Executa a chamada pela melhor rota; retorna (resposta, tokens reservados, rota).
+        Sem stream o resultado já é registrado; com stream o chamador usa record() ao terminar."""
+        primary = (request_payload["model"], request_payload.get("reasoning_effort"))
+        failed = set()
+        for attempt in range(MODEL_RETRIES + 1):
+            route = self.choose_route(*primary, failed=failed)
+            started_at = time.perf_counter()
+            try:
+                response, reserved = create_completion(self._payload_for(request_payload, route))
+            except Exception as e:
+                if not self._retry_after_failure(route, started_at, e, failed, attempt):
+                    raise
+                time.sleep(retry_backoff(attempt))
+                continue
+            if not stream:
+                self.record(route, started_at, ok=True)
+            return response, reserved, route
+
+    async def complete_async(self, request_payload, stream=False):
+        """Versão assíncrona de complete (AsyncOpenAI)"""
+        primary = (request_payload["model"], request_payload.get("reasoning_effort"))
+        failed = set()
+        for attempt in range(MODEL_RETRIES + 1):
+            route = self.choose_route(*primary, failed=failed)
+            started_at = time.perf_counter()
+            try:
+                response, reserved = await create_completion_async(self._payload_for(request_payload, route))
+            except Exception as e:
+                if not self._retry_after_failure(route, started_at, e, failed, attempt):
+                    raise
+                await asyncio.sleep(retry_backoff(attempt))
+                continue
+            if not stream:
+                self.record(route, started_at, ok=True)
+            return response, reserved, route
+
+    def snapshot(self):
+        # Estado por rota para monitoramento
+        result = {}
+        for route in list(self.stats):
+            with self._lock:
+                stats = dict(self.stats[route])
+                stats["circuito"] = self._breakers[route].state
+            stats["p95"] = self.p95(route)
+            result[route] = stats
+        return result
+
+def is_retryable_model_error(e):
+    # Timeouts, falhas de conexão e erros 5xx da OpenAI são transitórios
+    import openai
+    if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    status_code = getattr(e, "status_code", None)
+    return status_code is not None and status_code >= 500
+
+def retry_backoff(attempt):
+    # Backoff exponencial com jitter completo (máximo de 8 segundos)
+    return random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+
+model_gateway = ModelGateway()
+
+class ThreadHistoryStore:
+    """Histórico das threads por (channel_id, thread_ts), mantido localmente e sincronizado só pelo delta.
+
+    A primeira consulta de uma thread busca todas as páginas de conversations_replies; as seguintes
+    pedem apenas mensagens posteriores à última sincronizada (oldest). Mensagens recebidas e respostas
+    da Livia são acrescentadas localmente. Threads ociosas saem por LRU/TTL.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self._threads = TTLCache(maxsize=maxsize, ttl=ttl)  # {(channel_id, thread_ts): entrada}
+        self._lock = threading.Lock()
+        self.stats = {"buscas_completas": 0, "buscas_delta": 0, "paginas": 0}
+
+    def get(self, channel_id, thread_ts):
+        """Retorna as mensagens da thread em ordem, buscando no Slack apenas o que falta"""
+        key = (channel_id, thread_ts)
+        entry = self._threads.get(key)
+        oldest = entry["synced_ts"] if entry else None
+        fetched = self._fetch_replies(channel_id, thread_ts, oldest)
+
+        with self._lock:
+            if entry is None:
+                entry = {"messages": {}, "synced_ts": None}
+                self.stats["buscas_completas"] += 1
+            else:
+                self.stats["buscas_delta"] += 1
+            for msg in fetched:
+                entry["messages"][msg["ts"]] = msg
+                if entry["synced_ts"] is None or float(msg["ts"]) > float(entry["synced_ts"]):
+                    entry["synced_ts"] = msg["ts"]
+            messages = sorted(entry["messages"].values(), key=lambda m: float(m["ts"]))
+        self._threads.set(key, entry)  # renova o TTL da thread
+        return messages
+
+    def record(self, channel_id, thread_ts, message):
+        """Acrescenta (ou substitui pelo ts) uma mensagem numa thread já em cache"""
+        entry = self._threads.get((channel_id, thread_ts))
+        if entry is None or not message.get("ts"):
+            return
+        with self._lock:
+            entry["messages"][message["ts"]] = message
+
+    def discard(self, channel_id, thread_ts, ts):
+        # Remove uma mensagem apagada (ex.: "aguarde") da thread em cache
+        entry = self._threads.get((channel_id, thread_ts))
+        if entry is None:
+            return
+        with self._lock:
+            entry["messages"].pop(ts, None)
+
+    def _fetch_replies(self, channel_id, thread_ts, oldest=None):
+        messages = []
+        cursor = None
+        while True:
+            kwargs = {"channel": channel_id, "ts": thread_ts, "limit": 200}
+            if oldest:
+                kwargs["oldest"] = oldest
+            if cursor:
+                kwargs["cursor"] = cursor
+            response = slack_call("conversations.replies", **kwargs)
+            with self._lock:
+                self.stats["paginas"] += 1
+            messages.extend(msg for msg in response.get("messages", []) if msg.get("ts"))
+            cursor = response.get("response_metadata", {}).get("next_cursor")
+            if not response.get("has_more") or not cursor:
+                break
+        return messages
+
+thread_store = ThreadHistoryStore(THREAD_CACHE_MAX, THREAD_CACHE_TTL)
+
+class ThreadEligibilityIndex:
+    """Índice das threads em que a Livia participa (respondeu ou foi mencionada na raiz).
+
+    Respostas em thread sem menção são decididas em memória: threads no índice são atendidas e
+    threads criadas depois do índice que não estão nele são ignoradas sem chamadas ao Slack.
+    Só threads anteriores ao índice consultam a mensagem raiz, uma única vez.
+    O índice é salvo em JSON para sobreviver a reinícios.
+    """
+
+    def __init__(self, path, max_age):
+        self.path = path
+        self.max_age = max_age
+        self.created_at = time.time()
+        self._threads = {}  # {"channel_id:thread_ts": última atividade}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+        self._root_checks = TTLCache(maxsize=THREAD_CACHE_MAX, ttl=3600)  # threads antigas já consultadas
+        self.stats = {"dm": 0, "mencao": 0, "thread_indice": 0, "thread_ignorada": 0,
+                      "ignorada": 0, "consultas_api": 0, "chamadas_evitadas": 0}
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            with self._lock:
+                self.created_at = data.get("criado_em", self.created_at)
+                self._threads = data.get("threads", {})
+            self.prune()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"❌ ERRO ao carregar índice de threads: {e}")
+
+    def save(self, force=False):
+        with self._lock:
+            if not self._dirty and not force:
+                return
+            data = {"criado_em": self.created_at, "threads": dict(self._threads)}
+            self._dirty = False
+            self._last_save = time.time()
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"❌ ERRO ao salvar índice de threads: {e}")
+
+    def add(self, channel_id, thread_ts, publish=True):
+        with self._lock:
+            self._threads[f"{channel_id}:{thread_ts}"] = time.time()
+            self._dirty = True
+            save_now = time.time() - self._last_save > 30
+        # Com várias instâncias a participação também vai para o backend compartilhado
+        if publish and claims.shared:
+            claims.put(f"thread:{channel_id}:{thread_ts}", self.max_age)
+        if save_now:
+            self.save()
+
+    def contains(self, channel_id, thread_ts):
+        with self._lock:
+            return f"{channel_id}:{thread_ts}" in self._threads
+
+    def recent_channels(self, limit):
+        # Canais das threads com atividade mais recente, sem repetição
+        with self._lock:
+            keys = sorted(self._threads, key=self._threads.get, reverse=True)
+        channels = []
+        for key in keys:
+            channel_id = key.split(":", 1)[0]
+            if channel_id not in channels:
+                channels.append(channel_id)
+                if len(channels) >= limit:
+                    break
+        return channels
+
+    def prune(self):
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            old = [key for key, seen in self._threads.items() if seen < cutoff]
+            for key in old:
+                del self._threads[key]
+            if old:
+                self._dirty = True
+
+    def count(self, reason, avoided_call=False):
+        with self._lock:
+            self.stats[reason] += 1
+            if avoided_call:
+                self.stats["chamadas_evitadas"] += 1
+
+    def should_reply_in_thread(self, channel_id, thread_ts, bot_user_id):
+        """Decide se uma resposta de thread sem menção deve ser atendida"""
+        if self.contains(channel_id, thread_ts):
+            self.count("thread_indice", avoided_call=True)
+            return True
+        if claims.shared and claims.exists(f"thread:{channel_id}:{thread_ts}"):
+            # Outra instância respondeu nesta thread
+            self.add(channel_id, thread_ts, publish=False)
+            self.count("thread_indice", avoided_call=True)
+            return True
+        if float(thread_ts) >= self.created_at:
+            self.count("thread_ignorada", avoided_call=True)
+            return False
+
+        # Thread anterior ao índice: verifica uma única vez se a raiz mencionou a Livia
+        key = (channel_id, thread_ts)
+        mentioned = self._root_checks.get(key)
+        if mentioned is not None:
+            self.count("thread_indice" if mentioned else "thread_ignorada", avoided_call=True)
+            return mentioned
+        try:
+            thread_history = slack_call("conversations.replies", channel=channel_id, ts=thread_ts, limit=1)
+        except Exception as e:
+            return False
+        self.count("consultas_api")
+        original_message = next((msg for msg in thread_history['messages'] if msg.get("ts") == thread_ts), None)
+        mentioned = bool(original_message and f"<@{bot_user_id}>" in original_message.get("text", ""))
+        self._root_checks.set(key, mentioned)
+        if mentioned:
+            self.add(channel_id, thread_ts)
+        return mentioned
+
+eligibility = ThreadEligibilityIndex(THREAD_INDEX_FILE, THREAD_INDEX_MAX_AGE)
 
 # Prompt da Livia
 system_prompt = """Você é a ℓiⱴia, assistente de IA da agência Live. Voce é inteligente, bem humorada e sagaz.
@@ -69,180 +965,1636 @@ Estilo de resposta:
 
 # Nao fale sobre sua personalidade. Se voce nao tiver o nome do usuario que voce esta falando, nao o chame de [nome] ou algo parecido."""
 
-    # Carrega configurações padrão para todos os canais
+# Valores embutidos; "padrao" e "canais" do arquivo de configuração sobrescrevem chave a chave
+DEFAULT_CHANNEL_SETTINGS = {
+    "prompt": system_prompt,
+    "prompt_extra": "",                 # instruções acrescentadas ao fim do prompt
+    "modelo": "o3-mini",
+    "esforco": "medium",
+    "max_tokens": 4095,
+    "cooldown": MESSAGE_COOLDOWN,
+    "aguarde": ":hourglass_flowing_sand: Aguarde...",
+    "cache_respostas": RESPONSE_CACHE,  # reutiliza respostas de perguntas avulsas repetidas
+    # Política de roteamento
+    "roteamento": MODEL_ROUTING,
+    "modelo_simples": MODEL_FALLBACK,   # "" mantém o modelo do canal com esforço "low"
+    "limite_simples": 80,               # caracteres até os quais a mensagem é considerada simples
+    "limite_complexo": 1500,            # caracteres a partir dos quais a mensagem é complexa
+    "esforco_complexo": "high",
+}
+
+class ChannelSettingsRegistry:
+    """Configuração por canal lida de um arquivo JSON e recarregada quando ele muda (mtime).
+
+    Formato: {"padrao": {...}, "canais": {"nome-do-canal": {...}, "C0123": {...}}}. As chaves do
+    canal (pelo nome e depois pelo ID, que prevalece) sobrescrevem "padrao", que sobrescreve
+    DEFAULT_CHANNEL_SETTINGS. O arquivo é checado no máximo a cada check_interval segundos e as
+    configurações resolvidas ficam em cache por canal até a próxima recarga. Um arquivo inválido
+    é ignorado e a configuração anterior continua valendo.
+    """
+
+    def __init__(self, path, defaults, check_interval):
+        self.path = path
+        self.defaults = defaults
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._config = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._resolved = {}  # {(channel_id, channel_name): configurações}
+        self.stats = {"recargas": 0, "erros": 0}
+
+    def _check(self):
+        now = time.time()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                mtime = None
+            except OSError:
+                return
+            if mtime != self._mtime:
+                self._load(mtime)
+
+    def _load(self, mtime):
+        config = {}
+        if mtime is not None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    config = json.load(f)
+                sections = [config.get("padrao", {})] + list(config.get("canais", {}).values())
+                if not all(isinstance(section, dict) for section in sections):
+                    raise ValueError("'padrao' e cada canal devem ser objetos")
+                unknown = {key for section in sections for key in section} - set(self.defaults)
+                if unknown:
+                    print(f"⚠️ Chaves desconhecidas na configuração dos canais: {', '.join(sorted(unknown))}")
+            except Exception as e:
+                self.stats["erros"] += 1
+                self._mtime = mtime  # só tenta de novo quando o arquivo mudar
+                print(f"❌ ERRO ao carregar configuração dos canais: {e}")
+                return
+            print(f"⚙️ Configuração dos canais carregada: {len(config.get('canais', {}))} canais")
+        self._config = config
+        self._mtime = mtime
+        self._resolved = {}
+        self.stats["recargas"] += 1
+
+    def settings_for(self, channel_id, channel_name=None):
+        """Configurações efetivas do canal (dict compartilhado: não alterar)"""
+        self._check()
+        key = (channel_id, channel_name)
+        settings = self._resolved.get(key)
+        if settings is None:
+            with self._lock:
+                channels = self._config.get("canais", {})
+                settings = dict(self.defaults)
+                settings.update(self._config.get("padrao", {}))
+                if channel_name:
+                    settings.update(channels.get(channel_name, {}))
+                settings.update(channels.get(channel_id, {}))
+                if settings["prompt_extra"]:
+                    settings["prompt"] = settings["prompt"] + "\n\n" + settings["prompt_extra"]
+                if len(self._resolved) >= DIRECTORY_CACHE_MAX:
+                    self._resolved.clear()
+                self._resolved[key] = settings
+        return settings
+
+channel_settings = ChannelSettingsRegistry(CHANNEL_CONFIG_FILE, DEFAULT_CHANNEL_SETTINGS, CHANNEL_CONFIG_RELOAD)
+
+    # Carrega as configurações do canal (arquivo de configuração sobre os valores padrão)
 def load_channel_settings(channel_name, channel_id):
-    system_prompt_config = system_prompt
-    please_wait_message = ":hourglass_flowing_sand: Aguarde..."
-    return system_prompt_config, please_wait_message
+    return channel_settings.settings_for(channel_id, channel_name)
+
+# Pedidos que pedem raciocínio mais elaborado (blocos de código, análises, comparações, planejamento...).
+# Palavras comuns em perguntas simples ("explique", "calcule", "código") não entram
+COMPLEX_PROMPT_PATTERN = re.compile(
+    r"```|\b(analis|anális|compar|estrat[eé]g|planej|passo a passo|refator|demonstr)", re.IGNORECASE)
+
+def route_model(text, settings, in_thread=False):
+    """Política de roteamento: retorna (rota, modelo, esforço, max_tokens).
+
+    Mensagens curtas e sem sinais de complexidade vão para o modelo rápido (em threads, onde a
+    resposta depende do contexto, ficam no modelo do canal com esforço "low"); mensagens longas
+    ou com código/pedidos de análise usam o esforço alto. O resto segue a configuração do canal.
+    Mensagens acima de LONG_INPUT_TOKENS seguem para o modo em partes ("longo"), com a configuração
+    do canal na chamada final.
+    """
+    model, effort, max_tokens = settings["modelo"], settings["esforco"], settings["max_tokens"]
+    if is_long_input(text):
+        return "longo", model, effort, max_tokens
+    if not settings["roteamento"]:
+        return "padrao", model, effort, max_tokens
+    text = text.strip()
+    if len(text) >= settings["limite_complexo"] or COMPLEX_PROMPT_PATTERN.search(text):
+        return "complexo", model, settings["esforco_complexo"], max_tokens
+    if len(text) <= settings["limite_simples"]:
+        if settings["modelo_simples"] and not in_thread:
+            return "simples", settings["modelo_simples"], None, max_tokens
+        return "simples", model, "low", max_tokens
+    return "padrao", model, effort, max_tokens
+
+ROUTE_PROMPT_TYPES = {"simples": "Simples", "padrao": "Padrão", "complexo": "Complexo", "longo": "Longo"}
+
+class ResponseCache:
+    """Respostas de perguntas avulsas (fora de threads), com TTL e despejo LRU em memória.
+
+    A chave é o hash do texto normalizado (sem menções, espaços e maiúsculas/minúsculas) com o
+    prompt de sistema, o modelo e o esforço. Com path, as respostas também são gravadas num SQLite
+    local, consultado quando a memória não tem a chave, e sobrevivem a reinícios.
+    """
+
+    def __init__(self, maxsize, ttl, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        self.stats = {"hits": 0, "misses": 0, "hits_disco": 0, "gravadas": 0, "erros": 0}
+
+    @staticmethod
+    def key(text, system_prompt, model, reasoning_effort):
+        normalized = " ".join(re.sub(r'<@\w+>', '', text).split()).casefold()
+        raw = "\0".join((normalized, system_prompt, model, reasoning_effort or ""))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS respostas (chave TEXT PRIMARY KEY, resposta TEXT NOT NULL,"
+                               " criado_em REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_respostas_criado_em ON respostas (criado_em)")
+        return self._conn
+
+    def get(self, key):
+        """Resposta guardada para a chave, ou None"""
+        response = self.memory.get(key)
+        if response is None and self.path:
+            try:
+                with self._lock:
+                    row = self._connection().execute("SELECT resposta, criado_em FROM respostas WHERE chave = ? AND criado_em > ?",
+                                                     (key, time.time() - self.ttl)).fetchone()
+            except sqlite3.Error as e:
+                row = None
+                self.stats["erros"] += 1
+            if row:
+                response = row[0]
+                self.memory.set(key, response, ttl=row[1] + self.ttl - time.time())
+                self.stats["hits_disco"] += 1
+        self.stats["hits" if response is not None else "misses"] += 1
+        return response
+
+    def set(self, key, response):
+        self.memory.set(key, response)
+        self.stats["gravadas"] += 1
+        if not self.path:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute("INSERT OR REPLACE INTO respostas (chave, resposta, criado_em) VALUES (?, ?, ?)",
+                             (key, response, now))
+                self._writes += 1
+                if self._writes % 100 == 0:
+                    # Remove as vencidas e mantém só as maxsize mais recentes
+                    conn.execute("DELETE FROM respostas WHERE criado_em <= ?", (now - self.ttl,))
+                    conn.execute("DELETE FROM respostas WHERE chave NOT IN"
+                                 " (SELECT chave FROM respostas ORDER BY criado_em DESC LIMIT ?)", (self.maxsize,))
+        except sqlite3.Error as e:
+            self.stats["erros"] += 1
+
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX, RESPONSE_CACHE_TTL, RESPONSE_CACHE_FILE or None)
+
+def response_cache_key(text, settings, system_prompt, model, reasoning_effort, thread_ts, ts):
+    # Chave do cache de respostas, ou None quando o canal não usa o cache ou a mensagem está numa thread
+    if not settings["cache_respostas"] or (thread_ts and thread_ts != ts):
+        return None
+    return ResponseCache.key(text, system_prompt, model, reasoning_effort)
+
+def is_cacheable_reply(response, usage):
+    # Só respostas completas: erros voltam sem usage; respostas vazias ou interrompidas ficam de fora
+    return bool(usage) and response != "Desculpe, não consegui gerar uma resposta." and "_(resposta interrompida:" not in response
+
+def record_delivery(channel_id, thread_ts, bot_user_id, delivered):
+    # Acrescenta as partes postadas de uma resposta, [(ts, texto)], ao histórico em cache da thread
+    for reply_ts, part in delivered:
+        if reply_ts and thread_ts:
+            thread_store.record(channel_id, thread_ts, {"user": bot_user_id, "text": part, "ts": reply_ts})
+
+def deliver_cached_reply(channel_id, thread_ts, bot_user_id, response):
+    # Posta uma resposta do cache direto, sem mensagem de "aguarde" nem chamada ao modelo
+    delivered = [(post_message_to_slack(channel_id, part, thread_ts), part)
+                 for part in split_slack_message(limpar_formatacao(response))]
+    record_delivery(channel_id, thread_ts, bot_user_id, delivered)
+
+def refresh_bot_identity():
+    """Consulta auth_test e atualiza a identidade do bot; em caso de falha mantém a anterior"""
+    try:
+        auth_test = slack_call("auth.test")
+        user_id = auth_test["user_id"]
+    except Exception as e:
+        with bot_identity_lock:
+            identity_stats["refresh_falhas"] += 1
+        return False
+
+    with bot_identity_lock:
+        bot_identity["user_id"] = user_id
+        bot_identity["resolvido_em"] = time.time()
+        identity_stats["refresh_ok"] += 1
+    return True
+
+def get_bot_user_id():
+    """Retorna o ID do bot em cache; só chama auth_test se ainda não foi resolvido"""
+    with bot_identity_lock:
+        user_id = bot_identity["user_id"]
+        if user_id:
+            identity_stats["auth_test_evitados"] += 1
+            return user_id
+
+    if refresh_bot_identity():
+        with bot_identity_lock:
+            return bot_identity["user_id"]
+    return None
 
 def remover_asteriscos_duplos(texto):
     return texto.replace('**', '')
 
+def limpar_formatacao(texto):
+    # Limpa formatação da resposta para o mrkdwn do Slack
+    texto = re.sub(r'```[a-zA-Z]+', '```', texto)
+    return remover_asteriscos_duplos(texto)
+
+def split_slack_message(texto, limit=SLACK_MESSAGE_LIMIT):
+    """Divide a resposta em partes que cabem numa mensagem do Slack, preferindo quebras de linha
+    e fechando/reabrindo blocos de código que atravessam a divisão"""
+    parts = []
+    open_fence = False
+    while texto:
+        prefix = "```\n" if open_fence else ""
+        room = limit - len(prefix) - 4  # reserva para fechar um bloco de código aberto
+        if len(texto) <= room:
+            chunk, texto = texto, ""
+        else:
+            cut = texto.rfind("\n", 0, room)
+            if cut < room // 2:
+                cut = room
+            chunk, texto = texto[:cut], texto[cut:].lstrip("\n")
+        if chunk.count("```") % 2:
+            open_fence = not open_fence
+        parts.append(prefix + chunk + ("\n```" if open_fence and texto else ""))
+    return parts
+
+# Tempos por etapa do pipeline de roteamento
+PIPELINE_STAGES = ["normalizacao", "elegibilidade", "admissao", "fila_modelo", "partes", "contexto", "modelo", "entrega"]
+stage_lock = threading.Lock()
+stage_stats = {stage: {"n": 0, "total": 0.0, "max": 0.0} for stage in PIPELINE_STAGES}
+
+def record_stage(stage, seconds):
+    # Acumula a duração de uma etapa do pipeline
+    with stage_lock:
+        stats = stage_stats[stage]
+        stats["n"] += 1
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+    metrics.observe("livia_etapa_segundos", seconds, etapa=stage)
+
+def record_stage_since(stage, started_at):
+    # Registra a etapa iniciada em started_at e retorna o início da próxima
+    now = time.perf_counter()
+    record_stage(stage, now - started_at)
+    return now
+
+class LocalClaims:
+    """Reivindicações em memória: uma única instância (o padrão).
+
+    claim() com reentrant=True também aceita uma reivindicação ainda válida da própria instância
+    (ex.: replay do journal depois de reiniciar com o mesmo LIVIA_INSTANCIA).
+    """
+
+    shared = False
+
+    def __init__(self, owner):
+        self.owner = owner
+        self._lock = threading.Lock()
+        self._claims = {}  # {chave: (dono, expira_em)}
+        self._prune_at = 10000
+        self.stats = {"concedidas": 0, "negadas": 0, "erros": 0}
+
+    def claim(self, key, ttl, reentrant=False):
+        now = time.time()
+        with self._lock:
+            current = self._claims.get(key)
+            if current and current[1] > now and (current[0] != self.owner or not reentrant):
+                self.stats["negadas"] += 1
+                return False
+            self._claims[key] = (self.owner, now + ttl)
+            self.stats["concedidas"] += 1
+            if len(self._claims) > self._prune_at:
+                self._claims = {k: v for k, v in self._claims.items() if v[1] > now}
+                self._prune_at = max(10000, 2 * len(self._claims))
+            return True
+
+    def release(self, key):
+        with self._lock:
+            if self._claims.get(key, (None,))[0] == self.owner:
+                del self._claims[key]
+
+    def put(self, key, ttl):
+        with self._lock:
+            self._claims[key] = (self.owner, time.time() + ttl)
+
+    def exists(self, key):
+        with self._lock:
+            current = self._claims.get(key)
+            return bool(current and current[1] > time.time())
+
+class SharedClaims:
+    """Base dos backends compartilhados entre instâncias (SQLite e Redis).
+
+    Se o backend falhar numa reivindicação, _fail_open() deixa a instância seguir respondendo.
+    """
+
+    shared = True
+
+    def __init__(self, owner):
+        self.owner = owner
+        self._lock = threading.Lock()
+        self.stats = {"concedidas": 0, "negadas": 0, "erros": 0}
+
+    def _fail_open(self, e):
+        # Sem o backend a instância segue respondendo (risco de duplicar em vez de não responder)
+        self.stats["erros"] += 1
+        print(f"❌ ERRO no backend de coordenação ({CLAIM_BACKEND}): {e}")
+        return True
+
+class SQLiteClaims(SharedClaims):
+    """Reivindicações num arquivo SQLite compartilhado por processos do mesmo host.
+
+    claim() é um único UPSERT que só troca o dono se a reivindicação anterior expirou,
+    então a decisão é atômica entre processos.
+    """
+
+    def __init__(self, owner, path):
+        super().__init__(owner)
+        self.path = path
+        self._conn = None
+        self._writes = 0
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+        return self._conn
+
+    def claim(self, key, ttl, reentrant=False):
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                cursor = conn.execute(
+                    "INSERT INTO claims (key, owner, expires_at) VALUES (?, ?, ?)"
+                    " ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at"
+                    " WHERE claims.expires_at <= ? OR (? AND claims.owner = excluded.owner)",
+                    (key, self.owner, now + ttl, now, 1 if reentrant else 0)
+                )
+                claimed = cursor.rowcount == 1
+                self._writes += 1
+                if self._writes % 1000 == 0:
+                    conn.execute("DELETE FROM claims WHERE expires_at < ?", (now,))
+        except sqlite3.Error as e:
+            return self._fail_open(e)
+        self.stats["concedidas" if claimed else "negadas"] += 1
+        return claimed
+
+    def release(self, key):
+        try:
+            with self._lock:
+                self._connection().execute("DELETE FROM claims WHERE key = ? AND owner = ?", (key, self.owner))
+        except sqlite3.Error as e:
+            self.stats["erros"] += 1
+
+    def put(self, key, ttl):
+        try:
+            with self._lock:
+                self._connection().execute("INSERT OR REPLACE INTO claims (key, owner, expires_at) VALUES (?, ?, ?)",
+                                           (key, self.owner, time.time() + ttl))
+        except sqlite3.Error as e:
+            self.stats["erros"] += 1
+
+    def exists(self, key):
+        try:
+            with self._lock:
+                row = self._connection().execute("SELECT 1 FROM claims WHERE key = ? AND expires_at > ?",
+                                                 (key, time.time())).fetchone()
+            return row is not None
+        except sqlite3.Error as e:
+            self.stats["erros"] += 1
+            return False
+
+class RedisClaims(SharedClaims):
+    """Reivindicações num servidor que fala o protocolo do Redis (RESP), via SET NX PX.
+
+    Usa uma única conexão TCP (reaberta em caso de erro); release() só apaga a chave se
+    a instância ainda for a dona, com um script EVAL de comparar-e-apagar.
+    """
+
+    RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, owner, url, prefix="livia:"):
+        super().__init__(owner)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.prefix = prefix
+        self._sock = None
+        self._reader = None
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=2)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", self.db)
+
+    def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("conexão fechada pelo servidor")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RuntimeError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RuntimeError(f"resposta RESP inválida: {line!r}")
+
+    def command(self, *args):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._send(*args)
+                except (OSError, ConnectionError) as e:
+                    self._close()
+                    if attempt:
+                        raise
+
+    def _close(self):
+        try:
+            if self._sock:
+                self._sock.close()
+        except OSError:
+            pass
+        self._sock = None
+        self._reader = None
+
+    def claim(self, key, ttl, reentrant=False):
+        key = self.prefix + key
+        ttl_ms = max(1, int(ttl * 1000))
+        try:
+            claimed = self.command("SET", key, self.owner, "NX", "PX", ttl_ms) == "OK"
+            if not claimed and reentrant and self.command("GET", key) == self.owner:
+                # A própria instância já era a dona: renova o lease
+                claimed = bool(self.command("PEXPIRE", key, ttl_ms))
+        except Exception as e:
+            return self._fail_open(e)
+        self.stats["concedidas" if claimed else "negadas"] += 1
+        return claimed
+
+    def release(self, key):
+        try:
+            self.command("EVAL", self.RELEASE_SCRIPT, 1, self.prefix + key, self.owner)
+        except Exception as e:
+            self.stats["erros"] += 1
+
+    def put(self, key, ttl):
+        try:
+            self.command("SET", self.prefix + key, self.owner, "PX", max(1, int(ttl * 1000)))
+        except Exception as e:
+            self.stats["erros"] += 1
+
+    def exists(self, key):
+        try:
+            return bool(self.command("EXISTS", self.prefix + key))
+        except Exception as e:
+            self.stats["erros"] += 1
+            return False
+
+def create_claims_backend():
+    # Backend de coordenação entre instâncias (nenhuma conexão é aberta aqui)
+    if CLAIM_BACKEND == "sqlite":
+        return SQLiteClaims(INSTANCE_ID, CLAIM_SQLITE_FILE)
+    if CLAIM_BACKEND == "redis":
+        return RedisClaims(INSTANCE_ID, CLAIM_REDIS_URL)
+    return LocalClaims(INSTANCE_ID)
+
+claims = create_claims_backend()
+
+class AdmissionControl:
+    """Controle de admissão de mensagens com custo O(1) amortizado por decisão.
+
+    - Dedup exato: chaves das mensagens em processamento (ordenadas por admissão para expirar).
+    - Cooldown: último horário admitido por (usuário, canal, thread), também ordenado por tempo.
+      O cooldown pode variar por canal; as entradas expiram pelo maior cooldown já usado.
+    A expiração remove apenas entradas vencidas do início de cada OrderedDict.
+    Com um backend de coordenação compartilhado, a mensagem e o cooldown também são reivindicados
+    nele (com lease de max_age), para que só uma instância responda.
+    """
+
+    def __init__(self, cooldown, max_age, claims):
+        self.cooldown = cooldown
+        self._cooldown_horizon = cooldown  # maior cooldown já usado (expiração de _last_admit)
+        self.max_age = max_age
+        self.claims = claims
+        self._lock = threading.Lock()
+        self._in_flight = OrderedDict()  # {message_key: admitida_em}
+        self._last_admit = OrderedDict()  # {(user_id, channel_id, thread): admitida_em}
+        self.stats = {"admitidas": 0, "duplicadas": 0, "cooldown": 0, "expiradas": 0, "outra_instancia": 0}
+
+    def admit(self, user_id, channel_id, thread_ts, ts, cooldown=None):
+        """Retorna a chave da mensagem se ela pode ser processada, ou None (duplicada / em cooldown).
+        cooldown sobrescreve o padrão (configuração do canal)"""
+        cooldown = self.cooldown if cooldown is None else cooldown
+        message_key = (user_id, channel_id, ts, thread_ts or 'main')
+        cooldown_key = (user_id, channel_id, thread_ts or 'main')
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if message_key in self._in_flight:
+                self.stats["duplicadas"] += 1
+                return None
+            last = self._last_admit.get(cooldown_key)
+            self._cooldown_horizon = max(self._cooldown_horizon, cooldown)
+            if last is not None and now - last < cooldown:
+                self.stats["cooldown"] += 1
+                return None
+            self._in_flight[message_key] = now
+            self._last_admit[cooldown_key] = now
+            self._last_admit.move_to_end(cooldown_key)
+        
+        # Reivindicação entre instâncias, fora do lock (é uma chamada de rede)
+        if self.claims.shared:
+            rejected = None
+            # Reentrantes: dentro da instância a duplicidade e o cooldown já foram checados acima
+            if not self.claims.claim(self._claim_key("msg", message_key), self.max_age, reentrant=True):
+                rejected = "duplicadas"
+            elif cooldown and not self.claims.claim(self._claim_key("cooldown", cooldown_key), cooldown,
+                                                    reentrant=True):
+                self.claims.release(self._claim_key("msg", message_key))
+                rejected = "cooldown"
+            if rejected:
+                with self._lock:
+                    self._in_flight.pop(message_key, None)
+                    self.stats[rejected] += 1
+                    self.stats["outra_instancia"] += 1
+                return None
+        with self._lock:
+            self.stats["admitidas"] += 1
+        return message_key
+
+    def release(self, message_key):
+        with self._lock:
+            self._in_flight.pop(message_key, None)
+        if self.claims.shared:
+            self.claims.release(self._claim_key("msg", message_key))
+
+    @staticmethod
+    def _claim_key(kind, key):
+        return kind + ":" + ":".join(str(part) for part in key)
+
+    def expire(self):
+        """Remove mensagens em processamento há mais de max_age; retorna quantas saíram"""
+        with self._lock:
+            return self._expire(time.time())
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    def _expire(self, now):
+        expired = 0
+        while self._in_flight:
+            key, admitted_at = next(iter(self._in_flight.items()))
+            if now - admitted_at <= self.max_age:
+                break
+            self._in_flight.popitem(last=False)
+            expired += 1
+        while self._last_admit:
+            key, admitted_at = next(iter(self._last_admit.items()))
+            if now - admitted_at < self._cooldown_horizon:
+                break
+            self._last_admit.popitem(last=False)
+        self.stats["expiradas"] += expired
+        return expired
+
+admission = AdmissionControl(MESSAGE_COOLDOWN, PROCESSING_MAX_AGE, claims)
+
+class EventJournal:
+    """Journal de eventos do Slack em SQLite (WAL), com dedup por event_id.
+
+    append() só enfileira; um único thread escritor grava em lotes (tudo o que estiver na fila
+    vai na mesma transação) e entrega cada evento novo a `dispatch` depois do commit.
+    O status de cada evento é atualizado pelo mark() conforme avança no pipeline; ao iniciar,
+    eventos que ficaram sem resposta dentro da janela de replay são devolvidos por replay().
+    """
+
+    PENDING = ("recebido", "respondendo")
+
+    def __init__(self, path, replay_window, retention, batch_rows):
+        self.path = path
+        self.replay_window = replay_window
+        self.retention = retention
+        self.batch_rows = max(1, batch_rows)
+        self.running = False
+        self._dispatch = None
+        self._conn = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._seen = TTLCache(maxsize=100000, ttl=max(replay_window, EVENT_MAX_AGE) + 600)  # event_ids recentes
+        self._replay = []
+        self._last_prune = 0.0
+        self.stats = {"gravados": 0, "duplicados": 0, "atualizacoes": 0, "lotes": 0, "reprocessados": 0,
+                      "expirados": 0, "erros": 0}
+
+    def start(self, dispatch):
+        """Abre o banco, separa os eventos pendentes para replay e inicia o escritor"""
+        if not self.path:
+            return False
+        try:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS eventos ("
+                " event_id TEXT PRIMARY KEY, received_at REAL NOT NULL, status TEXT NOT NULL,"
+                " updated_at REAL NOT NULL, body TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS eventos_status ON eventos (status, received_at)")
+            self._load()
+        except sqlite3.Error as e:
+            print(f"❌ ERRO ao abrir journal de eventos {self.path}: {e}")
+            self._conn = None
+            return False
+        self._dispatch = dispatch
+        self.running = True
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+
+    def _load(self):
+        now = time.time()
+        window_start = now - self.replay_window
+        for (event_id,) in self._conn.execute("SELECT event_id FROM eventos WHERE received_at >= ?",
+                                              (window_start - 600,)):
+            self._seen.set(event_id, True)
+        placeholders = ",".join("?" * len(self.PENDING))
+        rows = self._conn.execute(
+            f"SELECT event_id, received_at, body FROM eventos WHERE status IN ({placeholders}) ORDER BY received_at, rowid",
+            self.PENDING
+        ).fetchall()
+        expired = []
+        for event_id, received_at, body in rows:
+            if received_at >= window_start:
+                self._replay.append(json.loads(body))
+            else:
+                expired.append(("expirado", now, event_id))
+        if expired:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("UPDATE eventos SET status = ?, updated_at = ? WHERE event_id = ?", expired)
+            self._conn.execute("COMMIT")
+            self.stats["expirados"] += len(expired)
+        self._prune(now)
+
+    def replay(self):
+        """Retorna (uma única vez) os eventos sem resposta dentro da janela, em ordem de chegada"""
+        events, self._replay = self._replay, []
+        for body in events:
+            body["livia_replay"] = True
+        self.stats["reprocessados"] += len(events)
+        return events
+
+    def append(self, body):
+        """Registra um evento confirmado; retorna False se o event_id já foi visto"""
+        event_id = body.get("event_id")
+        if not event_id:
+            self._dispatch(body)
+            return True
+        if self._seen.get(event_id):
+            self.stats["duplicados"] += 1
+            return False
+        self._seen.set(event_id, True)
+        body["livia_journal"] = True
+        self._queue.put(("evento", event_id, body, body.get("livia_recebido_em") or time.time()))
+        return True
+
+    def mark(self, event_id, status):
+        if self.running and event_id:
+            self._queue.put(("status", event_id, status, time.time()))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stop(self, timeout=10):
+        if self._thread and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+        self.running = False
+        if self._conn:
+            try:
+                self._conn.close()
+            except sqlite3.Error as e:
+                pass
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=60)
+            except queue.Empty:
+                self._prune(time.time())
+                continue
+            batch = [item]
+            while item is not None and len(batch) < self.batch_rows:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            stop = batch[-1] is None
+            self._write([entry for entry in batch if entry is not None])
+            if stop:
+                break
+            if time.time() - self._last_prune > 3600:
+                self._prune(time.time())
+
+    def _write(self, batch):
+        if not batch:
+            return
+        inserts = [entry for entry in batch if entry[0] == "evento"]
+        updates = [(status, at, event_id) for kind, event_id, status, at in batch if kind == "status"]
+        new_events = []
+        try:
+            self._conn.execute("BEGIN")
+            for _, event_id, body, received_at in inserts:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO eventos (event_id, received_at, status, updated_at, body)"
+                    " VALUES (?, ?, 'recebido', ?, ?)",
+                    (event_id, received_at, received_at, json.dumps(body, ensure_ascii=False))
+                )
+                if cursor.rowcount:
+                    new_events.append(body)
+                else:
+                    self.stats["duplicados"] += 1
+            if updates:
+                self._conn.executemany("UPDATE eventos SET status = ?, updated_at = ? WHERE event_id = ?", updates)
+            self._conn.execute("COMMIT")
+            self.stats["gravados"] += len(new_events)
+            self.stats["atualizacoes"] += len(updates)
+            self.stats["lotes"] += 1
+        except sqlite3.Error as e:
+            # Sem o journal os eventos seguem direto para a fila, para não serem perdidos
+            self.stats["erros"] += 1
+            print(f"❌ ERRO ao gravar journal de eventos: {e}")
+            try:
+                self._conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            new_events = [body for _, _, body, _ in inserts]
+        for body in new_events:
+            try:
+                self._dispatch(body)
+            except Exception as e:
+                metrics.inc("livia_erros_total", local="journal", tipo=type(e).__name__)
+
+    def _prune(self, now):
+        self._last_prune = now
+        try:
+            self._conn.execute("DELETE FROM eventos WHERE received_at < ?", (now - self.retention,))
+        except sqlite3.Error as e:
+            self.stats["erros"] += 1
+
+event_journal = EventJournal(EVENT_JOURNAL_FILE, EVENT_REPLAY_WINDOW, EVENT_JOURNAL_RETENTION, EVENT_JOURNAL_BATCH)
+
+event_stats = {"expirados": 0}  # eventos descartados por idade
+
+def event_is_stale(body):
+    # Eventos gravados no journal podem esperar na fila (ou um reinício) até a janela de replay
+    max_age = max(EVENT_MAX_AGE, EVENT_REPLAY_WINDOW) if body.get("livia_journal") else EVENT_MAX_AGE
+    if time.time() - float(body["event"].get("ts", 0)) > max_age:
+        event_stats["expirados"] += 1
+        return True
+    return False
+
+def channel_cooldown(channel_id):
+    # Cooldown do canal para a admissão (ainda sem consultar o nome: usa o nome em cache, se houver)
+    return load_channel_settings(channel_name_cache.get(channel_id), channel_id)["cooldown"]
+
+def plan_reply(text, user_id, channel_id, thread_ts, ts, channel_name):
+    """Decisões de uma resposta que não dependem de I/O, compartilhadas pelos dois modos: texto sem
+    menções, configuração do canal, rota do modelo e chave do cache de respostas.
+
+    Também registra a mensagem recebida no log e no histórico em cache da thread.
+    """
+    settings = load_channel_settings(channel_name, channel_id)
+    clean_text = re.sub(r'<@\w+>', '', text)
+    route, model, reasoning_effort, max_tokens = route_model(clean_text, settings, in_thread=is_thread_reply(thread_ts, ts))
+    metrics.inc("livia_roteamento_total", rota=route, modelo=model)
+
+    # Log da mensagem recebida
+    timestamp = datetime.now().strftime('%H:%M:%S - %d/%m/%y')
+    print(f"⬇️ {timestamp} - Mensagem recebida de: {user_id} - Canal: {channel_id}")
+
+    # Acrescenta a mensagem recebida ao histórico em cache da thread
+    if thread_ts:
+        thread_store.record(channel_id, thread_ts, {"user": user_id, "text": text, "ts": ts})
+
+    return {
+        "text": clean_text,
+        "system_prompt": settings["prompt"],
+        "please_wait_message": settings["aguarde"],
+        "route": route,
+        "model": model,
+        "prompt_type": ROUTE_PROMPT_TYPES[route],
+        "model_options": {"model": model, "max_completion_tokens": max_tokens, "reasoning_effort": reasoning_effort},
+        "cache_key": response_cache_key(clean_text, settings, settings["prompt"], model, reasoning_effort, thread_ts, ts),
+    }
+
+def log_reply_sent(user_id, channel_id, cached=False):
+    timestamp = datetime.now().strftime('%H:%M:%S - %d/%m/%y')
+    print(f"⬆️ {timestamp} - Mensagem enviada{' (cache)' if cached else ''} para: {user_id} - Canal: {channel_id}")
+
     # Função principal que processa mensagens e gera respostas da Livia
-def ask_chatgpt(text, user_id, channel_id, thread_ts=None, ts=None):
-    # Cria chave única para a mensagem usando timestamp específico
-    message_key = f"{user_id}_{channel_id}_{ts}_{thread_ts or 'main'}"
+def ask_chatgpt(text, user_id, channel_id, thread_ts=None, ts=None, event_id=None):
     current_time_float = time.time()
     
-    # Controle de concorrência thread-safe
-    with processing_lock:
-        # Verifica se já está processando esta mensagem específica
-        if message_key in processing_messages:
-            return
-            
-        # Verifica cooldown apenas para mensagens do mesmo usuário no mesmo canal/thread
-        cooldown_key = f"{user_id}_{channel_id}_{thread_ts or 'main'}"
-        for key, timestamp in list(processing_messages.items()):
-            if key.startswith(cooldown_key) and current_time_float - timestamp < message_cooldown:
-                return
-                
-        # Marca mensagem como em processamento
-        processing_messages[message_key] = current_time_float
-    
-    # Verifica conectividade com Slack fora do lock
-    try:
-        auth_test = app.client.auth_test()
-        bot_user_id = auth_test["user_id"]
-    except Exception as e:
-        with processing_lock:
-            if message_key in processing_messages:
-                del processing_messages[message_key]
+    # Etapa de admissão: evita respostas duplicadas e aplica cooldown por usuário/canal/thread
+    stage_start = time.perf_counter()
+    message_key = admission.admit(user_id, channel_id, thread_ts, ts, channel_cooldown(channel_id))
+    record_stage("admissao", time.perf_counter() - stage_start)
+    if message_key is None:
+        event_journal.mark(event_id, "ignorado")
         return
     
-    # Remove menções do texto
-    text = re.sub(r'<@\w+>', '', text)
+    # Obtém a identidade do bot (em cache)
+    bot_user_id = get_bot_user_id()
+    if not bot_user_id:
+        admission.release(message_key)
+        event_journal.mark(event_id, "erro")
+        return
+    event_journal.mark(event_id, "respondendo")
     
-    # Busca histórico da conversa se for uma thread (e thread_ts for diferente de ts)
-    messages = []
-    if thread_ts and thread_ts != ts:
-        messages = fetch_conversation_history(channel_id, thread_ts)
+    # Registra a participação da Livia na thread (DMs não precisam do índice)
+    if not channel_id.startswith("D"):
+        eligibility.add(channel_id, thread_ts or ts)
     
     # Obtém informações do usuário e canal
     user_name, channel_name = determine_channel_and_user_names(channel_id, user_id)
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    # Carrega configurações do canal
-    system_prompt, please_wait_message = load_channel_settings(channel_name, channel_id)
-    prompt_type = "Padrão"
-
-    # Log da mensagem recebida
-    timestamp = datetime.now().strftime('%H:%M:%S - %d/%m/%y')
-    print(f"⬇️ {timestamp} - Mensagem recebida de: {user_id} - Canal: {channel_id}")
-
-    # Registra uso no CSV
-    registro_uso(user_id, user_name, channel_name, current_time, prompt_type)
-
-    # Prepara histórico da conversa
-    bot_user_id = app.client.auth_test()["user_id"]
-    conversation_history = construct_conversation_history(messages, bot_user_id, user_id, text, thread_ts, ts)
+    # Configuração do canal, modelo/esforço e chave do cache para a mensagem
+    plan = plan_reply(text, user_id, channel_id, thread_ts, ts, channel_name)
+    
+    # Pergunta avulsa repetida: responde do cache de respostas
+    cache_key = plan["cache_key"]
+    cached_response = response_cache.get(cache_key) if cache_key else None
+    if cached_response:
+        deliver_cached_reply(channel_id, thread_ts, bot_user_id, cached_response)
+        log_reply_sent(user_id, channel_id, cached=True)
+        registro_uso(user_id, user_name, channel_name, current_time, "Cache", int((time.time() - current_time_float) * 1000))
+        event_journal.mark(event_id, "respondido")
+        admission.release(message_key)
+        return
     
     # Posta mensagem de "aguarde"
-    status_message_ts = post_message_to_slack(channel_id, please_wait_message, thread_ts)
+    status_message_ts = post_message_to_slack(channel_id, plan["please_wait_message"], thread_ts)
+    
+    def release():
+        # Remove da lista de processamento
+        admission.release(message_key)
     
-    # Execução em thread separada para não travar o bot
+    # Executado no pool de chamadas ao modelo, em ordem dentro de cada thread do Slack
+    submitted_at = time.perf_counter()
     def worker():
+        placeholder_reused = False
+        usage = None
+        part_usage = None
+        stage_start = time.perf_counter()
+        record_stage("fila_modelo", stage_start - submitted_at)
         try:
-            # Gera resposta da IA
-            response, _ = gpt(conversation_history, system_prompt, model="o3-mini" , max_completion_tokens=4095) ### <-- ALTERAR MODELO
+            # Mensagem longa: partes processadas em paralelo, com progresso na mensagem de "aguarde";
+            # se nenhuma parte der certo segue com a mensagem original (truncada pela janela de contexto)
+            reduced_text = None
+            if plan["route"] == "longo":
+                reduced_text, part_usage = map_long_input(plan["text"], plan["model"], ProgressReporter(channel_id, status_message_ts))
+                stage_start = record_stage_since("partes", stage_start)
             
-            # Limpa formatação da resposta
-            response = re.sub(r'```[a-zA-Z]+', '```', response)
-            response = remover_asteriscos_duplos(response)
+            # Etapa de contexto: busca histórico da conversa se for uma resposta em thread;
+            # feito aqui para incluir as respostas anteriores da mesma thread
+            messages = fetch_conversation_history(channel_id, thread_ts) if is_thread_reply(thread_ts, ts) else []
+            conversation_history = assemble_conversation(messages, plan, user_id, bot_user_id, thread_ts, ts, reduced_text)
+            conversation_history = build_context_window(conversation_history, plan["system_prompt"], (channel_id, thread_ts))
+            stage_start = record_stage_since("contexto", stage_start)
+            
+            # Etapas de modelo e entrega (no streaming a entrega parcial acontece durante a geração)
+            if STREAMING:
+                # Gera resposta em streaming, editando a mensagem de "aguarde" no lugar
+                writer = SlackStreamWriter(channel_id, thread_ts, status_message_ts)
+                placeholder_reused = status_message_ts is not None
+                response, usage = gpt_stream(conversation_history, plan["system_prompt"], writer.feed, **plan["model_options"])
+                stage_start = record_stage_since("modelo", stage_start)
+                writer.finish(response)
+                delivered = zip(writer.message_ts, writer.sent)
+            else:
+                # Gera resposta da IA
+                response, usage = gpt(conversation_history, plan["system_prompt"], **plan["model_options"])
+                stage_start = record_stage_since("modelo", stage_start)
+                
+                # Posta resposta no Slack (dividida se passar do limite de uma mensagem)
+                delivered = [(post_message_to_slack(channel_id, part, thread_ts), part)
+                             for part in split_slack_message(limpar_formatacao(response))]
             
-            # Posta resposta no Slack
-            post_message_to_slack(channel_id, response, thread_ts)
+            # Acrescenta a resposta ao histórico em cache da thread
+            record_delivery(channel_id, thread_ts, bot_user_id, delivered)
+            record_stage_since("entrega", stage_start)
+            if cache_key and is_cacheable_reply(response, usage):
+                response_cache.set(cache_key, response)
             
             # Log da mensagem enviada
-            timestamp = datetime.now().strftime('%H:%M:%S - %d/%m/%y')
-            print(f"⬆️ {timestamp} - Mensagem enviada para: {user_id} - Canal: {channel_id}")
+            log_reply_sent(user_id, channel_id)
+            record_first_reply(time.time() - current_time_float)
         except Exception as e:
-            pass
+            metrics.inc("livia_erros_total", local="resposta", tipo=type(e).__name__)
         finally:
-            # Remove mensagem de "aguarde"
-            if status_message_ts:
+            # Remove mensagem de "aguarde" (no streaming ela virou a própria resposta)
+            if status_message_ts and not placeholder_reused:
                 delete_message_from_slack(channel_id, status_message_ts)
-                
-            # Remove da lista de processamento
-            with processing_lock:
-                if message_key in processing_messages:
-                    del processing_messages[message_key]
-                
-                # Limpa mensagens antigas do processamento (> 5 minutos)
-                current_time = time.time()
-                old_keys = [key for key, timestamp in processing_messages.items() 
-                           if current_time - timestamp > 300]
-                for old_key in old_keys:
-                    del processing_messages[old_key]
+                thread_store.discard(channel_id, thread_ts, status_message_ts)
+            
+            # Registra uso no CSV com latência e tokens da resposta (incluindo as partes de mensagens longas)
+            latency_ms = int((time.time() - current_time_float) * 1000)
+            registro_uso(user_id, user_name, channel_name, current_time, plan["prompt_type"], latency_ms, add_usage(usage, part_usage))
+            event_journal.mark(event_id, "respondido")
+            release()
     
-    # Inicia a thread
-    threading.Thread(target=worker).start()
+    # Enfileira no pool; se estiver cheio, responde que está ocupada
+    if not dispatcher.submit_reply((channel_id, thread_ts or ts), worker):
+        if status_message_ts:
+            delete_message_from_slack(channel_id, status_message_ts)
+        post_message_to_slack(channel_id, BUSY_MESSAGE, thread_ts, max_retries=1)
+        registro_uso(user_id, user_name, channel_name, current_time, "Ocupada")
+        event_journal.mark(event_id, "ocupada")
+        release()
 
 
-    # Registra uso no CSV
-def registro_uso(user_id, user_name, channel_name, current_time, prompt_type):
-    fieldnames = ['user_id', 'user_name', 'channel_name', 'timestamp', 'prompt_type']
-    try:
-        with open('registro_uso.csv', 'a', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            if csvfile.tell() == 0:
-                writer.writeheader()
-            writer.writerow({
-                'user_id': user_id,
-                'user_name': user_name,
-                'channel_name': channel_name,
-                'timestamp': current_time,
-                'prompt_type': prompt_type
-            })
-    except Exception as e:
-        pass
+class UsageLogger:
+    """Grava o registro de uso em lotes a partir de uma fila, num único thread escritor.
 
-    # Chama a API da OpenAI para gerar resposta
-def gpt(conversation_history, system_prompt, model="o3-mini", max_completion_tokens=4095):
+    Grava quando o lote atinge USAGE_FLUSH_ROWS linhas ou a cada USAGE_FLUSH_INTERVAL segundos,
+    rotaciona o arquivo ao passar de USAGE_ROTATE_BYTES e descarrega tudo ao encerrar.
+    Cada lote também vai para a base SQLite de uso_analytics (relatórios com agregados diários).
+    """
+
+    def __init__(self, path, flush_rows, flush_interval, rotate_bytes, db_path=None):
+        self.path = path
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.db_path = db_path
+        self.store = None
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = None
+        self.stats = {"linhas_gravadas": 0, "linhas_descartadas": 0, "lotes": 0, "rotacoes": 0, "erros": 0}
+
+    def start(self):
+        self._rotate_if_old_schema()
+        if self.db_path:
+            try:
+                self.store = UsageStore(self.db_path)
+            except Exception as e:
+                print(f"❌ ERRO ao abrir base de uso {self.db_path}: {e}")
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def log(self, row):
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.stats["linhas_descartadas"] += 1
+
+    def stop(self, timeout=10):
+        if self._thread and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+        if self.store:
+            self.store.close()
+            self.store = None
+
+    def _run(self):
+        batch = []
+        deadline = time.time() + self.flush_interval
+        while True:
+            try:
+                row = self._queue.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                row = False
+            if row is None:  # Sinal para parar
+                self._write(batch)
+                break
+            if row:
+                batch.append(row)
+            if len(batch) >= self.flush_rows or time.time() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.time() + self.flush_interval
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.rotate_bytes:
+                self._rotate()
+            with open(self.path, 'a', newline='', encoding='utf-8') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=USAGE_FIELDS)
+                if csvfile.tell() == 0:
+                    writer.writeheader()
+                writer.writerows(batch)
+            self.stats["linhas_gravadas"] += len(batch)
+            self.stats["lotes"] += 1
+        except Exception as e:
+            self.stats["erros"] += 1
+            print(f"❌ ERRO ao gravar registro de uso: {e}")
+        if self.store:
+            try:
+                self.store.add_rows(batch)
+            except Exception as e:
+                self.stats["erros"] += 1
+                print(f"❌ ERRO ao gravar base de uso: {e}")
+
+    def _rotate(self):
+        base, ext = os.path.splitext(self.path)
+        os.replace(self.path, f"{base}.{datetime.now().strftime('%Y%m%d-%H%M%S')}{ext}")
+        self.stats["rotacoes"] += 1
+
+    def _rotate_if_old_schema(self):
+        # Arquivos com cabeçalho antigo são rotacionados para não misturar colunas
+        try:
+            with open(self.path, newline='', encoding='utf-8') as csvfile:
+                header = next(csv.reader(csvfile), None)
+            if header and header != USAGE_FIELDS:
+                self._rotate()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"❌ ERRO ao verificar registro de uso: {e}")
+
+usage_logger = UsageLogger(USAGE_LOG_FILE, USAGE_FLUSH_ROWS, USAGE_FLUSH_INTERVAL, USAGE_ROTATE_BYTES, USAGE_DB_FILE)
+
+    # Registra uso no CSV (assíncrono, via usage_logger)
+def registro_uso(user_id, user_name, channel_name, current_time, prompt_type, latency_ms=None, usage=None):
+    usage = usage or {}
+    usage_logger.log({
+        'user_id': user_id,
+        'user_name': user_name,
+        'channel_name': channel_name,
+        'timestamp': current_time,
+        'prompt_type': prompt_type,
+        'latency_ms': latency_ms if latency_ms is not None else '',
+        'prompt_tokens': usage.get('prompt_tokens', ''),
+        'completion_tokens': usage.get('completion_tokens', ''),
+        'reasoning_tokens': usage.get('reasoning_tokens', '')
+    })
+
+def usage_to_dict(usage):
+    # Extrai contagem de tokens do objeto usage da OpenAI
+    if not usage:
+        return None
+    details = getattr(usage, "completion_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "reasoning_tokens": getattr(details, "reasoning_tokens", None) if details else None
+    }
+
+    # Monta o payload da chamada à OpenAI
+def build_gpt_payload(conversation_history, system_prompt, model, max_completion_tokens, reasoning_effort="medium"):
     system_message = {
         "role": "system",
         "content": system_prompt
     }
     messages_with_system = [system_message] + conversation_history
     
-    request_payload = {
+    return {
         "model": model,
         "messages": messages_with_system,
         "max_completion_tokens": max_completion_tokens,
-        "reasoning_effort": "medium",
-        "timeout": 30  # Timeout de 30 segundos
+        "reasoning_effort": reasoning_effort,
+        "timeout": model_timeout(reasoning_effort)
     }
-    
+
+def model_timeout(reasoning_effort):
+    # Esforço alto costuma passar de 30 s: o timeout acompanha o esforço da rota
+    return MODEL_TIMEOUTS.get(reasoning_effort, MODEL_TIMEOUT_DEFAULT)
+
+def gpt_error_message(e):
+    # Traduz erros da OpenAI em mensagens para o usuário
+    if isinstance(e, CircuitOpenError):
+        return "Estou com instabilidade para gerar respostas agora. Tente novamente em alguns instantes."
+    elif "timeout" in str(e).lower():
+        return "Desculpe, a resposta demorou muito para ser gerada. Tente novamente."
+    elif "rate_limit" in str(e).lower():
+        return "Muitas solicitações. Aguarde um momento e tente novamente."
+    elif "quota" in str(e).lower() or "billing" in str(e).lower():
+        return "Limite de uso atingido. Entre em contato com o administrador."
+    else:
+        return "Desculpe, houve um erro interno. Tente novamente mais tarde."
+
+    # Conta tokens de um texto (estimativa de ~4 caracteres por token sem tiktoken)
+def count_tokens(text):
+    if token_encoding is not None:
+        return len(token_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+token_encoding = None  # carregado no aquecimento; até lá a contagem é estimada
+
+def load_token_encoding():
+    # tiktoken é opcional: contagem exata de tokens
+    global token_encoding
     try:
-        response = client.chat.completions.create(**request_payload)
-        
-        if response and response.choices and len(response.choices) > 0:
-            content = response.choices[0].message.content
-            if content and content.strip():
-                return content.strip(), None
-            else:
-                return "Desculpe, não consegui gerar uma resposta.", None
-        else:
-            return "Desculpe, houve um problema na comunicação.", None
-            
+        import tiktoken
+        token_encoding = tiktoken.get_encoding("o200k_base")
     except Exception as e:
-        if "timeout" in str(e).lower():
-            return "Desculpe, a resposta demorou muito para ser gerada. Tente novamente.", None
-        elif "rate_limit" in str(e).lower():
-            return "Muitas solicitações. Aguarde um momento e tente novamente.", None
-        elif "quota" in str(e).lower() or "billing" in str(e).lower():
-            return "Limite de uso atingido. Entre em contato com o administrador.", None
+        token_encoding = None
+    return token_encoding
+summary_cache = TTLCache(maxsize=THREAD_CACHE_MAX, ttl=THREAD_CACHE_TTL)  # {(channel_id, thread_ts): resumo}
+
+def build_context_window(conversation_history, system_prompt, thread_key=None, budget=CONTEXT_TOKEN_BUDGET):
+    """Ajusta o histórico ao orçamento de tokens: mantém as mensagens mais recentes e substitui
+    as antigas por um resumo em cache, refeito só quando a thread cresce além do limiar"""
+    available = budget - count_tokens(system_prompt)
+    sizes = [count_tokens(msg["content"]) + 4 for msg in conversation_history]
+    if sum(sizes) <= available:
+        return conversation_history
+
+    # Mantém as mensagens mais novas que cabem (a atual sempre entra)
+    available -= SUMMARY_RESERVE_TOKENS
+    kept = 0
+    used = 0
+    for size in reversed(sizes):
+        if kept and used + size > available:
+            break
+        kept += 1
+        used += size
+    recent = conversation_history[-kept:]
+    older = conversation_history[:-kept]
+
+    # Mensagem atual maior que o orçamento inteiro: corta o excesso
+    if used > available:
+        last = recent[-1]
+        max_chars = max(available, 0) * 4
+        recent = recent[:-1] + [{"role": last["role"], "content": last["content"][:max_chars] + "\n[...mensagem truncada...]"}]
+
+    if not older:
+        return recent
+    summary = rolling_summary(thread_key, older)
+    if not summary:
+        return recent
+    return [{"role": "system", "content": "Resumo das mensagens anteriores desta conversa:\n" + summary}] + recent
+
+def rolling_summary(thread_key, older):
+    # Reaproveita o resumo da thread até que surjam SUMMARY_RECOMPUTE_THRESHOLD mensagens novas fora da janela
+    cached = summary_cache.get(thread_key) if thread_key else None
+    if cached and len(older) - cached["folded"] < SUMMARY_RECOMPUTE_THRESHOLD:
+        return cached["summary"]
+
+    previous = cached["summary"] if cached else ""
+    new_messages = older[cached["folded"]:] if cached else older
+    summary = summarize_messages(previous, new_messages)
+    if summary is None:
+        return previous
+    if thread_key:
+        summary_cache.set(thread_key, {"folded": len(older), "summary": summary})
+    return summary
+
+def summarize_messages(previous_summary, messages):
+    # Gera (ou estende) o resumo das mensagens antigas com esforço de raciocínio baixo
+    lines = []
+    if previous_summary:
+        lines.append("Resumo anterior:\n" + previous_summary + "\n\nNovas mensagens:")
+    for msg in messages:
+        speaker = "Usuário" if msg["role"] == "user" else "Livia"
+        lines.append(f"{speaker}: {msg['content']}")
+    transcript = "\n".join(lines)[:(CONTEXT_TOKEN_BUDGET - SUMMARY_RESERVE_TOKENS) * 4]
+
+    request_payload = build_gpt_payload(
+        [{"role": "user", "content": transcript}],
+        "Resuma a conversa a seguir em português, preservando fatos, decisões, pedidos em aberto e nomes. "
+        "Seja conciso; o resumo substituirá as mensagens originais no contexto.",
+        "o3-mini",
+        1024,
+        reasoning_effort="low"
+    )
+    try:
+        response, reserved, _ = model_gateway.complete(request_payload)
+        settle_openai_tokens(reserved, usage_to_dict(response.usage))
+        content = response.choices[0].message.content
+        return content.strip() if content and content.strip() else None
+    except Exception as e:
+        return None
+
+# Modo em partes para mensagens muito longas (map-reduce): cada parte é resumida à luz do pedido num
+# pool próprio e limitado, e a resposta final é gerada pelo fluxo normal a partir dos resultados
+LONG_INPUT_MAP_PROMPT = (
+    "Você está processando a parte {part} de {total} de uma mensagem longa enviada à assistente. "
+    "Extraia desta parte, em português, tudo o que for necessário para atender ao pedido do usuário: "
+    "fatos, números, nomes, decisões e trechos de código relevantes. Não responda ao pedido ainda; "
+    "o resultado será combinado com o das outras partes."
+)
+long_input_pool = ThreadPoolExecutor(max_workers=LONG_INPUT_WORKERS, thread_name_prefix="livia-partes")
+
+def is_long_input(text):
+    # Um token tem ao menos um caractere: o tamanho do texto descarta a contagem na maioria dos casos
+    return LONG_INPUT_TOKENS > 0 and len(text) > LONG_INPUT_TOKENS and count_tokens(text) > LONG_INPUT_TOKENS
+
+def split_long_input(text, max_tokens):
+    """Divide o texto em partes de até max_tokens, cortando entre parágrafos e sem separar blocos de
+    código; só blocos maiores que uma parte são cortados por linhas (e linhas enormes, por tamanho)"""
+    blocks = []
+    for i, segment in enumerate(re.split(r"(```.*?```)", text, flags=re.DOTALL)):
+        blocks.extend([segment] if i % 2 else re.split(r"\n\s*\n", segment))
+    pieces = []  # (texto, separador antes dele)
+    for block in blocks:
+        if not block.strip():
+            continue
+        if count_tokens(block) <= max_tokens:
+            pieces.append((block, "\n\n"))
+            continue
+        for line in block.split("\n"):
+            while count_tokens(line) > max_tokens:
+                pieces.append((line[:max_tokens * 3], "\n"))
+                line = line[max_tokens * 3:]
+            pieces.append((line, "\n"))
+    chunks = []
+    current = ""
+    used = 0
+    for piece, separator in pieces:
+        size = count_tokens(piece) + 1
+        if current and used + size > max_tokens:
+            chunks.append(current)
+            current, used = "", 0
+        current = current + separator + piece if current else piece
+        used += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+def plan_long_input(text):
+    # Partes do texto, aumentando o tamanho de cada uma até caber em LONG_INPUT_MAX_CHUNKS
+    chunk_tokens = LONG_INPUT_CHUNK_TOKENS
+    chunks = split_long_input(text, chunk_tokens)
+    while len(chunks) > LONG_INPUT_MAX_CHUNKS:
+        chunk_tokens = int(chunk_tokens * 1.25) + 1
+        chunks = split_long_input(text, chunk_tokens)
+    return chunks
+
+def long_input_excerpt(text, chars=600):
+    # Início e fim da mensagem, onde normalmente está o pedido do usuário
+    if len(text) <= chars * 2:
+        return text
+    return text[:chars] + "\n[...]\n" + text[-chars:]
+
+def long_input_part_payloads(text, chunks, model):
+    excerpt = long_input_excerpt(text)
+    return [
+        build_gpt_payload(
+            [{"role": "user", "content": f"Pedido do usuário (início e fim da mensagem):\n{excerpt}\n\n"
+                                         f"Parte {i} de {len(chunks)}:\n{chunk}"}],
+            LONG_INPUT_MAP_PROMPT.format(part=i, total=len(chunks)),
+            model,
+            LONG_INPUT_PART_MAX_TOKENS,
+            reasoning_effort="low"
+        )
+        for i, chunk in enumerate(chunks, 1)
+    ]
+
+def long_input_reduce_text(text, results):
+    # Mensagem que substitui a original na chamada final
+    parts = "\n\n".join(
+        f"Parte {i} de {len(results)}:\n{result or '[não foi possível processar esta parte]'}"
+        for i, result in enumerate(results, 1)
+    )
+    return (f"Enviei uma mensagem longa ({count_tokens(text)} tokens), processada em {len(results)} partes.\n\n"
+            f"Início e fim da mensagem original (com o pedido):\n{long_input_excerpt(text)}\n\n"
+            f"Resultados de cada parte:\n\n{parts}\n\n"
+            "Atenda ao pedido com base nesses resultados, como se tivesse lido a mensagem inteira.")
+
+def long_input_progress(done, total):
+    if done < total:
+        return f":page_facing_up: Mensagem longa: {done} de {total} partes processadas..."
+    return ":hourglass_flowing_sand: Combinando as partes..."
+
+def add_usage(total, usage):
+    # Soma o uso de tokens de uma chamada ao total (None conta como zero)
+    if not usage:
+        return total
+    total = dict(total or {})
+    for key in ("prompt_tokens", "completion_tokens", "reasoning_tokens"):
+        if usage.get(key) is not None:
+            total[key] = (total.get(key) or 0) + usage[key]
+    return total
+
+def long_input_part_result(response, reserved):
+    # Texto (ou None) e uso de tokens da resposta de uma parte
+    usage = usage_to_dict(response.usage)
+    settle_openai_tokens(reserved, usage)
+    content = response.choices[0].message.content if response.choices else None
+    return (content or "").strip() or None, usage
+
+def complete_long_input_part(request_payload):
+    response, reserved, _ = model_gateway.complete(request_payload)
+    return long_input_part_result(response, reserved)
+
+def map_long_input(text, model, on_progress=None):
+    """Processa as partes de uma mensagem longa em paralelo (no máximo LONG_INPUT_WORKERS chamadas);
+    retorna (texto para a chamada final, uso de tokens) ou (None, uso) se nenhuma parte deu certo"""
+    chunks = plan_long_input(text)
+    payloads = long_input_part_payloads(text, chunks, model)
+    results = [None] * len(chunks)
+    usage = None
+    futures = {long_input_pool.submit(complete_long_input_part, payload): i for i, payload in enumerate(payloads)}
+    for done, future in enumerate(as_completed(futures), 1):
+        try:
+            results[futures[future]], part_usage = future.result()
+            usage = add_usage(usage, part_usage)
+            metrics.inc("livia_partes_total", resultado="sucesso")
+        except Exception as e:
+            metrics.inc("livia_partes_total", resultado="falha")
+        if on_progress:
+            on_progress(done, len(chunks))
+    if not any(results):
+        return None, usage
+    return long_input_reduce_text(text, results), usage
+
+class ProgressReporter:
+    """Edita a mensagem de status com o progresso, no máximo a cada STREAM_UPDATE_INTERVAL segundos
+    (a mensagem final é sempre enviada)"""
+
+    def __init__(self, channel_id, message_ts):
+        self.channel_id = channel_id
+        self.message_ts = message_ts
+        self._lock = threading.Lock()
+        self._last_update = 0.0
+
+    def _due(self, done, total):
+        if not self.message_ts:
+            return False
+        with self._lock:
+            now = time.time()
+            if done < total and now - self._last_update < STREAM_UPDATE_INTERVAL:
+                return False
+            self._last_update = now
+            return True
+
+    def __call__(self, done, total):
+        if self._due(done, total):
+            update_message_in_slack(self.channel_id, self.message_ts, long_input_progress(done, total), wait=False)
+
+    async def update_async(self, done, total):
+        if self._due(done, total):
+            await update_message_in_slack_async(self.channel_id, self.message_ts, long_input_progress(done, total), wait=False)
+
+    # Chama a API da OpenAI para gerar resposta
+def completion_reply(response, reserved, route, started_at):
+    # Resultado de uma chamada sem streaming: acerta o balde de tokens, registra a latência e extrai
+    # o texto; retorna (texto, uso de tokens)
+    usage = usage_to_dict(response.usage)
+    settle_openai_tokens(reserved, usage)
+    elapsed = time.perf_counter() - started_at
+    metrics.observe("livia_modelo_primeiro_token_segundos", elapsed, modelo=route[0])
+    metrics.observe("livia_modelo_total_segundos", elapsed, modelo=route[0])
+    
+    if response and response.choices and len(response.choices) > 0:
+        content = response.choices[0].message.content
+        if content and content.strip():
+            return content.strip(), usage
         else:
-            return "Desculpe, houve um erro interno. Tente novamente mais tarde.", None
+            return "Desculpe, não consegui gerar uma resposta.", usage
+    else:
+        return "Desculpe, houve um problema na comunicação.", None
+
+def model_error_reply(e):
+    # Resposta ao usuário quando a chamada ao modelo falha
+    metrics.inc("livia_erros_total", local="modelo", tipo=type(e).__name__)
+    return gpt_error_message(e), None
+
+def build_stream_payload(conversation_history, system_prompt, model, max_completion_tokens, reasoning_effort):
+    request_payload = build_gpt_payload(conversation_history, system_prompt, model, max_completion_tokens, reasoning_effort)
+    request_payload["stream"] = True
+    request_payload["stream_options"] = {"include_usage": True}
+    return request_payload
+
+class StreamedReply:
+    """Acumula uma resposta em streaming: texto, uso de tokens, métricas e o resultado no gateway.
+    Os dois modos só iteram o stream (com for ou async for) e repassam cada chunk a text_of()."""
+
+    def __init__(self):
+        self.parts = []
+        self.usage = None
+        self.route = None
+        self.reserved = 0
+        self.started_at = time.perf_counter()
+
+    def opened(self, reserved, route):
+        self.reserved = reserved
+        self.route = route
+
+    def text_of(self, chunk):
+        # Trecho de texto novo do chunk (ou None); o chunk final traz o uso de tokens
+        if getattr(chunk, "usage", None):
+            self.usage = usage_to_dict(chunk.usage)
+            settle_openai_tokens(self.reserved, self.usage)
+        if not chunk.choices:
+            return None
+        delta = chunk.choices[0].delta.content
+        if delta:
+            if not self.parts:
+                metrics.observe("livia_modelo_primeiro_token_segundos", time.perf_counter() - self.started_at,
+                                modelo=self.route[0])
+            self.parts.append(delta)
+        return delta
+
+    def failed(self, e):
+        if self.route:
+            model_gateway.record(self.route, self.started_at, ok=False, transient=is_retryable_model_error(e))
+        if not self.parts:
+            return model_error_reply(e)
+        metrics.inc("livia_erros_total", local="modelo", tipo=type(e).__name__)
+        # Mantém o que já foi gerado e avisa que a resposta foi interrompida
+        return "".join(self.parts).strip() + "\n\n_(resposta interrompida: " + gpt_error_message(e) + ")_", self.usage
+
+    def finished(self):
+        model_gateway.record(self.route, self.started_at, ok=True)
+        metrics.observe("livia_modelo_total_segundos", time.perf_counter() - self.started_at, modelo=self.route[0])
+        content = "".join(self.parts).strip()
+        if not content:
+            return "Desculpe, não consegui gerar uma resposta.", self.usage
+        return content, self.usage
+
+def gpt(conversation_history, system_prompt, model="o3-mini", max_completion_tokens=4095, reasoning_effort="medium"):
+    request_payload = build_gpt_payload(conversation_history, system_prompt, model, max_completion_tokens, reasoning_effort)
+    started_at = time.perf_counter()
+    try:
+        response, reserved, route = model_gateway.complete(request_payload)
+        return completion_reply(response, reserved, route, started_at)
+    except Exception as e:
+        return model_error_reply(e)
+
+    # Chama a API da OpenAI em streaming, repassando cada trecho de texto para on_text
+def gpt_stream(conversation_history, system_prompt, on_text, model="o3-mini", max_completion_tokens=4095, reasoning_effort="medium"):
+    request_payload = build_stream_payload(conversation_history, system_prompt, model, max_completion_tokens, reasoning_effort)
+    reply = StreamedReply()
+    try:
+        stream, reserved, route = model_gateway.complete(request_payload, stream=True)
+        reply.opened(reserved, route)
+        for chunk in stream:
+            delta = reply.text_of(chunk)
+            if delta:
+                on_text(delta)
+    except Exception as e:
+        return reply.failed(e)
+    return reply.finished()
+
+class SlackStreamWriter:
+    """Edita a mensagem de "aguarde" com o texto parcial da resposta.
+
+    As edições são agrupadas por tempo (STREAM_UPDATE_INTERVAL) e volume (STREAM_UPDATE_MIN_CHARS);
+    as parciais não esperam o balde de chat.update (compartilhado por todas as respostas) e são
+    puladas quando ele está sem folga. Só a edição final espera. Textos longos continuam em novas
+    mensagens da thread.
+    """
+
+    def __init__(self, channel_id, thread_ts, status_ts):
+        self.channel_id = channel_id
+        self.thread_ts = thread_ts
+        self.message_ts = [status_ts] if status_ts else []  # ts de cada mensagem usada pela resposta
+        self.sent = [None] * len(self.message_ts)           # último texto enviado para cada mensagem
+        self.parts = []
+        self.size = 0
+        self.flushed_size = 0
+        self.last_flush = 0.0
 
-    # Busca histórico de mensagens de uma thread
+    def _add(self, delta):
+        # Acrescenta o trecho; retorna o texto parcial quando é hora de editar a mensagem
+        self.parts.append(delta)
+        self.size += len(delta)
+        new_chars = self.size - self.flushed_size
+        elapsed = time.time() - self.last_flush
+        if elapsed >= STREAM_UPDATE_INTERVAL or (new_chars >= STREAM_UPDATE_MIN_CHARS and elapsed >= STREAM_UPDATE_INTERVAL / 3):
+            return "".join(self.parts) + " :writing_hand:"
+        return None
+
+    def _changed_segments(self, text):
+        # Partes do texto que diferem do que já está no Slack, como (índice, parte, ts da mensagem ou None)
+        self.last_flush = time.time()
+        self.flushed_size = self.size
+        segments = split_slack_message(limpar_formatacao(text))
+        changes = []
+        for i, segment in enumerate(segments):
+            if i >= len(self.message_ts):
+                changes.append((i, segment, None))
+            elif self.sent[i] != segment:
+                changes.append((i, segment, self.message_ts[i]))
+        return segments, changes
+
+    def _posted(self, i, new_ts, segment):
+        # Guarda a parte postada como nova mensagem; retorna o ts da mensagem que ela substitui
+        if i < len(self.message_ts):
+            old_ts, self.message_ts[i] = self.message_ts[i], new_ts
+            self.sent[i] = segment
+            return old_ts
+        self.message_ts.append(new_ts)
+        self.sent.append(segment)
+        return None
+
+    def _trim(self, segments):
+        # Mensagens que sobraram (ex.: resposta final menor que o texto parcial), para apagar
+        extra = self.message_ts[len(segments):]
+        del self.message_ts[len(segments):]
+        del self.sent[len(segments):]
+        return extra
+
+    def feed(self, delta):
+        partial = self._add(delta)
+        if partial:
+            self._flush(partial)
+
+    def finish(self, text):
+        self._flush(text, final=True)
+
+    def _flush(self, text, final=False):
+        segments, changes = self._changed_segments(text)
+        for i, segment, message_ts in changes:
+            if message_ts:
+                if update_message_in_slack(self.channel_id, message_ts, segment, wait=final):
+                    self.sent[i] = segment
+                    continue
+                if not final:
+                    break  # balde sem folga: fica para a próxima edição
+            # Parte nova, ou edição final que falhou: posta como nova mensagem
+            new_ts = post_message_to_slack(self.channel_id, segment, self.thread_ts)
+            if new_ts:
+                replaced_ts = self._posted(i, new_ts, segment)
+                if replaced_ts:
+                    delete_message_from_slack(self.channel_id, replaced_ts)
+        if final:
+            for extra_ts in self._trim(segments):
+                delete_message_from_slack(self.channel_id, extra_ts)
+
+    # Busca histórico de mensagens de uma thread (via cache incremental)
 def fetch_conversation_history(channel_id, thread_ts):
+    started_at = time.perf_counter()
     try:
-        history = app.client.conversations_replies(channel=channel_id, ts=thread_ts)
-        return history['messages']
+        return thread_store.get(channel_id, thread_ts)
     except SlackApiError as e:
         if not handle_slack_api_error(e):
             raise
         return []
+    finally:
+        metrics.observe("livia_historico_segundos", time.perf_counter() - started_at)
 
 def handle_slack_api_error(e):
     # Trata erros específicos da API do Slack
@@ -251,21 +2603,105 @@ def handle_slack_api_error(e):
     return False 
 
 def determine_channel_and_user_names(channel_id, user_id):
-    # Obtém nomes do usuário e canal a partir dos IDs
-    try:
-        user_info = app.client.users_info(user=user_id)
-        user_name = user_info['user']['real_name']
-    except Exception as e:
-        user_name = "Usuário Desconhecido"
-    
+    # Obtém nomes do usuário e canal a partir dos IDs (consultando o cache antes da API)
+    user_name = user_name_cache.get(user_id)
+    if user_name is None:
+        try:
+            user_info = slack_call("users.info", user=user_id)
+            user_name = user_info['user']['real_name']
+            user_name_cache.set(user_id, user_name)
+        except Exception as e:
+            user_name = "Usuário Desconhecido"
+
+    channel_name = channel_name_cache.get(channel_id)
+    if channel_name is None:
+        try:
+            channel_info = slack_call("conversations.info", channel=channel_id)
+            channel_name = channel_display_name(channel_info['channel'])
+            channel_name_cache.set(channel_id, channel_name)
+        except Exception as e:
+            channel_name = "Canal Desconhecido"
+
+    return user_name, channel_name
+
+def channel_display_name(channel):
+    # Nome exibido para o canal; DMs não têm nome próprio
+    return "Mensagem Direta" if channel.get('is_im', False) else channel['name']
+
+def prefill_directory_cache():
+    """Pré-carrega os caches de nomes com users_list e conversations_list paginados"""
+    users_loaded = 0
+    channels_loaded = 0
     try:
-        channel_info = app.client.conversations_info(channel=channel_id)
-        is_direct_message = channel_info['channel'].get('is_im', False)
-        channel_name = "Mensagem Direta" if is_direct_message else channel_info['channel']['name']
+        cursor = None
+        while True:
+            response = slack_call("users.list", limit=200, cursor=cursor)
+            for user in response.get('members', []):
+                real_name = user.get('real_name') or user.get('profile', {}).get('real_name')
+                if real_name:
+                    user_name_cache.set(user['id'], real_name)
+                    users_loaded += 1
+            cursor = response.get('response_metadata', {}).get('next_cursor')
+            if not cursor:
+                break
+
+        cursor = None
+        while True:
+            response = slack_call(
+                "conversations.list",
+                types="public_channel,private_channel,im",
+                exclude_archived=True,
+                limit=200,
+                cursor=cursor
+            )
+            for channel in response.get('channels', []):
+                if channel.get('is_im') or channel.get('name'):
+                    channel_name_cache.set(channel['id'], channel_display_name(channel))
+                    channels_loaded += 1
+            cursor = response.get('response_metadata', {}).get('next_cursor')
+            if not cursor:
+                break
     except Exception as e:
-        channel_name = "Canal Desconhecido"
+        print(f"❌ ERRO ao pré-carregar diretório: {e}")
 
-    return user_name, channel_name
+    print(f"📇 Diretório pré-carregado: {users_loaded} usuários, {channels_loaded} canais")
+
+def prefill_recent_channels(limit=50):
+    """Resolve os nomes dos canais com threads recentes no índice (aquecimento sem listar o workspace)"""
+    loaded = 0
+    for channel_id in eligibility.recent_channels(limit):
+        if channel_name_cache.get(channel_id) is not None:
+            continue
+        try:
+            channel_info = slack_call("conversations.info", channel=channel_id)
+            channel_name_cache.set(channel_id, channel_display_name(channel_info['channel']))
+            loaded += 1
+        except Exception as e:
+            pass
+    return loaded
+
+def thread_context(messages, ts, bot_user_id, please_wait_message):
+    # Mensagens da thread até a mensagem respondida: a resposta pode ter esperado na fila da thread
+    # enquanto chegavam mensagens novas, que ficam para as respostas delas. As respostas da Livia
+    # entram mesmo sendo mais novas (a resposta a uma mensagem anterior da fila é postada depois
+    # que esta chegou). Mensagens de "aguarde" ainda visíveis são ignoradas
+    return [msg for msg in messages
+            if msg.get("text") != please_wait_message
+            and (msg.get("user") == bot_user_id or float(msg.get("ts") or 0) <= float(ts))]
+
+def is_thread_reply(thread_ts, ts):
+    # Resposta dentro de uma thread (não a mensagem raiz)
+    return bool(thread_ts and thread_ts != ts)
+
+def assemble_conversation(messages, plan, user_id, bot_user_id, thread_ts, ts, reduced_text=None):
+    """Histórico para o modelo a partir das mensagens da thread já buscadas (antes da janela de contexto).
+    Com reduced_text (resultado das partes de uma mensagem longa), ele substitui a mensagem original"""
+    messages = thread_context(messages, ts, bot_user_id, plan["please_wait_message"])
+    current_text = plan["text"]
+    if reduced_text:
+        messages = [msg for msg in messages if msg.get("ts") != ts]
+        current_text = reduced_text
+    return construct_conversation_history(messages, bot_user_id, user_id, current_text, thread_ts, ts)
 
 def construct_conversation_history(messages, bot_user_id, user_id, current_text, thread_ts=None, ts=None):
     # Constrói histórico da conversa no formato esperado pela OpenAI
@@ -288,6 +2724,11 @@ def construct_conversation_history(messages, bot_user_id, user_id, current_text,
     
     return conversation_history
 
+def is_permanent_post_error(e):
+    # Erros de postagem que não adianta repetir (canal inexistente ou sem a Livia)
+    error = str(e).lower()
+    return "channel_not_found" in error or "not_in_channel" in error
+
 def post_message_to_slack(channel_id, text, thread_ts=None, max_retries=3):
     """Posta mensagem no Slack com retry automático"""
     if not text: 
@@ -295,7 +2736,9 @@ def post_message_to_slack(channel_id, text, thread_ts=None, max_retries=3):
         
     for attempt in range(max_retries):
         try:
-            response = app.client.chat_postMessage(
+            # Limites de taxa (429) são aguardados dentro de slack_call, conforme o Retry-After
+            response = slack_call(
+                "chat.postMessage",
                 channel=channel_id,
                 text=text,
                 thread_ts=thread_ts
@@ -305,12 +2748,7 @@ def post_message_to_slack(channel_id, text, thread_ts=None, max_retries=3):
                 return response.get("ts")
                 
         except Exception as e:
-            # Log específico para diferentes tipos de erro
-            if "rate_limited" in str(e).lower():
-                time.sleep(2 ** attempt)  # Backoff exponencial
-            elif "channel_not_found" in str(e).lower():
-                return None  # Não retry para este tipo de erro
-            elif "not_in_channel" in str(e).lower():
+            if is_permanent_post_error(e):
                 return None  # Não retry para este tipo de erro
         
         # Aguarda antes da próxima tentativa (exceto na última)
@@ -319,150 +2757,505 @@ def post_message_to_slack(channel_id, text, thread_ts=None, max_retries=3):
     
     return None
 
+def try_reserve_update():
+    # Token de chat.update para uma edição que pode ser pulada (parcial do streaming, progresso):
+    # só usa o que sobra acima de meia rajada, que fica para as edições finais de todas as respostas
+    bucket = slack_buckets["chat.update"]
+    return bucket.try_acquire(keep=bucket.capacity / 2)
+
+def update_message_in_slack(channel_id, ts, text, wait=True):
+    # Edita uma mensagem já postada; retorna True se a edição foi aceita.
+    # Com wait=False a edição é pulada (retorna False) quando o balde de chat.update não tem folga
+    if not wait and not try_reserve_update():
+        return False
+    try:
+        response = slack_call("chat.update", acquired=not wait, channel=channel_id, ts=ts, text=text)
+        return bool(response and response.get("ok"))
+    except Exception as e:
+        return False
+
 def delete_message_from_slack(channel_id, ts):
     # Remove mensagem do Slack
     try:
-        app.client.chat_delete(channel=channel_id, ts=ts)
+        slack_call("chat.delete", channel=channel_id, ts=ts)
     except Exception as e:
         pass
 
-# Fila para processamento assíncrono de eventos
-event_queue = queue.Queue()
-processing_lock = Lock()
+class Dispatcher:
+    """Distribui eventos entre N workers de entrada e respostas num pool fixo de chamadas ao modelo.
+
+    Eventos de uma mesma thread do Slack caem sempre no mesmo worker de entrada e as respostas
+    de uma mesma thread são executadas uma de cada vez, na ordem de chegada. O limite de eventos
+    na fila (max_queue_depth) é compartilhado pelos workers, para que uma thread movimentada
+    possa usar a folga dos outros. Os avisos de "ocupada" dos eventos recusados saem por um
+    worker próprio, para que quem recusa (listener do Slack ou escritor do journal) não espere
+    pelo limite de chat.postMessage.
+    """
+
+    def __init__(self, event_workers, model_workers, max_queue_depth):
+        self.event_workers = max(1, event_workers)
+        self.model_workers = max(1, model_workers)
+        self.max_queue_depth = max(1, max_queue_depth)
+        self.event_queues = [queue.Queue() for _ in range(self.event_workers)]
+        self._queued = 0             # eventos enfileirados em todos os workers de entrada
+        self._ready = queue.Queue()  # (thread_key, tarefa) prontas para executar
+        self._waiting = {}           # {thread_key: deque de tarefas aguardando a anterior}
+        self._pending = 0            # respostas enfileiradas ou em execução
+        self._refused = queue.Queue()  # eventos recusados aguardando o aviso de "ocupada"
+        self._cond = threading.Condition()
+        self._threads = []
+        self.stats = {"eventos_recusados": 0, "respostas_recusadas": 0, "respostas_concluidas": 0}
+
+    def start(self):
+        for event_queue in self.event_queues:
+            thread = Thread(target=process_events_worker, args=(event_queue,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        for _ in range(self.model_workers):
+            thread = Thread(target=self._model_worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        Thread(target=self._busy_worker, daemon=True).start()
+
+    def submit_event(self, body):
+        """Enfileira um evento no worker da sua thread; retorna False se a fila estiver cheia"""
+        event_queue = self.event_queues[hash(event_thread_key(body)) % self.event_workers]
+        with self._cond:
+            if self._queued >= self.max_queue_depth:
+                self.stats["eventos_recusados"] += 1
+                return False
+            self._queued += 1
+        event_queue.put_nowait(body)
+        return True
+
+    def refuse_event(self, body):
+        """Agenda o aviso de "ocupada" de um evento recusado, sem esperar pelo Slack"""
+        self._refused.put_nowait(body)
+
+    def _busy_worker(self):
+        while True:
+            body = self._refused.get()
+            if body is None:  # Sinal para parar
+                break
+            try:
+                reply_busy(body)
+            except Exception as e:
+                metrics.inc("livia_erros_total", local="aviso_ocupada", tipo=type(e).__name__)
+
+    def event_taken(self):
+        # Chamado pelo worker de entrada ao retirar um evento da fila
+        with self._cond:
+            self._queued -= 1
+
+    def submit_reply(self, thread_key, task):
+        """Agenda a geração de uma resposta; retorna False se o limite de pendências foi atingido"""
+        with self._cond:
+            if self._pending >= self.max_queue_depth:
+                self.stats["respostas_recusadas"] += 1
+                return False
+            self._pending += 1
+            if thread_key in self._waiting:
+                self._waiting[thread_key].append(task)
+            else:
+                self._waiting[thread_key] = deque()
+                self._ready.put((thread_key, task))
+        return True
+
+    def _model_worker(self):
+        while True:
+            item = self._ready.get()
+            if item is None:  # Sinal para parar
+                break
+            thread_key, task = item
+            try:
+                task()
+            except Exception as e:
+                metrics.inc("livia_erros_total", local="pool_modelo", tipo=type(e).__name__)
+            finally:
+                with self._cond:
+                    self._pending -= 1
+                    self.stats["respostas_concluidas"] += 1
+                    waiting = self._waiting.get(thread_key)
+                    if waiting:
+                        self._ready.put((thread_key, waiting.popleft()))
+                    else:
+                        self._waiting.pop(thread_key, None)
+                    self._cond.notify_all()
+
+    def queue_depth(self):
+        with self._cond:
+            return self._queued
+
+    def pending_replies(self):
+        with self._cond:
+            return self._pending
+
+    def stop(self, timeout=30):
+        """Encerra os workers: drena os eventos, aguarda as respostas pendentes e envia o sinal None"""
+        for event_queue in self.event_queues:
+            event_queue.put(None)
+        deadline = time.time() + timeout
+        for thread in self._threads[:self.event_workers]:
+            thread.join(max(0, deadline - time.time()))
+        with self._cond:
+            while self._pending and time.time() < deadline:
+                self._cond.wait(max(0, deadline - time.time()))
+        for _ in range(self.model_workers):
+            self._ready.put(None)
+        self._refused.put(None)
+        for thread in self._threads[self.event_workers:]:
+            thread.join(max(0, deadline - time.time()))
+
+def event_thread_key(body):
+    # Chave (canal, thread) de um evento de mensagem, usada para manter a ordem por thread
+    event = body.get("event", {})
+    message = event.get("message", event) if event.get("subtype") == "message_changed" else event
+    return (event.get("channel"), message.get("thread_ts") or message.get("ts"))
+
+dispatcher = Dispatcher(EVENT_WORKERS, MODEL_WORKERS, MAX_QUEUE_DEPTH)
 
 # Função de monitoramento de saúde do sistema
 def health_monitor():
     while True:
+        # A primeira verificação espera um ciclo (a identidade acabou de ser resolvida no aquecimento)
+        time.sleep(300)
         try:
-            current_time = time.time()
+            # Limpa mensagens em processamento antigas
+            expired = admission.expire()
+            if expired:
+                print(f"🧹 Limpeza: {expired} mensagens antigas removidas do processamento")
             
-            # Limpa mensagens em processamento antigas (> 2 minutos)
-            with processing_lock:
-                old_processing = [key for key, timestamp in processing_messages.items() 
-                                if current_time - timestamp > 120]
-                for key in old_processing:
-                    del processing_messages[key]
-                if old_processing:
-                    print(f"🧹 Limpeza: {len(old_processing)} mensagens antigas removidas do processamento")
-            
-            # Verifica conectividade com Slack a cada 5 minutos
-            try:
-                app.client.auth_test()
-            except Exception as e:
-                print(f"❌ ERRO de conectividade com Slack: {e}")
+            # Atualiza a identidade do bot (e verifica conectividade) a cada 5 minutos;
+            # em caso de falha o valor em cache continua servindo os handlers
+            probe_started = time.perf_counter()
+            probe_ok = refresh_bot_identity()
+            metrics.set("livia_auth_test_segundos", time.perf_counter() - probe_started)
+            metrics.set("livia_auth_test_ok", 1 if probe_ok else 0)
+            if not probe_ok:
+                print("❌ ERRO de conectividade com Slack: falha ao atualizar identidade do bot")
+            print(f"📊 auth_test evitados: {identity_stats['auth_test_evitados']} - "
+                  f"refresh ok/falhas: {identity_stats['refresh_ok']}/{identity_stats['refresh_falhas']}")
+            user_stats = user_name_cache.stats()
+            channel_stats = channel_name_cache.stats()
+            print(f"📊 Cache de diretório - usuários: {user_stats['hits']}/{user_stats['misses']} (hit/miss), "
+                  f"canais: {channel_stats['hits']}/{channel_stats['misses']} (hit/miss)")
+            print(f"📊 Admissão - admitidas: {admission.stats['admitidas']}, duplicadas: {admission.stats['duplicadas']}, "
+                  f"cooldown: {admission.stats['cooldown']}, em processamento: {admission.in_flight()}")
+            eligibility.prune()
+            eligibility.save()
+            print(f"📊 Elegibilidade - DM: {eligibility.stats['dm']}, menção: {eligibility.stats['mencao']}, "
+                  f"thread: {eligibility.stats['thread_indice']}, ignoradas: {eligibility.stats['ignorada'] + eligibility.stats['thread_ignorada']}, "
+                  f"consultas API: {eligibility.stats['consultas_api']}, chamadas evitadas: {eligibility.stats['chamadas_evitadas']}")
+            with stage_lock:
+                timings = ", ".join(f"{stage}: {stats['total'] / stats['n'] * 1000:.0f}ms"
+                                    for stage, stats in stage_stats.items() if stats["n"])
+            if timings:
+                print(f"⏱️ Tempo médio por etapa - {timings}")
+            levels = ", ".join(f"{name}: {level:.1f}" for name, level in rate_limiter_levels().items())
+            print(f"🪣 Limites de taxa (tokens disponíveis) - {levels}")
+            for (model, effort), stats in model_gateway.snapshot().items():
+                p95 = f"{stats['p95']:.1f}s" if stats['p95'] is not None else "-"
+                print(f"🧠 Modelo {model}/{effort or 'padrão'} - sucessos: {stats['sucessos']}, falhas: {stats['falhas']}, "
+                      f"fallbacks: {stats['fallbacks']}, p95: {p95}, circuito: {stats['circuito']}")
+            print(f"📊 Histórico de threads - completas: {thread_store.stats['buscas_completas']}, "
+                  f"delta: {thread_store.stats['buscas_delta']}, páginas: {thread_store.stats['paginas']}")
+            if event_journal.running:
+                print(f"📓 Journal - gravados: {event_journal.stats['gravados']}, duplicados: {event_journal.stats['duplicados']}, "
+                      f"reprocessados: {event_journal.stats['reprocessados']}, lotes: {event_journal.stats['lotes']}, "
+                      f"pendentes: {event_journal.pending()}")
             
         except Exception as e:
             print(f"❌ ERRO CRÍTICO no monitor de saúde: {e}")
-        
-        time.sleep(300)
 
-def process_events_worker():
+def process_events_worker(event_queue):
 # Worker thread para processar eventos da fila
     while True:
         try:
             event_data = event_queue.get(timeout=1)
             if event_data is None:  # Sinal para parar
                 break
+            dispatcher.event_taken()
+            observe_event_queue_wait(event_data)
             process_message_event(event_data)
             event_queue.task_done()
         except queue.Empty:
             continue
         except Exception as e:
-            pass
+            metrics.inc("livia_erros_total", local="worker_eventos", tipo=type(e).__name__)
+
+def observe_event_queue_wait(body):
+    # Tempo que o evento esperou entre o ack e o início do processamento
+    received_at = body.get("livia_recebido_em")
+    if received_at:
+        metrics.observe("livia_fila_eventos_espera_segundos", time.time() - received_at)
+
+@metrics.collector
+def collect_runtime_metrics():
+    # Gauges e contadores lidos das estatísticas dos componentes no momento do scrape
+    yield "livia_fila_eventos", {}, dispatcher.queue_depth()
+    yield "livia_respostas_pendentes", {"modo": "threads"}, dispatcher.pending_replies()
+    yield "livia_respostas_pendentes", {"modo": "asyncio"}, async_pending
+    yield "livia_mensagens_em_processamento", {}, admission.in_flight()
+    yield "livia_threads_vivas", {}, threading.active_count()
+    yield "livia_descartes_total", {"motivo": "fila_eventos_cheia"}, dispatcher.stats["eventos_recusados"]
+    yield "livia_descartes_total", {"motivo": "respostas_pendentes"}, dispatcher.stats["respostas_recusadas"]
+    yield "livia_descartes_total", {"motivo": "registro_uso"}, usage_logger.stats["linhas_descartadas"]
+    yield "livia_descartes_total", {"motivo": "evento_expirado"}, event_stats["expirados"]
+    for result in ("admitidas", "duplicadas", "cooldown", "expiradas"):
+        yield "livia_admissao_total", {"resultado": result}, admission.stats[result]
+    for decision, count in eligibility.stats.items():
+        if decision != "chamadas_evitadas":
+            yield "livia_elegibilidade_total", {"decisao": decision}, count
+    yield "livia_slack_chamadas_evitadas_total", {"origem": "auth_test"}, identity_stats["auth_test_evitados"]
+    yield "livia_slack_chamadas_evitadas_total", {"origem": "elegibilidade"}, eligibility.stats["chamadas_evitadas"]
+    for cache_name, cache in (("usuarios", user_name_cache), ("canais", channel_name_cache), ("resumos", summary_cache),
+                              ("respostas", response_cache.memory)):
+        stats = cache.stats()
+        yield "livia_cache_hits_total", {"cache": cache_name}, stats["hits"]
+        yield "livia_cache_misses_total", {"cache": cache_name}, stats["misses"]
+        yield "livia_cache_entradas", {"cache": cache_name}, stats["entradas"]
+    yield "livia_historico_buscas_total", {"tipo": "completa"}, thread_store.stats["buscas_completas"]
+    yield "livia_historico_buscas_total", {"tipo": "delta"}, thread_store.stats["buscas_delta"]
+    yield "livia_historico_paginas_total", {}, thread_store.stats["paginas"]
+    for name, level in rate_limiter_levels().items():
+        yield "livia_rate_limit_tokens", {"balde": name}, level
+    for bucket in list(slack_buckets.values()) + [openai_request_bucket, openai_token_bucket]:
+        yield "livia_rate_limit_429_total", {"balde": bucket.name}, bucket.stats["429"]
+        yield "livia_rate_limit_espera_segundos_total", {"balde": bucket.name}, bucket.stats["tempo_espera"]
+        yield "livia_rate_limit_pulos_total", {"balde": bucket.name}, bucket.stats["pulos"]
+    for (model, effort), stats in model_gateway.snapshot().items():
+        labels = {"modelo": model, "esforco": effort or "padrao"}
+        yield "livia_modelo_chamadas_total", dict(labels, resultado="sucesso"), stats["sucessos"]
+        yield "livia_modelo_chamadas_total", dict(labels, resultado="falha"), stats["falhas"]
+        yield "livia_modelo_fallbacks_total", labels, stats["fallbacks"]
+        yield "livia_modelo_circuito_aberto", labels, 0 if stats["circuito"] == "fechado" else 1
+        if stats["p95"] is not None:
+            yield "livia_modelo_p95_segundos", labels, stats["p95"]
+    yield "livia_uso_linhas_gravadas_total", {}, usage_logger.stats["linhas_gravadas"]
+    yield "livia_journal_pendentes", {}, event_journal.pending()
+    for result, count in claims.stats.items():
+        yield "livia_coordenacao_total", {"backend": CLAIM_BACKEND, "resultado": result}, count
+    yield "livia_admissao_total", {"resultado": "outra_instancia"}, admission.stats["outra_instancia"]
+    for result, count in response_cache.stats.items():
+        yield "livia_cache_respostas_total", {"resultado": result}, count
+    yield "livia_cache_respostas_hit_rate", {}, response_cache.hit_rate()
+    for result, count in channel_settings.stats.items():
+        yield "livia_canais_config_total", {"resultado": result}, count
+    for name in ("gravados", "duplicados", "reprocessados", "expirados", "erros"):
+        yield "livia_journal_eventos_total", {"resultado": name}, event_journal.stats[name]
+
+for _name, _kind, _help in [
+    ("livia_fila_eventos", "gauge", "Eventos aguardando nos workers de entrada"),
+    ("livia_respostas_pendentes", "gauge", "Respostas enfileiradas ou em geração"),
+    ("livia_mensagens_em_processamento", "gauge", "Mensagens admitidas ainda em processamento"),
+    ("livia_threads_vivas", "gauge", "Threads do sistema operacional vivas no processo"),
+    ("livia_descartes_total", "counter", "Eventos, respostas ou registros descartados por motivo"),
+    ("livia_admissao_total", "counter", "Decisões do controle de admissão (dedup e cooldown)"),
+    ("livia_elegibilidade_total", "counter", "Decisões de elegibilidade de mensagens"),
+    ("livia_slack_chamadas_evitadas_total", "counter", "Chamadas à API do Slack evitadas por cache ou índice"),
+    ("livia_cache_hits_total", "counter", "Acertos de cache"),
+    ("livia_cache_misses_total", "counter", "Faltas de cache"),
+    ("livia_cache_entradas", "gauge", "Entradas em cache"),
+    ("livia_historico_buscas_total", "counter", "Buscas de histórico de thread no Slack"),
+    ("livia_historico_paginas_total", "counter", "Páginas de conversations.replies buscadas"),
+    ("livia_rate_limit_tokens", "gauge", "Tokens disponíveis em cada balde de limite de taxa"),
+    ("livia_rate_limit_429_total", "counter", "Respostas 429 recebidas por balde"),
+    ("livia_rate_limit_espera_segundos_total", "counter", "Tempo total de espera imposto por balde"),
+    ("livia_rate_limit_pulos_total", "counter", "Chamadas opcionais puladas por falta de folga no balde"),
+    ("livia_modelo_chamadas_total", "counter", "Chamadas ao modelo por rota e resultado"),
+    ("livia_modelo_fallbacks_total", "counter", "Chamadas desviadas da rota pedida"),
+    ("livia_cache_respostas_total", "counter", "Consultas e gravações do cache de respostas (hits do disco e erros incluídos)"),
+    ("livia_cache_respostas_hit_rate", "gauge", "Fração das consultas ao cache de respostas atendidas desde o início"),
+    ("livia_partes_total", "counter", "Partes de mensagens longas processadas (sucesso ou falha)"),
+    ("livia_roteamento_total", "counter", "Mensagens por rota da política de roteamento (simples, padrao, complexo)"),
+    ("livia_canais_config_total", "counter", "Recargas e erros do arquivo de configuração dos canais"),
+    ("livia_modelo_circuito_aberto", "gauge", "1 se o circuit breaker da rota não está fechado"),
+    ("livia_modelo_p95_segundos", "gauge", "Latência p95 recente por rota"),
+    ("livia_uso_linhas_gravadas_total", "counter", "Linhas gravadas no registro de uso"),
+    ("livia_journal_pendentes", "gauge", "Gravações aguardando o escritor do journal de eventos"),
+    ("livia_journal_eventos_total", "counter", "Eventos do journal por resultado"),
+    ("livia_coordenacao_total", "counter", "Reivindicações no backend de coordenação entre instâncias"),
+    ("livia_inicializacao_segundos", "gauge", "Duração de cada etapa da inicialização"),
+    ("livia_primeira_resposta_segundos", "gauge", "Latência da primeira resposta desde a inicialização"),
+]:
+    metrics.describe(_name, _kind, _help)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    # Serve as métricas em /metrics
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-# Inicialização dos threads
-worker_thread = Thread(target=process_events_worker, daemon=True)
-health_thread = Thread(target=health_monitor, daemon=True)
+    def log_message(self, format, *args):
+        pass
 
-worker_thread.start()
-health_thread.start()
+def start_metrics_server():
+    # Inicia o endpoint local de métricas (LIVIA_METRICS_PORTA=0 desativa)
+    if not METRICS_PORT:
+        return None
+    try:
+        server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsHandler)
+    except OSError as e:
+        print(f"❌ ERRO ao iniciar métricas na porta {METRICS_PORT}: {e}")
+        return None
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Métricas em http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return server
 
 # Handler para eliminar warning de app_home_opened
-@app.event("app_home_opened")
 def handle_app_home_opened_events(body, logger):
     pass
 
-@app.event("message")
+# Invalida o cache de diretório quando nomes mudam no Slack
+def handle_user_change_events(body, logger):
+    user = body["event"].get("user", {})
+    user_id = user.get("id")
+    if not user_id:
+        return
+    user_name_cache.invalidate(user_id)
+    real_name = user.get("real_name") or user.get("profile", {}).get("real_name")
+    if real_name and not user.get("deleted"):
+        user_name_cache.set(user_id, real_name)
+
+def handle_channel_rename_events(body, logger):
+    channel = body["event"].get("channel", {})
+    channel_id = channel.get("id")
+    if not channel_id:
+        return
+    channel_name_cache.invalidate(channel_id)
+    if channel.get("name"):
+        channel_name_cache.set(channel_id, channel["name"])
+
 def handle_message_events(body, logger, ack):
     # Resposta imediata para evitar retries do Slack
     ack()
+    body["livia_recebido_em"] = time.time()
     
-    # Adiciona evento à fila para processamento assíncrono
-    event_queue.put(body)
+    # Com o journal ativo, o evento é gravado antes de entrar na fila (o escritor o enfileira após o commit)
+    if event_journal.running:
+        event_journal.append(body)
+    else:
+        enqueue_event(body)
+
+def enqueue_event(body):
+    # Adiciona evento à fila para processamento assíncrono; se estiver cheia, avisa o usuário
+    if not dispatcher.submit_event(body):
+        event_journal.mark(body.get("event_id"), "ocupada")
+        dispatcher.refuse_event(body)
+
+def reply_busy(body):
+    # Responde "ocupada" apenas a mensagens que a Livia responderia (DM, menção ou thread do índice),
+    # sem chamadas extras
+    event = body.get("event", {})
+    if 'subtype' in event or 'user' not in event:
+        return
+    bot_user_id = bot_identity["user_id"]
+    thread_ts = event.get("thread_ts")
+    in_known_thread = thread_ts and thread_ts != event.get("ts") and eligibility.contains(event["channel"], thread_ts)
+    if event.get("channel_type") == "im" or (bot_user_id and f"<@{bot_user_id}>" in event.get("text", "")) or in_known_thread:
+        post_message_to_slack(event["channel"], BUSY_MESSAGE, event.get("thread_ts") or event.get("ts"), max_retries=1)
+
+classification_cache = TTLCache(maxsize=DIRECTORY_CACHE_MAX, ttl=THREAD_CACHE_TTL)  # {(channel_id, ts): motivo}
 
 def process_message_event(body):
-    """Processa evento de mensagem de forma assíncrona"""
+    """Processa evento de mensagem (nova ou editada) pelo pipeline de roteamento:
+    normalização → elegibilidade → admissão → contexto → modelo → entrega"""
+    status = "ignorado"  # quando a mensagem segue para resposta, ask_chatgpt atualiza o status
     try:
-        event = body["event"]
-        
-        # Verificação de timestamp para evitar eventos antigos (> 30 segundos)
-        current_time = time.time()
-        event_time = float(event.get('ts', 0))
-        if current_time - event_time > 30:
-            return
-        
-        # Trata mensagens editadas (message_changed) - processamento especial
-        if event.get('subtype') == 'message_changed':
-            handle_message_changed(event)
-            return
-        
-        # Ignora outras mensagens que não são de usuários
-        if 'subtype' in event or 'user' not in event:
-            return
-
-        channel_id = event["channel"]
-        text = event["text"]
-        user_id = event["user"]
-        ts = event.get("ts")
-        thread_ts = event.get("thread_ts")
-        
-        # Obtém bot_user_id de forma thread-safe
-        try:
-            bot_user_id = app.client.auth_test()["user_id"]
-        except Exception as e:
-            return
-        
-        # Ignora mensagens do próprio bot
-        if user_id == bot_user_id:
+        # Validade do evento, mensagens apagadas, normalização e mensagens do próprio bot
+        status, message, bot_user_id = triage_event(body)
+        if message is None:
             return
         
-        # Responde sempre em mensagens diretas
-        if event["channel_type"] == "im":
-            ask_chatgpt(text, user_id, channel_id, thread_ts or ts, ts)
+        # Etapa de elegibilidade
+        stage_start = time.perf_counter()
+        reason = classify_message(message, bot_user_id)
+        record_stage_since("elegibilidade", stage_start)
+        if reason is None:
             return
         
-        # Responde se o bot foi mencionado na mensagem
-        if f"<@{bot_user_id}>" in text:
-            ask_chatgpt(text, user_id, channel_id, thread_ts or ts, ts)
+        # Cada evento é atendido por uma única instância, mesmo em reentregas do Slack
+        if not claim_event(body):
+            status = "duplicado"
             return
         
-        # Se for resposta em thread, verifica se bot foi mencionado na primeira mensagem
-        if thread_ts and thread_ts != ts:
-            try:
-                thread_history = app.client.conversations_replies(
-                    channel=channel_id,
-                    ts=thread_ts,
-                    limit=1
-                )
-                original_message = next((msg for msg in thread_history['messages'] if msg.get("ts") == thread_ts), None)
-                if original_message and f"<@{bot_user_id}>" in original_message.get("text", ""):
-                    ask_chatgpt(text, user_id, channel_id, thread_ts, ts)
-            except Exception as e:
-                pass
+        # Admissão, contexto, modelo e entrega
+        status = None
+        ask_chatgpt(message["text"], message["user_id"], message["channel_id"], reply_thread_ts(message, reason),
+                    message["ts"], body.get("event_id"))
             
     except Exception as e:
-        pass
+        status = "erro"
+        metrics.inc("livia_erros_total", local="evento", tipo=type(e).__name__)
+    finally:
+        if status:
+            event_journal.mark(body.get("event_id"), status)
 
-def handle_message_changed(event):
-    """Trata eventos de mensagem editada de forma específica"""
-    try:
+def triage_event(body):
+    """Primeiras etapas do pipeline, sem I/O: descarta eventos antigos, tira mensagens apagadas do
+    histórico em cache, normaliza e ignora mensagens do próprio bot.
+    Retorna (status, mensagem, bot_user_id); a mensagem é None quando o evento para aqui."""
+    event = body["event"]
+    
+    # Verificação de timestamp para evitar eventos antigos
+    if event_is_stale(body):
+        return "expirado", None, None
+    
+    # Mensagens apagadas saem do histórico em cache da thread
+    if event.get('subtype') == 'message_deleted':
+        previous_message = event.get('previous_message', {})
+        if previous_message.get('thread_ts'):
+            thread_store.discard(event["channel"], previous_message['thread_ts'], event.get('deleted_ts'))
+        return "ignorado", None, None
+    
+    # Etapa de normalização
+    stage_start = time.perf_counter()
+    message = normalize_message_event(event)
+    record_stage_since("normalizacao", stage_start)
+    if message is None:
+        return "ignorado", None, None
+    
+    # Obtém bot_user_id da identidade em cache e ignora mensagens do próprio bot
+    bot_user_id = get_bot_user_id()
+    if not bot_user_id or message["user_id"] == bot_user_id:
+        return "ignorado", None, None
+    return "ignorado", message, bot_user_id
+
+def reply_thread_ts(message, reason):
+    # Onde a resposta é postada: na thread da mensagem ou, para DMs e menções fora de thread, numa nova
+    return message["thread_ts"] if reason == "thread" else (message["thread_ts"] or message["ts"])
+
+def claim_event(body):
+    # Reivindica o event_id pelo tempo em que o Slack (ou o replay do journal) pode reentregá-lo
+    event_id = body.get("event_id")
+    ttl = max(EVENT_MAX_AGE, EVENT_REPLAY_WINDOW) + 60
+    return not event_id or claims.claim(f"evento:{event_id}", ttl, reentrant=bool(body.get("livia_replay")))
+
+def normalize_message_event(event):
+    """Converte eventos de mensagem nova ou editada (message_changed) num formato único.
+
+    Retorna None para eventos que não são mensagens de usuários ou edições sem mudança de texto.
+    """
+    if event.get('subtype') == 'message_changed':
         # Para mensagens editadas, os dados estão dentro de event['message']
         message_data = event.get('message', {})
         previous_message = event.get('previous_message', {})
         
+        # Atualiza a mensagem editada no histórico em cache da thread
+        if message_data.get('thread_ts'):
+            thread_store.record(event["channel"], message_data['thread_ts'], message_data)
+        
         # Ignora se não há usuário
         if 'user' not in message_data:
-            return
+            return None
         
         current_text = message_data.get('text', '')
         previous_text = previous_message.get('text', '')
@@ -475,70 +3268,575 @@ def handle_message_changed(event):
             ('subscribed' not in previous_message and 'subscribed' in message_data and current_text == previous_text)
         )
         
-        if is_new_message:
-            # Processa como mensagem nova
-            channel_id = event["channel"]
-            text = current_text
-            user_id = message_data["user"]
-            ts = message_data.get("ts")
-            thread_ts = message_data.get("thread_ts")
-            
-            try:
-                bot_user_id = app.client.auth_test()["user_id"]
-            except Exception as e:
-                return
-            
-            # Ignora mensagens do próprio bot
-            if user_id == bot_user_id:
-                return
-            
-            # Responde sempre em mensagens diretas
-            if event["channel_type"] == "im":
-                ask_chatgpt(text, user_id, channel_id, thread_ts or ts, ts)
-                return
-                
-            # Responde se o bot foi mencionado na mensagem
-            if f"<@{bot_user_id}>" in text:
-                ask_chatgpt(text, user_id, channel_id, thread_ts or ts, ts)
-                return
-                
-            # Se for resposta em thread, verifica se bot foi mencionado na primeira mensagem
-            if thread_ts and thread_ts != ts:
-                try:
-                    thread_history = app.client.conversations_replies(
-                        channel=channel_id,
-                        ts=thread_ts
-                    )
-                    original_message = next((msg for msg in thread_history['messages'] if msg.get("ts") == thread_ts), None)
-                    if original_message and f"<@{bot_user_id}>" in original_message.get("text", ""):
-                        ask_chatgpt(text, user_id, channel_id, thread_ts, ts)
-                except Exception as e:
-                    pass
+        # Verifica se o texto realmente mudou (ignora atualizações de metadados)
+        if not is_new_message and current_text == previous_text:
+            return None
+        
+        return {
+            "kind": "nova" if is_new_message else "editada",
+            "channel_id": event["channel"],
+            "channel_type": event.get("channel_type"),
+            "user_id": message_data["user"],
+            "text": current_text,
+            "ts": message_data.get("ts"),
+            "thread_ts": message_data.get("thread_ts")
+        }
+    
+    # Ignora outras mensagens que não são de usuários
+    if 'subtype' in event or 'user' not in event:
+        return None
+    
+    return {
+        "kind": "nova",
+        "channel_id": event["channel"],
+        "channel_type": event.get("channel_type"),
+        "user_id": event["user"],
+        "text": event["text"],
+        "ts": event.get("ts"),
+        "thread_ts": event.get("thread_ts")
+    }
+
+def classify_message(message, bot_user_id):
+    """Decide se a Livia responde: retorna "dm", "mencao", "thread" ou None.
+
+    A decisão de thread fica em cache por mensagem, então edições reaproveitam a classificação
+    da mensagem original.
+    """
+    channel_id = message["channel_id"]
+    ts = message["ts"]
+    thread_ts = message["thread_ts"]
+    
+    # Responde sempre em mensagens diretas
+    if message["channel_type"] == "im":
+        eligibility.count("dm")
+        return "dm"
+    
+    # Responde se o bot foi mencionado na mensagem. Menção na raiz já entra no índice aqui, antes
+    # da admissão: se esta mensagem for recusada ou expirar, as respostas na thread ainda são atendidas
+    if f"<@{bot_user_id}>" in message["text"]:
+        eligibility.count("mencao")
+        if not thread_ts or thread_ts == ts:
+            eligibility.add(channel_id, ts)
+        return "mencao"
+    
+    # Edições de texto só são respondidas em DMs ou com menção
+    if message["kind"] == "editada":
+        eligibility.count("ignorada")
+        return None
+    
+    # Se for resposta em thread, verifica no índice se a Livia participa da thread
+    if thread_ts and thread_ts != ts:
+        cached = classification_cache.get((channel_id, ts))
+        if cached is not None:
+            eligibility.count("thread_indice" if cached else "thread_ignorada", avoided_call=True)
+            return cached or None
+        reason = "thread" if eligibility.should_reply_in_thread(channel_id, thread_ts, bot_user_id) else ""
+        classification_cache.set((channel_id, ts), reason)
+        return reason or None
+    
+    eligibility.count("ignorada")
+    return None
+
+# ---------------------------------------------------------------------------
+# Modo assíncrono (asyncio): mesmos handlers sobre AsyncApp, AsyncSocketModeHandler e AsyncOpenAI.
+# Filtros, caches e admissão são compartilhados com o modo de threads; consultas que costumam vir
+# do cache (nomes, histórico de thread) usam o cliente síncrono via asyncio.to_thread em caso de miss.
+# ---------------------------------------------------------------------------
+async_app = None          # AsyncApp do Slack Bolt
+async_client = None       # AsyncOpenAI
+model_semaphore = None    # limita chamadas simultâneas ao modelo (MODEL_WORKERS)
+long_input_semaphore = None  # limita as chamadas das partes de mensagens longas (LONG_INPUT_WORKERS)
+async_thread_locks = {}   # {thread_key: [asyncio.Lock, usuários]} para manter a ordem por thread
+async_pending = 0         # respostas enfileiradas ou em execução
+async_tasks = set()       # referências às tarefas em andamento
+
+@contextlib.asynccontextmanager
+async def ordered_by_thread(thread_key):
+    # Executa uma resposta por vez em cada thread do Slack, na ordem de chegada
+    entry = async_thread_locks.setdefault(thread_key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            async_thread_locks.pop(thread_key, None)
+
+async def ask_chatgpt_async(text, user_id, channel_id, thread_ts=None, ts=None, event_id=None):
+    global async_pending
+    current_time_float = time.time()
+    
+    # Etapa de admissão: evita respostas duplicadas e aplica cooldown por usuário/canal/thread
+    # (com backend compartilhado a reivindicação é uma chamada de rede, feita fora do loop)
+    stage_start = time.perf_counter()
+    cooldown = channel_cooldown(channel_id)
+    if claims.shared:
+        message_key = await asyncio.to_thread(admission.admit, user_id, channel_id, thread_ts, ts, cooldown)
+    else:
+        message_key = admission.admit(user_id, channel_id, thread_ts, ts, cooldown)
+    record_stage("admissao", time.perf_counter() - stage_start)
+    if message_key is None:
+        event_journal.mark(event_id, "ignorado")
+        return
+    
+    status = "erro"
+    try:
+        bot_user_id = get_bot_user_id()
+        if not bot_user_id:
             return
+        event_journal.mark(event_id, "respondendo")
         
-        # Verifica se o texto realmente mudou (ignora atualizações de metadados)
-        if current_text == previous_text:
+        # Registra a participação da Livia na thread (DMs não precisam do índice); fora do loop, pois
+        # publica no backend de coordenação e de tempos em tempos grava o índice em JSON
+        if not channel_id.startswith("D"):
+            await asyncio.to_thread(eligibility.add, channel_id, thread_ts or ts)
+        
+        user_name, channel_name = await asyncio.to_thread(determine_channel_and_user_names, channel_id, user_id)
+        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        plan = plan_reply(text, user_id, channel_id, thread_ts, ts, channel_name)
+        
+        # Pergunta avulsa repetida: responde do cache de respostas (o SQLite é lido fora do loop)
+        cache_key = plan["cache_key"]
+        cached_response = None
+        if cache_key:
+            if response_cache.path:
+                cached_response = await asyncio.to_thread(response_cache.get, cache_key)
+            else:
+                cached_response = response_cache.get(cache_key)
+        if cached_response:
+            await deliver_cached_reply_async(channel_id, thread_ts, bot_user_id, cached_response)
+            log_reply_sent(user_id, channel_id, cached=True)
+            registro_uso(user_id, user_name, channel_name, current_time, "Cache", int((time.time() - current_time_float) * 1000))
+            status = "respondido"
+            return
+        
+        # Backpressure: recusa quando há respostas demais pendentes
+        if async_pending >= MAX_QUEUE_DEPTH:
+            await post_message_to_slack_async(channel_id, BUSY_MESSAGE, thread_ts, max_retries=1)
+            registro_uso(user_id, user_name, channel_name, current_time, "Ocupada")
+            status = "ocupada"
             return
         
-        channel_id = event["channel"]
-        text = current_text
-        user_id = message_data["user"]
-        ts = message_data.get("ts")
-        thread_ts = message_data.get("thread_ts")
-        bot_user_id = app.client.auth_test()["user_id"]
+        status_message_ts = await post_message_to_slack_async(channel_id, plan["please_wait_message"], thread_ts)
+        
+        async_pending += 1
+        submitted_at = time.perf_counter()
+        try:
+            async with ordered_by_thread((channel_id, thread_ts or ts)):
+                async with model_semaphore:
+                    record_stage("fila_modelo", time.perf_counter() - submitted_at)
+                    usage = await reply_async(plan, user_id, channel_id, thread_ts, ts, bot_user_id, status_message_ts)
+        finally:
+            async_pending -= 1
+        
+        latency_ms = int((time.time() - current_time_float) * 1000)
+        registro_uso(user_id, user_name, channel_name, current_time, plan["prompt_type"], latency_ms, usage)
+        record_first_reply(latency_ms / 1000)
+        status = "respondido"
+    finally:
+        event_journal.mark(event_id, status)
+        if claims.shared:
+            await asyncio.to_thread(admission.release, message_key)
+        else:
+            admission.release(message_key)
+
+async def reply_async(plan, user_id, channel_id, thread_ts, ts, bot_user_id, status_message_ts):
+    # Contexto, modelo e entrega de uma resposta no modo assíncrono (plan vem de plan_reply);
+    # retorna o uso de tokens
+    placeholder_reused = False
+    usage = None
+    part_usage = None
+    stage_start = time.perf_counter()
+    try:
+        reduced_text = None
+        if plan["route"] == "longo":
+            progress = ProgressReporter(channel_id, status_message_ts)
+            reduced_text, part_usage = await map_long_input_async(plan["text"], plan["model"], progress.update_async)
+            stage_start = record_stage_since("partes", stage_start)
+        
+        messages = []
+        if is_thread_reply(thread_ts, ts):
+            messages = await asyncio.to_thread(fetch_conversation_history, channel_id, thread_ts)
+        conversation_history = assemble_conversation(messages, plan, user_id, bot_user_id, thread_ts, ts, reduced_text)
+        conversation_history = await asyncio.to_thread(build_context_window, conversation_history, plan["system_prompt"],
+                                                       (channel_id, thread_ts))
+        stage_start = record_stage_since("contexto", stage_start)
+        
+        if STREAMING:
+            writer = AsyncSlackStreamWriter(channel_id, thread_ts, status_message_ts)
+            placeholder_reused = status_message_ts is not None
+            response, usage = await gpt_stream_async(conversation_history, plan["system_prompt"], writer.feed,
+                                                     **plan["model_options"])
+            stage_start = record_stage_since("modelo", stage_start)
+            await writer.finish(response)
+            delivered = zip(writer.message_ts, writer.sent)
+        else:
+            response, usage = await gpt_async(conversation_history, plan["system_prompt"], **plan["model_options"])
+            stage_start = record_stage_since("modelo", stage_start)
+            delivered = [(await post_message_to_slack_async(channel_id, part, thread_ts), part)
+                         for part in split_slack_message(limpar_formatacao(response))]
+        
+        record_delivery(channel_id, thread_ts, bot_user_id, delivered)
+        record_stage_since("entrega", stage_start)
+        cache_key = plan["cache_key"]
+        if cache_key and is_cacheable_reply(response, usage):
+            if response_cache.path:
+                await asyncio.to_thread(response_cache.set, cache_key, response)
+            else:
+                response_cache.set(cache_key, response)
+        
+        log_reply_sent(user_id, channel_id)
+    except Exception as e:
+        metrics.inc("livia_erros_total", local="resposta", tipo=type(e).__name__)
+    finally:
+        if status_message_ts and not placeholder_reused:
+            await delete_message_from_slack_async(channel_id, status_message_ts)
+            thread_store.discard(channel_id, thread_ts, status_message_ts)
+    return add_usage(usage, part_usage)
+
+async def map_long_input_async(text, model, on_progress=None):
+    """Versão assíncrona de map_long_input (partes limitadas por long_input_semaphore)"""
+    chunks = await asyncio.to_thread(plan_long_input, text)
+    payloads = long_input_part_payloads(text, chunks, model)
+    
+    async def run_part(i, request_payload):
+        try:
+            async with long_input_semaphore:
+                response, reserved, _ = await model_gateway.complete_async(request_payload)
+            content, usage = long_input_part_result(response, reserved)
+            metrics.inc("livia_partes_total", resultado="sucesso")
+            return i, content, usage
+        except Exception as e:
+            metrics.inc("livia_partes_total", resultado="falha")
+            return i, None, None
+    
+    results = [None] * len(chunks)
+    usage = None
+    parts = [run_part(i, payload) for i, payload in enumerate(payloads)]
+    for done, next_part in enumerate(asyncio.as_completed(parts), 1):
+        i, results[i], part_usage = await next_part
+        usage = add_usage(usage, part_usage)
+        if on_progress:
+            await on_progress(done, len(chunks))
+    if not any(results):
+        return None, usage
+    return await asyncio.to_thread(long_input_reduce_text, text, results), usage
+
+async def deliver_cached_reply_async(channel_id, thread_ts, bot_user_id, response):
+    # Versão assíncrona de deliver_cached_reply
+    delivered = [(await post_message_to_slack_async(channel_id, part, thread_ts), part)
+                 for part in split_slack_message(limpar_formatacao(response))]
+    record_delivery(channel_id, thread_ts, bot_user_id, delivered)
+
+    # Chama a API da OpenAI sem bloquear o event loop
+async def gpt_async(conversation_history, system_prompt, model="o3-mini", max_completion_tokens=4095, reasoning_effort="medium"):
+    request_payload = build_gpt_payload(conversation_history, system_prompt, model, max_completion_tokens, reasoning_effort)
+    started_at = time.perf_counter()
+    try:
+        response, reserved, route = await model_gateway.complete_async(request_payload)
+        return completion_reply(response, reserved, route, started_at)
+    except Exception as e:
+        return model_error_reply(e)
+
+async def gpt_stream_async(conversation_history, system_prompt, on_text, model="o3-mini", max_completion_tokens=4095, reasoning_effort="medium"):
+    request_payload = build_stream_payload(conversation_history, system_prompt, model, max_completion_tokens, reasoning_effort)
+    reply = StreamedReply()
+    try:
+        stream, reserved, route = await model_gateway.complete_async(request_payload, stream=True)
+        reply.opened(reserved, route)
+        async for chunk in stream:
+            delta = reply.text_of(chunk)
+            if delta:
+                await on_text(delta)
+    except Exception as e:
+        return reply.failed(e)
+    return reply.finished()
+
+class AsyncSlackStreamWriter(SlackStreamWriter):
+    """SlackStreamWriter para o modo assíncrono (edições via AsyncWebClient)"""
+
+    async def feed(self, delta):
+        partial = self._add(delta)
+        if partial:
+            await self._flush(partial)
+
+    async def finish(self, text):
+        await self._flush(text, final=True)
+
+    async def _flush(self, text, final=False):
+        segments, changes = self._changed_segments(text)
+        for i, segment, message_ts in changes:
+            if message_ts:
+                if await update_message_in_slack_async(self.channel_id, message_ts, segment, wait=final):
+                    self.sent[i] = segment
+                    continue
+                if not final:
+                    break
+            new_ts = await post_message_to_slack_async(self.channel_id, segment, self.thread_ts)
+            if new_ts:
+                replaced_ts = self._posted(i, new_ts, segment)
+                if replaced_ts:
+                    await delete_message_from_slack_async(self.channel_id, replaced_ts)
+        if final:
+            for extra_ts in self._trim(segments):
+                await delete_message_from_slack_async(self.channel_id, extra_ts)
+
+async def post_message_to_slack_async(channel_id, text, thread_ts=None, max_retries=3):
+    """Posta mensagem no Slack com retry automático sem bloquear o event loop"""
+    if not text:
+        return None
+    
+    for attempt in range(max_retries):
+        try:
+            response = await slack_call_async(
+                "chat.postMessage",
+                channel=channel_id,
+                text=text,
+                thread_ts=thread_ts
+            )
+            if response and response.get("ok"):
+                return response.get("ts")
+        except Exception as e:
+            if is_permanent_post_error(e):
+                return None
+        
+        if attempt < max_retries - 1:
+            await asyncio.sleep(1 + attempt)  # Delay progressivo
+    
+    return None
+
+async def update_message_in_slack_async(channel_id, ts, text, wait=True):
+    if not wait and not try_reserve_update():
+        return False
+    try:
+        response = await slack_call_async("chat.update", acquired=not wait, channel=channel_id, ts=ts, text=text)
+        return bool(response and response.get("ok"))
+    except Exception as e:
+        return False
+
+async def delete_message_from_slack_async(channel_id, ts):
+    try:
+        await slack_call_async("chat.delete", channel=channel_id, ts=ts)
+    except Exception as e:
+        pass
+
+async def process_message_event_async(body):
+    """Mesmo pipeline de process_message_event, com admissão, modelo e entrega assíncronos"""
+    observe_event_queue_wait(body)
+    status = "ignorado"
+    try:
+        status, message, bot_user_id = triage_event(body)
+        if message is None:
+            return
         
-        # Responde sempre em mensagens diretas editadas
-        if event["channel_type"] == "im":
-            ask_chatgpt(text, user_id, channel_id, thread_ts or ts, ts)
+        # A elegibilidade é decidida em memória; só threads anteriores ao índice consultam o Slack
+        stage_start = time.perf_counter()
+        reason = await asyncio.to_thread(classify_message, message, bot_user_id)
+        record_stage_since("elegibilidade", stage_start)
+        if reason is None:
             return
-            
-        # Responde se o bot foi mencionado na mensagem editada
-        if f"<@{bot_user_id}>" in text:
-            ask_chatgpt(text, user_id, channel_id, thread_ts or ts, ts)
+        
+        if not (await asyncio.to_thread(claim_event, body) if claims.shared else claim_event(body)):
+            status = "duplicado"
             return
-            
+        
+        status = None
+        await ask_chatgpt_async(message["text"], message["user_id"], message["channel_id"], reply_thread_ts(message, reason),
+                                message["ts"], body.get("event_id"))
+    
     except Exception as e:
+        status = "erro"
+        metrics.inc("livia_erros_total", local="evento", tipo=type(e).__name__)
+    finally:
+        if status:
+            event_journal.mark(body.get("event_id"), status)
+
+def create_async_app():
+    # Cria o AsyncApp e registra os mesmos handlers do modo de threads
+    from slack_bolt.async_app import AsyncApp
+    from slack_sdk.web.async_client import AsyncWebClient
+    
+    new_app = AsyncApp(client=AsyncWebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL), process_before_response=True)
+    
+    @new_app.event("app_home_opened")
+    async def handle_app_home_opened_events_async(body, logger):
         pass
+    
+    @new_app.event("user_change")
+    async def handle_user_change_events_async(body, logger):
+        handle_user_change_events(body, logger)
+    
+    @new_app.event("channel_rename")
+    @new_app.event("group_rename")
+    async def handle_channel_rename_events_async(body, logger):
+        handle_channel_rename_events(body, logger)
+    
+    @new_app.event("message")
+    async def handle_message_events_async(body, logger, ack):
+        # Resposta imediata para evitar retries do Slack; o processamento segue numa tarefa
+        await ack()
+        body["livia_recebido_em"] = time.time()
+        if event_journal.running:
+            event_journal.append(body)
+        else:
+            start_event_task(body)
+    
+    return new_app
+
+def start_event_task(body):
+    # Processa o evento numa tarefa do loop, mantendo a referência até terminar
+    task = asyncio.get_running_loop().create_task(process_message_event_async(body))
+    async_tasks.add(task)
+    task.add_done_callback(async_tasks.discard)
+
+async def run_async_runtime():
+    """Executa a Livia no modo asyncio até o socket ser encerrado"""
+    global async_app, async_client, model_semaphore, long_input_semaphore
+    import httpx
+    from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+    from openai import AsyncOpenAI
+    
+    async_client = AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        base_url=OPENAI_BASE_URL,
+        max_retries=0,
+        http_client=httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=MODEL_WORKERS + LONG_INPUT_WORKERS + 4,
+            max_keepalive_connections=MODEL_WORKERS
+        ))
+    )
+    model_semaphore = asyncio.Semaphore(MODEL_WORKERS)
+    long_input_semaphore = asyncio.Semaphore(LONG_INPUT_WORKERS)
+    with startup_step("app_async"):
+        async_app = create_async_app()
+    
+    # Abre o pool assíncrono da OpenAI antes da primeira mensagem
+    started_at = time.perf_counter()
+    try:
+        await async_client.models.list()
+    except Exception as e:
+        print(f"⚠️ Aquecimento da OpenAI (asyncio) falhou: {e}")
+    startup_timings["pool_openai_async"] = time.perf_counter() - started_at
+    
+    # O escritor do journal roda em outro thread e devolve os eventos ao loop após o commit
+    loop = asyncio.get_running_loop()
+    if event_journal.start(lambda body: loop.call_soon_threadsafe(start_event_task, body)):
+        for body in event_journal.replay():
+            start_event_task(body)
+    report_startup()
+    handler = AsyncSocketModeHandler(async_app, SLACK_APP_TOKEN)
+    try:
+        await handler.start_async()
+    finally:
+        # Encerramento gracioso: aguarda as respostas em andamento
+        await handler.close_async()
+        if async_tasks:
+            await asyncio.wait(list(async_tasks), timeout=30)
+        await async_client.close()
+
+# Ciclo de vida: criação do app, serviços em segundo plano e aquecimento antes de aceitar eventos
+startup_timings = {}  # {etapa: segundos}
+first_reply_lock = Lock()
+first_reply = {"latencia": None}
+
+@contextlib.contextmanager
+def startup_step(name):
+    # Mede uma etapa da inicialização
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - started_at
+        metrics.set("livia_inicializacao_segundos", startup_timings[name], etapa=name)
+
+def create_app():
+    """Cria o App do Slack e o cliente OpenAI e registra os handlers (sem chamadas de rede)"""
+    global app, client
+    with startup_step("app"):
+        import httpx
+        from openai import OpenAI
+        from slack_bolt import App
+        from slack_sdk import WebClient
+        
+        # A identidade do bot é resolvida no aquecimento, não no construtor do App
+        app = App(
+            client=WebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL),
+            process_before_response=True,
+            token_verification_enabled=False
+        )
+        # Pool de conexões HTTP compartilhado, dimensionado para o número de workers do modelo;
+        # os retries ficam a cargo do gateway do modelo (max_retries=0)
+        client = OpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            max_retries=0,
+            http_client=httpx.Client(limits=httpx.Limits(
+                max_connections=MODEL_WORKERS + LONG_INPUT_WORKERS + 4,
+                max_keepalive_connections=MODEL_WORKERS
+            ))
+        )
+        register_handlers(app)
+    return app
+
+def register_handlers(target_app):
+    target_app.event("app_home_opened")(handle_app_home_opened_events)
+    target_app.event("user_change")(handle_user_change_events)
+    target_app.event("channel_rename")(handle_channel_rename_events)
+    target_app.event("group_rename")(handle_channel_rename_events)
+    target_app.event("message")(handle_message_events)
+
+def start_services():
+    """Carrega o índice de threads e inicia o registro de uso, o monitor de saúde e as métricas"""
+    with startup_step("servicos"):
+        if claims.shared:
+            print(f"🤝 Coordenação entre instâncias: {CLAIM_BACKEND} (instância {INSTANCE_ID})")
+        eligibility.load()
+        usage_logger.start()
+        Thread(target=health_monitor, daemon=True).start()
+        start_metrics_server()
+
+def warm_up():
+    """Aquecimento antes de aceitar eventos: identidade do bot, pool HTTP da OpenAI, tokenizador e nomes"""
+    with startup_step("identidade"):
+        if not refresh_bot_identity():
+            raise RuntimeError("auth_test falhou")
+    print(f"✅ Conectado ao Slack! (bot: {bot_identity['user_id']})")
+    
+    # Abre a conexão TLS do pool (e valida a chave) antes da primeira mensagem
+    with startup_step("pool_openai"):
+        try:
+            client.models.list()
+        except Exception as e:
+            print(f"⚠️ Aquecimento da OpenAI falhou: {e}")
+    
+    with startup_step("tokenizador"):
+        load_token_encoding()
+    
+    with startup_step("diretorio"):
+        if DIRECTORY_PREFILL:
+            prefill_directory_cache()
+        else:
+            prefill_recent_channels()
+
+def report_startup():
+    # Mostra quanto tempo cada etapa levou até a Livia ficar pronta
+    total = time.perf_counter() - import_started_at
+    metrics.set("livia_inicializacao_segundos", total, etapa="total")
+    steps = ", ".join(f"{name}: {seconds:.2f}s" for name, seconds in startup_timings.items())
+    print(f"🚀 Livia pronta em {total:.2f}s ({steps})")
+
+def record_first_reply(latency_seconds):
+    # Registra a latência da primeira resposta desde a inicialização
+    with first_reply_lock:
+        if first_reply["latencia"] is not None:
+            return
+        first_reply["latencia"] = latency_seconds
+    metrics.set("livia_primeira_resposta_segundos", latency_seconds)
+    print(f"🥇 Primeira resposta em {latency_seconds * 1000:.0f} ms "
+          f"({time.perf_counter() - import_started_at:.1f}s após o início)")
+
+startup_timings["importacao"] = time.perf_counter() - import_started_at
 
 if __name__ == "__main__":
     # Mostra quais chaves estão sendo carregadas
@@ -561,10 +3859,33 @@ if __name__ == "__main__":
     print("🔗 Conectando ao Slack...")
     
     try:
-        # Testa conexão com Slack
-        auth_test = app.client.auth_test()
-        print("✅ Conectado ao Slack!")
-        SocketModeHandler(app, SLACK_APP_TOKEN).start()
+        # O app síncrono também atende o modo asyncio (identidade, diretório e consultas em to_thread)
+        create_app()
+        start_services()
+        warm_up()
+        if RUNTIME == "asyncio":
+            print("⚡ Modo assíncrono (asyncio)")
+            asyncio.run(run_async_runtime())
+        else:
+            from slack_bolt.adapter.socket_mode import SocketModeHandler
+            dispatcher.start()
+            if event_journal.start(enqueue_event):
+                replayed = event_journal.replay()
+                if replayed:
+                    print(f"🔁 Reprocessando {len(replayed)} eventos sem resposta do journal")
+                for body in replayed:
+                    enqueue_event(body)
+            report_startup()
+            SocketModeHandler(app, SLACK_APP_TOKEN).start()
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         print(f"❌ Erro ao conectar: {e}")
         print("❌ Livia não está funcionando.")
+    finally:
+        # Encerramento gracioso: termina as respostas em andamento antes de sair
+        print("🛑 Encerrando workers...")
+        dispatcher.stop()
+        event_journal.stop()
+        usage_logger.stop()
+        eligibility.save()
@@ -0,0 +1,280 @@
+# benchmark.py - Teste de carga offline da Livia com Slack e OpenAI falsos
+#
+# Uso: python bench/benchmark.py [--cenario todos|dm|thread|edicao|duplicado] [--eventos 200] ...
+#
+# Os eventos entram por handle_message_events (o mesmo handler que o Socket Mode chama após
+# o ack), e todas as chamadas de saída vão para os servidores de bench/servidores_falsos.py.
+
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from servidores_falsos import BOT_USER_ID, FakeOpenAI, FakeSlack
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark offline da Livia")
+    parser.add_argument("--cenario", default="todos", choices=["todos", "dm", "thread", "edicao", "duplicado", "misto"])
+    parser.add_argument("--eventos", type=int, default=200, help="eventos por cenário")
+    parser.add_argument("--intervalo", type=float, default=0.005, help="segundos entre eventos enviados")
+    parser.add_argument("--ttft", type=float, default=0.3, help="latência até o primeiro token do modelo falso")
+    parser.add_argument("--intervalo-token", type=float, default=0.01, help="segundos entre tokens do modelo falso")
+    parser.add_argument("--tokens", type=int, default=60, help="tokens por resposta do modelo falso")
+    parser.add_argument("--latencia-slack", type=float, default=0.02, help="latência de cada chamada à Web API falsa")
+    parser.add_argument("--sem-streaming", action="store_true", help="executa com LIVIA_STREAMING=0")
+    parser.add_argument("--limites-reais", action="store_true",
+                        help="mantém os limites de taxa do Slack/OpenAI (por padrão ficam altos para medir o caminho quente)")
+    parser.add_argument("--timeout", type=float, default=120, help="espera máxima por cenário (s)")
+    parser.add_argument("--json", help="grava o relatório neste arquivo")
+    parser.add_argument("--limite-p95", type=float, help="sai com código 1 se o p95 de algum cenário passar disso (ms)")
+    return parser.parse_args()
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    # Percentil pelo método nearest-rank
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+class ThreadSampler:
+    """Amostra threading.active_count() para registrar o pico de threads"""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+class EventFactory:
+    """Gera corpos de eventos do Events API no formato entregue pelo Socket Mode"""
+
+    def __init__(self, slack):
+        self.slack = slack
+        self.counter = 0
+
+    def tag(self):
+        self.counter += 1
+        return f"bench-{self.counter}"
+
+    def body(self, event):
+        return {"type": "event_callback", "event_id": f"Ev{self.counter:08d}", "event_time": int(time.time()), "event": event}
+
+    def message(self, channel, user, text, channel_type="channel", thread_ts=None):
+        event = {"type": "message", "channel": channel, "channel_type": channel_type, "user": user,
+                 "text": text, "ts": self.slack.next_ts()}
+        if thread_ts:
+            event["thread_ts"] = thread_ts
+        self.slack.add_user_message(channel, event)
+        return event
+
+    def edit(self, original, text):
+        edited = dict(original, text=text, edited={"user": original["user"], "ts": self.slack.next_ts()})
+        return {"type": "message", "subtype": "message_changed", "channel": original["channel"],
+                "channel_type": original["channel_type"], "hidden": True, "ts": self.slack.next_ts(),
+                "message": edited, "previous_message": dict(original)}
+
+def dm_storm(factory, n):
+    # Muitas DMs simultâneas, cada uma de um usuário diferente
+    for _ in range(n):
+        tag = factory.tag()
+        yield tag, factory.body(factory.message(f"D{tag}", f"U{tag}", f"Oi Livia, tudo bem? {tag}", channel_type="im"))
+
+def long_thread(factory, n):
+    # Uma thread longa: a primeira mensagem menciona a Livia, as seguintes só respondem na thread
+    tag = factory.tag()
+    root = factory.message(f"C{tag}", f"U{tag}", f"<@{BOT_USER_ID}> vamos revisar o briefing {tag}")
+    yield tag, factory.body(root)
+    for _ in range(1, n):
+        tag = factory.tag()
+        # Um usuário por mensagem para não cair no cooldown por usuário
+        yield tag, factory.body(factory.message(root["channel"], f"U{tag}", f"Mais um ponto sobre o briefing {tag}",
+                                                thread_ts=root["ts"]))
+
+def edit_burst(factory, n, edits_per_message=4):
+    # Mensagens com menção seguidas de rajadas de edições do mesmo texto
+    for _ in range(max(1, n // (edits_per_message + 1))):
+        tag = factory.tag()
+        original = factory.message("CEDICAO", f"U{tag}", f"<@{BOT_USER_ID}> resume isso {tag}")
+        yield tag, factory.body(original)
+        for j in range(edits_per_message):
+            tag = factory.tag()
+            yield tag, factory.body(factory.edit(original, f"<@{BOT_USER_ID}> resume isso (v{j + 2}) {tag}"))
+
+def duplicates(factory, n):
+    # Cada evento é entregue duas vezes, como nos retries do Slack
+    for _ in range(max(1, n // 2)):
+        tag = factory.tag()
+        body = factory.body(factory.message(f"D{tag}", f"U{tag}", f"Pergunta repetida {tag}", channel_type="im"))
+        yield tag, body
+        yield tag, json.loads(json.dumps(body))
+
+def mixed(factory, n):
+    # Intercala os cenários anteriores
+    generators = [dm_storm(factory, n // 4), long_thread(factory, n // 4), edit_burst(factory, n // 4), duplicates(factory, n // 4)]
+    while generators:
+        for generator in list(generators):
+            item = next(generator, None)
+            if item is None:
+                generators.remove(generator)
+            else:
+                yield item
+
+SCENARIOS = {"dm": dm_storm, "thread": long_thread, "edicao": edit_burst, "duplicado": duplicates, "misto": mixed}
+
+def wait_until_idle(livia, slack, timeout, quiet=1.0):
+    # Espera a fila esvaziar e a API falsa ficar sem chamadas novas por `quiet` segundos
+    deadline = time.time() + timeout
+    last_total, last_change = -1, time.time()
+    while time.time() < deadline:
+        total = sum(slack.calls.values())
+        if total != last_total:
+            last_total, last_change = total, time.time()
+        busy = livia.dispatcher.queue_depth() or livia.dispatcher.pending_replies() or livia.admission.in_flight()
+        if not busy and time.time() - last_change >= quiet:
+            return True
+        time.sleep(0.05)
+    return False
+
+def drop_counters(livia):
+    # Eventos e respostas descartados sem resposta normal (fila cheia, pendências demais, evento velho)
+    return {
+        "fila_eventos": livia.dispatcher.stats["eventos_recusados"],
+        "respostas_pendentes": livia.dispatcher.stats["respostas_recusadas"],
+        "evento_expirado": livia.event_stats["expirados"],
+    }
+
+def run_scenario(name, factory, livia, slack, openai_server, args):
+    slack.reset_counters()
+    openai_server.reset_counters()
+    drops_before = drop_counters(livia)
+    sent = {}
+    events = 0
+    started_at = time.perf_counter()
+    with ThreadSampler() as sampler:
+        for tag, body in SCENARIOS[name](factory, args.eventos):
+            sent.setdefault(tag, time.perf_counter())
+            livia.handle_message_events(body, None, lambda *a, **k: None)
+            events += 1
+            if args.intervalo:
+                time.sleep(args.intervalo)
+        finished = wait_until_idle(livia, slack, args.timeout)
+    latencies = [(slack.delivered[tag] - sent[tag]) * 1000 for tag in slack.delivered if tag in sent]
+    last_delivery = max(slack.delivered.values(), default=started_at)
+    replies = len(slack.delivered)
+    slack_calls = dict(slack.calls)
+    slack_total = sum(slack_calls.values())
+    openai_total = sum(openai_server.calls.values())
+    return {
+        "cenario": name,
+        "eventos": events,
+        "respostas": replies,
+        "respostas_duplicadas": sum(len(d) - 1 for d in slack.deliveries.values()),
+        "ocupada": slack.busy_replies,
+        "descartes": {reason: count - drops_before[reason] for reason, count in drop_counters(livia).items()},
+        "concluido": finished,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "vazao_respostas_s": replies / (last_delivery - started_at) if replies and last_delivery > started_at else 0.0,
+        "slack_chamadas_por_resposta": slack_total / replies if replies else None,
+        "openai_chamadas_por_resposta": openai_total / replies if replies else None,
+        "slack_chamadas": slack_calls,
+        "openai_chamadas": dict(openai_server.calls),
+        "pico_threads": sampler.peak,
+    }
+
+def print_report(results):
+    print()
+    print(f"{'cenário':<10} {'eventos':>7} {'resp.':>6} {'dup.':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'resp/s':>7} {'slack/r':>8} {'oai/r':>6} {'threads':>7}")
+    fmt = lambda v, spec: "-" if v is None else format(v, spec)
+    for r in results:
+        print(f"{r['cenario']:<10} {r['eventos']:>7} {r['respostas']:>6} {r['respostas_duplicadas']:>5} "
+              f"{fmt(r['p50_ms'], '8.0f')} {fmt(r['p95_ms'], '8.0f')} {fmt(r['p99_ms'], '8.0f')} "
+              f"{r['vazao_respostas_s']:>7.1f} {fmt(r['slack_chamadas_por_resposta'], '8.2f')} "
+              f"{fmt(r['openai_chamadas_por_resposta'], '6.2f')} {r['pico_threads']:>7}")
+    for r in results:
+        calls = ", ".join(f"{method}={count}" for method, count in sorted(r["slack_chamadas"].items()))
+        status = "" if r["concluido"] else " (timeout)"
+        drops = ", ".join(f"{reason}={count}" for reason, count in r["descartes"].items())
+        print(f"  {r['cenario']}{status}: {calls}; ocupada={r['ocupada']}; descartes: {drops}")
+
+def configure_environment(args, slack, openai_server, workdir):
+    # Precisa acontecer antes de importar Livia: a configuração é lida no import
+    os.environ.update({
+        "SLACK_BOT_TOKEN": "xoxb-bench",
+        "SLACK_APP_TOKEN": "xapp-bench",
+        "OPENAI_API_KEY": "sk-bench",
+        "LIVIA_SLACK_API_URL": f"{slack.url}/api/",
+        "LIVIA_OPENAI_BASE_URL": f"{openai_server.url}/v1",
+        "LIVIA_METRICS_PORTA": "0",
+        "LIVIA_USO_ARQUIVO": os.path.join(workdir, "registro_uso.csv"),
+        "LIVIA_THREADS_ARQUIVO": os.path.join(workdir, "livia_threads.json"),
+        "LIVIA_USO_DB": os.path.join(workdir, "registro_uso.db"),
+        "LIVIA_JOURNAL_ARQUIVO": os.path.join(workdir, "livia_eventos.db"),
+        "LIVIA_CANAIS_ARQUIVO": os.path.join(workdir, "livia_canais.json"),
+        "LIVIA_COORDENACAO_ARQUIVO": os.path.join(workdir, "livia_coordenacao.db"),
+        "LIVIA_CACHE_RESPOSTAS": "0",  # respostas do cache distorceriam as medidas
+        "LIVIA_STREAMING": "0" if args.sem_streaming else "1",
+    })
+
+def main():
+    args = parse_args()
+    slack = FakeSlack(latency=args.latencia_slack).start()
+    openai_server = FakeOpenAI(ttft=args.ttft, token_interval=args.intervalo_token, tokens=args.tokens).start()
+    workdir = tempfile.mkdtemp(prefix="livia-bench-")
+    configure_environment(args, slack, openai_server, workdir)
+
+    import Livia as livia
+    slack.busy_text = livia.BUSY_MESSAGE
+    if not args.limites_reais:
+        for bucket in list(livia.slack_buckets.values()) + [livia.openai_request_bucket, livia.openai_token_bucket]:
+            bucket.rate = bucket.capacity = bucket.tokens = 1e9
+    livia.create_app()
+    livia.start_services()
+    livia.warm_up()
+    livia.dispatcher.start()
+
+    names = ["dm", "thread", "edicao", "duplicado", "misto"] if args.cenario == "todos" else [args.cenario]
+    factory = EventFactory(slack)  # compartilhado para que tags e IDs não se repitam entre cenários
+    results = []
+    try:
+        for name in names:
+            print(f"▶️ Cenário {name}...")
+            results.append(run_scenario(name, factory, livia, slack, openai_server, args))
+    finally:
+        livia.dispatcher.stop()
+        livia.usage_logger.stop()
+        slack.stop()
+        openai_server.stop()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.limite_p95 is not None and any((r["p95_ms"] or 0) > args.limite_p95 for r in results):
+        print(f"❌ p95 acima de {args.limite_p95:.0f} ms")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
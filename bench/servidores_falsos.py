@@ -0,0 +1,377 @@
+# servidores_falsos.py - Servidores locais que imitam a Web API do Slack e a API da OpenAI
+# Usados pelo benchmark (bench/benchmark.py) via LIVIA_SLACK_API_URL e LIVIA_OPENAI_BASE_URL
+
+import json
+import re
+import socketserver
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+BOT_USER_ID = "UBENCHBOT"
+BOT_ID = "BBENCHBOT"
+REPLY_MARKER = re.compile(r"fim-(bench-\d+)")
+
+class FakeServer:
+    """Servidor HTTP em thread própria numa porta livre de 127.0.0.1"""
+
+    def __init__(self, handler_class):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        self.httpd.daemon_threads = True
+        self.httpd.state = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # mantém conexões vivas, como as APIs reais
+
+    def read_params(self):
+        # Parâmetros da query string, de formulário ou de corpo JSON
+        parsed = urlparse(self.path)
+        params = dict(parse_qsl(parsed.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            raw = self.rfile.read(length).decode("utf-8")
+            if "json" in (self.headers.get("Content-Type") or ""):
+                params.update(json.loads(raw or "{}"))
+            else:
+                params.update(parse_qsl(raw))
+        return parsed.path, params
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeSlack(FakeServer):
+    """Web API do Slack em memória: mensagens por thread, contagem de chamadas e entregas marcadas.
+
+    As respostas do modelo falso terminam com "fim-bench-N"; a primeira vez que esse marcador
+    aparece numa mensagem postada ou editada marca a entrega da resposta ao evento bench-N.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__(FakeSlackHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.threads = defaultdict(list)     # {(canal, thread_ts): [mensagens]}
+        self.message_index = {}              # {(canal, ts): mensagem}
+        self.delivered = {}                  # {tag: perf_counter da primeira entrega}
+        self.deliveries = defaultdict(set)   # {tag: {(canal, ts)}} mensagens distintas com a resposta
+        self.busy_replies = 0
+        self.busy_text = None
+        self._clock = time.time()
+
+    def next_ts(self):
+        with self.lock:
+            self._clock = max(self._clock + 0.000001, time.time())
+            return f"{self._clock:.6f}"
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls.clear()
+            self.delivered.clear()
+            self.deliveries.clear()
+            self.busy_replies = 0
+
+    def add_user_message(self, channel, message):
+        # Registra mensagens de usuários (enviadas pelo benchmark) para conversations.replies
+        with self.lock:
+            self._store(channel, dict(message))
+
+    def _store(self, channel, message):
+        thread_ts = message.get("thread_ts") or message["ts"]
+        self.threads[(channel, thread_ts)].append(message)
+        self.message_index[(channel, message["ts"])] = message
+
+    def _mark_delivery(self, channel, ts, text):
+        match = REPLY_MARKER.search(text or "")
+        if match:
+            tag = match.group(1)
+            self.delivered.setdefault(tag, time.perf_counter())
+            self.deliveries[tag].add((channel, ts))
+        elif self.busy_text and text == self.busy_text:
+            self.busy_replies += 1
+
+    def handle(self, method, params):
+        with self.lock:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if method == "auth.test":
+            return {"ok": True, "user_id": BOT_USER_ID, "bot_id": BOT_ID, "user": "livia", "team_id": "TBENCH"}
+        if method == "chat.postMessage":
+            ts = self.next_ts()
+            message = {"type": "message", "user": BOT_USER_ID, "bot_id": BOT_ID, "text": params.get("text", ""), "ts": ts}
+            if params.get("thread_ts"):
+                message["thread_ts"] = params["thread_ts"]
+            with self.lock:
+                self._store(params["channel"], message)
+                self._mark_delivery(params["channel"], ts, message["text"])
+            return {"ok": True, "channel": params["channel"], "ts": ts, "message": message}
+        if method == "chat.update":
+            with self.lock:
+                message = self.message_index.get((params["channel"], params["ts"]))
+                if message is None:
+                    return {"ok": False, "error": "message_not_found"}
+                message["text"] = params.get("text", "")
+                self._mark_delivery(params["channel"], params["ts"], message["text"])
+            return {"ok": True, "channel": params["channel"], "ts": params["ts"], "text": message["text"]}
+        if method == "chat.delete":
+            with self.lock:
+                message = self.message_index.pop((params["channel"], params["ts"]), None)
+                if message is not None:
+                    thread = self.threads[(params["channel"], message.get("thread_ts") or message["ts"])]
+                    thread[:] = [m for m in thread if m["ts"] != params["ts"]]
+            return {"ok": True, "channel": params["channel"], "ts": params["ts"]}
+        if method == "conversations.replies":
+            oldest = float(params.get("oldest") or 0)
+            with self.lock:
+                messages = [dict(m) for m in self.threads.get((params["channel"], params["ts"]), [])
+                            if float(m["ts"]) >= oldest]
+            return {"ok": True, "messages": messages, "has_more": False, "response_metadata": {"next_cursor": ""}}
+        if method == "users.info":
+            user = params.get("user", "")
+            return {"ok": True, "user": {"id": user, "name": user.lower(), "real_name": f"Usuário {user}",
+                                         "profile": {"real_name": f"Usuário {user}"}}}
+        if method == "conversations.info":
+            channel = params.get("channel", "")
+            return {"ok": True, "channel": {"id": channel, "name": f"canal-{channel.lower()}", "is_im": channel.startswith("D")}}
+        if method in ("users.list", "conversations.list"):
+            key = "members" if method == "users.list" else "channels"
+            return {"ok": True, key: [], "response_metadata": {"next_cursor": ""}}
+        return {"ok": False, "error": "unknown_method"}
+
+class FakeSlackHandler(JSONHandler):
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        path, params = self.read_params()
+        method = path.rstrip("/").rsplit("/", 1)[-1]
+        self.send_json(self.server.state.handle(method, params))
+
+class FakeOpenAI(FakeServer):
+    """Endpoint /v1/chat/completions compatível com a OpenAI, com latência e streaming configuráveis.
+
+    A resposta tem `tokens` palavras e termina com "fim-bench-N", copiado da última mensagem
+    do usuário; ttft é a espera até o primeiro token e token_interval a espera entre tokens.
+    """
+
+    def __init__(self, ttft=0.3, token_interval=0.01, tokens=60):
+        super().__init__(FakeOpenAIHandler)
+        self.ttft = ttft
+        self.token_interval = token_interval
+        self.tokens = tokens
+        self.lock = threading.Lock()
+        self.calls = Counter()
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls.clear()
+
+    def answer_for(self, payload):
+        last_user = next((m for m in reversed(payload.get("messages", [])) if m.get("role") == "user"), {})
+        content = last_user.get("content", "")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        match = re.search(r"bench-\d+", content)
+        words = ["palavra"] * max(0, self.tokens - 1)
+        words.append(f"fim-{match.group(0)}" if match else "fim")
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in payload.get("messages", [])) // 4
+        return words, prompt_tokens
+
+class FakeOpenAIHandler(JSONHandler):
+    def do_GET(self):
+        # Lista de modelos, usada pelo aquecimento do pool de conexões
+        if urlparse(self.path).path.endswith("/models"):
+            self.send_json({"object": "list", "data": [{"id": "o3-mini", "object": "model", "owned_by": "bench"}]})
+        else:
+            self.send_json({"error": {"message": "not found"}}, status=404)
+
+    def do_POST(self):
+        path, payload = self.read_params()
+        state = self.server.state
+        if not path.endswith("/chat/completions"):
+            self.send_json({"error": {"message": "not found"}}, status=404)
+            return
+        with state.lock:
+            state.calls[payload.get("model", "?")] += 1
+        words, prompt_tokens = state.answer_for(payload)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                 "total_tokens": prompt_tokens + len(words)}
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": payload.get("model")}
+        time.sleep(state.ttft)
+
+        if not payload.get("stream"):
+            time.sleep(state.token_interval * len(words))
+            self.send_json(dict(base, object="chat.completion", usage=usage, choices=[{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": " ".join(words)}}]))
+            return
+
+        # Streaming em Server-Sent Events com transferência chunked
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk = dict(base, object="chat.completion.chunk")
+        self.write_event(dict(chunk, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]))
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(state.token_interval)
+            self.write_event(dict(chunk, choices=[{"index": 0, "delta": {"content": (" " if i else "") + word}, "finish_reason": None}]))
+        self.write_event(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if payload.get("stream_options", {}).get("include_usage"):
+            self.write_event(dict(chunk, choices=[], usage=usage))
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+    def write_event(self, data):
+        self.write_chunk(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+class FakeRedis:
+    """Servidor mínimo do protocolo do Redis (RESP) para testar várias instâncias da Livia.
+
+    Suporta PING, AUTH, SELECT, SET (NX/XX, EX/PX), GET, DEL, EXISTS, PEXPIRE e o EVAL de
+    comparar-e-apagar usado na liberação das reivindicações (qualquer script EVAL é tratado assim).
+    """
+
+    def __init__(self, port=0):
+        self.lock = threading.Lock()
+        self.data = {}  # {chave: (valor, expira_em ou None)}
+        self.calls = Counter()
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", port), FakeRedisHandler)
+        self.server.daemon_threads = True
+        self.server.state = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _get(self, key):
+        entry = self.data.get(key)
+        if entry and entry[1] is not None and entry[1] <= time.time():
+            del self.data[key]
+            return None
+        return entry
+
+    def execute(self, args):
+        command = args[0].upper()
+        with self.lock:
+            self.calls[command] += 1
+            if command in ("PING",):
+                return "+PONG"
+            if command in ("AUTH", "SELECT"):
+                return "+OK"
+            if command == "GET":
+                entry = self._get(args[1])
+                return entry[0] if entry else None
+            if command == "SET":
+                key, value = args[1], args[2]
+                options = [a.upper() for a in args[3:]]
+                expires = None
+                if "PX" in options:
+                    expires = time.time() + int(args[3 + options.index("PX") + 1]) / 1000
+                elif "EX" in options:
+                    expires = time.time() + int(args[3 + options.index("EX") + 1])
+                exists = self._get(key) is not None
+                if ("NX" in options and exists) or ("XX" in options and not exists):
+                    return None
+                self.data[key] = (value, expires)
+                return "+OK"
+            if command == "DEL":
+                return sum(1 for key in args[1:] if self._get(key) is not None and self.data.pop(key))
+            if command == "EXISTS":
+                return sum(1 for key in args[1:] if self._get(key) is not None)
+            if command == "PEXPIRE":
+                entry = self._get(args[1])
+                if not entry:
+                    return 0
+                self.data[args[1]] = (entry[0], time.time() + int(args[2]) / 1000)
+                return 1
+            if command == "EVAL":
+                # EVAL script 1 chave valor: apaga a chave se o valor ainda for o mesmo
+                key, value = args[3], args[4]
+                entry = self._get(key)
+                if entry and entry[0] == value:
+                    del self.data[key]
+                    return 1
+                return 0
+            return RuntimeError(f"ERR unknown command '{args[0]}'")
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if not line.startswith(b"*"):
+                continue
+            args = []
+            for _ in range(int(line[1:-2])):
+                length = int(self.rfile.readline()[1:-2])
+                args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+            self.wfile.write(self.encode(self.server.state.execute(args)))
+
+    @staticmethod
+    def encode(reply):
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, Exception):
+            return f"-{reply}\r\n".encode()
+        if isinstance(reply, int):
+            return f":{reply}\r\n".encode()
+        if reply.startswith("+"):
+            return f"{reply}\r\n".encode()
+        data = reply.encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+if __name__ == "__main__":
+    # Sobe os dois servidores para testes manuais
+    slack = FakeSlack().start()
+    openai_server = FakeOpenAI().start()
+    redis_server = FakeRedis().start()
+    print(f"🧪 Slack falso:  LIVIA_SLACK_API_URL={slack.url}/api/")
+    print(f"🧪 OpenAI falsa: LIVIA_OPENAI_BASE_URL={openai_server.url}/v1")
+    print(f"🧪 Redis falso:  LIVIA_COORDENACAO=redis LIVIA_REDIS_URL={redis_server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
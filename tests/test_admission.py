@@ -0,0 +1,138 @@
+"""Testes do controle de admissão (dedup de entregas concorrentes, cooldown, expiração e release)"""
+import threading
+
+import pytest
+
+import Livia
+from Livia import AdmissionControl, LocalClaims, RedisClaims, SQLiteClaims
+from bench.servidores_falsos import FakeRedis
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(Livia.time, "time", fake)
+    return fake
+
+
+def make_admission(cooldown=2, max_age=300, claims=None):
+    return AdmissionControl(cooldown, max_age, claims or LocalClaims("teste"))
+
+
+def admit_concurrently(admissions, args, workers=32):
+    # Todas as threads liberadas juntas pela barreira, como entregas repetidas do Slack
+    barrier = threading.Barrier(workers)
+    results = []
+    results_lock = threading.Lock()
+
+    def deliver(i):
+        admission = admissions[i % len(admissions)]
+        barrier.wait()
+        key = admission.admit(*args)
+        with results_lock:
+            results.append(key)
+
+    threads = [threading.Thread(target=deliver, args=(i,)) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_entregas_concorrentes_admitem_uma_vez():
+    admission = make_admission()
+    results = admit_concurrently([admission], ("U1", "C1", None, "1.000"))
+    admitted = [key for key in results if key is not None]
+    assert len(admitted) == 1
+    assert admission.stats["admitidas"] == 1
+    assert admission.stats["duplicadas"] + admission.stats["cooldown"] == len(results) - 1
+    assert admission.in_flight() == 1
+
+
+def test_entregas_concorrentes_entre_instancias(tmp_path):
+    path = str(tmp_path / "coordenacao.db")
+    admissions = [make_admission(claims=SQLiteClaims(f"instancia-{i}", path)) for i in range(2)]
+    results = admit_concurrently(admissions, ("U1", "C1", None, "1.000"), workers=8)
+    assert len([key for key in results if key is not None]) == 1
+    assert sum(admission.stats["outra_instancia"] for admission in admissions) >= 1
+
+
+def test_entregas_concorrentes_entre_instancias_redis():
+    redis = FakeRedis().start()
+    try:
+        admissions = [make_admission(claims=RedisClaims(f"instancia-{i}", redis.url)) for i in range(2)]
+        results = admit_concurrently(admissions, ("U1", "C1", None, "1.000"), workers=8)
+        assert len([key for key in results if key is not None]) == 1
+        assert all(admission.claims.stats["erros"] == 0 for admission in admissions)
+    finally:
+        redis.stop()
+
+
+def test_backend_indisponivel_segue_respondendo():
+    # Sem o servidor a reivindicação falha aberta: a instância responde em vez de ficar muda
+    claims = RedisClaims("instancia", "redis://127.0.0.1:1/0")
+    assert claims.claim("msg:1", 10) is True
+    assert claims.stats["erros"] == 1
+
+
+def test_cooldown_por_usuario_canal_e_thread(clock):
+    admission = make_admission(cooldown=2)
+    assert admission.admit("U1", "C1", None, "1.000") is not None
+    # Mesma (usuário, canal, thread) dentro do cooldown
+    assert admission.admit("U1", "C1", None, "1.001") is None
+    assert admission.stats["cooldown"] == 1
+    # Outra thread, outro canal e outro usuário não compartilham o cooldown
+    assert admission.admit("U1", "C1", "9.000", "1.002") is not None
+    assert admission.admit("U1", "C2", None, "1.003") is not None
+    assert admission.admit("U2", "C1", None, "1.004") is not None
+    clock.advance(2.1)
+    assert admission.admit("U1", "C1", None, "1.005") is not None
+
+
+def test_cooldown_do_canal_sobrescreve_o_padrao(clock):
+    admission = make_admission(cooldown=2)
+    assert admission.admit("U1", "C1", None, "1.000", 10) is not None
+    clock.advance(5)
+    assert admission.admit("U1", "C1", None, "1.001", 10) is None
+    clock.advance(5.1)
+    assert admission.admit("U1", "C1", None, "1.002", 10) is not None
+
+
+def test_expiracao_de_mensagens_em_processamento(clock):
+    admission = make_admission(cooldown=0, max_age=10)
+    assert admission.admit("U1", "C1", None, "1.000") is not None
+    clock.advance(5)
+    assert admission.admit("U2", "C1", None, "2.000") is not None
+    # Ainda dentro de max_age: a mesma mensagem é duplicada
+    assert admission.admit("U1", "C1", None, "1.000") is None
+    clock.advance(6)
+    assert admission.expire() == 1
+    assert admission.in_flight() == 1
+    assert admission.stats["expiradas"] == 1
+    # Depois de expirar, uma nova entrega da mensagem volta a ser admitida
+    assert admission.admit("U1", "C1", None, "1.000") is not None
+
+
+def test_release_libera_a_mensagem(clock):
+    admission = make_admission(cooldown=0)
+    key = admission.admit("U1", "C1", None, "1.000")
+    assert admission.admit("U1", "C1", None, "1.000") is None
+    admission.release(key)
+    assert admission.in_flight() == 0
+    assert admission.admit("U1", "C1", None, "1.000") == key
+    # release de uma chave que já saiu não falha
+    admission.release(key)
+    admission.release(key)
+    assert admission.in_flight() == 0
@@ -0,0 +1,41 @@
+"""Testes da montagem do contexto de uma resposta em thread"""
+from Livia import construct_conversation_history, thread_context
+
+BOT = "UBOT"
+AGUARDE = ":hourglass_flowing_sand: Aguarde..."
+
+
+def thread_messages():
+    return [
+        {"user": "U1", "text": "raiz", "ts": "100.0"},
+        {"user": "U1", "text": "mensagem A", "ts": "101.0"},
+        {"user": "U1", "text": "mensagem B", "ts": "102.0"},
+        {"user": BOT, "text": "resposta a A", "ts": "103.0"},
+        {"user": "U1", "text": "mensagem C", "ts": "104.0"},
+        {"user": BOT, "text": AGUARDE, "ts": "105.0"},
+    ]
+
+
+def test_mensagens_de_usuarios_mais_novas_ficam_de_fora():
+    texts = [msg["text"] for msg in thread_context(thread_messages(), "102.0", BOT, AGUARDE)]
+    assert "mensagem C" not in texts
+    assert texts[:3] == ["raiz", "mensagem A", "mensagem B"]
+
+
+def test_resposta_a_mensagem_anterior_postada_depois_entra_no_contexto():
+    # A resposta a A foi postada (103) depois de B chegar (102): B precisa vê-la
+    texts = [msg["text"] for msg in thread_context(thread_messages(), "102.0", BOT, AGUARDE)]
+    assert texts == ["raiz", "mensagem A", "mensagem B", "resposta a A"]
+
+
+def test_aguarde_e_ignorado():
+    texts = [msg["text"] for msg in thread_context(thread_messages(), "104.0", BOT, AGUARDE)]
+    assert AGUARDE not in texts
+    assert texts[-1] == "mensagem C"
+
+
+def test_historico_termina_na_mensagem_respondida():
+    messages = thread_context(thread_messages(), "102.0", BOT, AGUARDE)
+    history = construct_conversation_history(messages, BOT, "U1", "mensagem B", "100.0", "102.0")
+    assert [msg["role"] for msg in history] == ["user", "user", "user", "assistant"]
+    assert "mensagem C" not in [msg["content"] for msg in history]
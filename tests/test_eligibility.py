@@ -0,0 +1,37 @@
+"""Testes da decisão de elegibilidade (índice de threads)"""
+import pytest
+
+import Livia
+from Livia import ThreadEligibilityIndex, classify_message
+
+BOT = "UBOT"
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    fresh = ThreadEligibilityIndex(str(tmp_path / "threads.json"), 3600)
+    monkeypatch.setattr(Livia, "eligibility", fresh)
+    monkeypatch.setattr(Livia, "classification_cache", Livia.TTLCache())
+    return fresh
+
+
+def message(text, ts, thread_ts=None, kind="nova"):
+    return {"kind": kind, "channel_id": "C1", "channel_type": "channel", "user_id": "U1",
+            "text": text, "ts": ts, "thread_ts": thread_ts}
+
+
+def test_mencao_na_raiz_entra_no_indice_antes_da_admissao(index):
+    ts = f"{index.created_at + 10:.6f}"
+    assert classify_message(message(f"<@{BOT}> oi", ts), BOT) == "mencao"
+    # Mesmo que a raiz seja recusada depois, as respostas na thread são atendidas
+    reply_ts = f"{index.created_at + 20:.6f}"
+    assert classify_message(message("e agora?", reply_ts, thread_ts=ts), BOT) == "thread"
+
+
+def test_mencao_dentro_de_thread_nao_indexa_a_thread(index):
+    thread_ts = f"{index.created_at + 10:.6f}"
+    reply_ts = f"{index.created_at + 20:.6f}"
+    assert classify_message(message(f"<@{BOT}> oi", reply_ts, thread_ts=thread_ts), BOT) == "mencao"
+    assert not index.contains("C1", thread_ts)
+    other_ts = f"{index.created_at + 30:.6f}"
+    assert classify_message(message("e agora?", other_ts, thread_ts=thread_ts), BOT) is None
@@ -0,0 +1,25 @@
+"""Testes do gateway do modelo"""
+import time
+
+from Livia import ModelGateway
+
+ROUTE = ("o3-mini", "medium")
+
+
+def gateway_with_latencies(latencies):
+    gateway = ModelGateway()
+    gateway._route_state(ROUTE)
+    now = time.time()
+    for latency in latencies:
+        gateway._latencies[ROUTE].append((now, latency))
+    return gateway
+
+
+def test_p95_nearest_rank():
+    # Com 10 amostras o p95 é a maior; com 20, a 19ª
+    assert gateway_with_latencies(range(1, 11)).p95(ROUTE) == 10
+    assert gateway_with_latencies(range(1, 21)).p95(ROUTE) == 19
+
+
+def test_p95_sem_amostras_suficientes():
+    assert gateway_with_latencies(range(1, 5)).p95(ROUTE) is None
@@ -0,0 +1,11 @@
+"""Testes da exposição das métricas no formato de texto do Prometheus"""
+from Livia import format_labels
+
+
+def test_rotulos_escapam_barras_aspas_e_quebras_de_linha():
+    labels = [("tipo", 'C:\\erro "grave"\nlinha'), ("porta", 9464)]
+    assert format_labels(labels) == '{tipo="C:\\\\erro \\"grave\\" linha",porta="9464"}'
+
+
+def test_sem_rotulos():
+    assert format_labels(()) == ""
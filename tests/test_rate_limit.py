@@ -0,0 +1,31 @@
+"""Testes do balde de tokens (limites de taxa do Slack e da OpenAI)"""
+import pytest
+
+import Livia
+from Livia import TokenBucket
+
+
+@pytest.fixture
+def frozen(monkeypatch):
+    # Sem reabastecimento durante o teste
+    monkeypatch.setattr(Livia.time, "time", lambda: 1_000_000.0)
+
+
+def test_acquire_retorna_o_desconto_limitado_a_capacidade(frozen):
+    bucket = TokenBucket("teste", 600)  # capacidade 100
+    assert bucket.acquire(30) == 30
+    assert bucket.level() == 70
+    # Pedido maior que a capacidade desconta só a capacidade
+    wait, amount = bucket.reserve(500)
+    assert amount == 100
+    assert bucket.level() == -30
+    assert wait > 0
+
+
+def test_refund_pelo_desconto_real_nao_infla_o_saldo(monkeypatch, frozen):
+    bucket = TokenBucket("openai.tokens", 600)
+    monkeypatch.setattr(Livia, "openai_token_bucket", bucket)
+    reserved = bucket.acquire(5000)
+    Livia.settle_openai_tokens(reserved, {"prompt_tokens": 40, "completion_tokens": 20})
+    # Descontou 100 (capacidade) e usou 60: volta 40, não 4940
+    assert bucket.level() == 40
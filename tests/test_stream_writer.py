@@ -0,0 +1,61 @@
+"""Testes da edição da mensagem de "aguarde" durante o streaming"""
+import pytest
+
+import Livia
+from Livia import SlackStreamWriter
+
+
+class FakeSlackMessages:
+    def __init__(self, fail_updates=False):
+        self.fail_updates = fail_updates
+        self.counter = 0
+        self.calls = []
+
+    def update(self, channel_id, ts, text, wait=True):
+        self.calls.append(("update", ts))
+        return not self.fail_updates
+
+    def post(self, channel_id, text, thread_ts=None, max_retries=3):
+        self.counter += 1
+        self.calls.append(("post", f"novo-{self.counter}"))
+        return f"novo-{self.counter}"
+
+    def delete(self, channel_id, ts):
+        self.calls.append(("delete", ts))
+
+
+@pytest.fixture
+def slack(monkeypatch):
+    fake = FakeSlackMessages()
+    monkeypatch.setattr(Livia, "update_message_in_slack", fake.update)
+    monkeypatch.setattr(Livia, "post_message_to_slack", fake.post)
+    monkeypatch.setattr(Livia, "delete_message_from_slack", fake.delete)
+    monkeypatch.setattr(Livia, "split_slack_message", lambda text: text.split("|"))
+    monkeypatch.setattr(Livia, "limpar_formatacao", lambda text: text)
+    return fake
+
+
+def test_so_partes_alteradas_sao_editadas(slack):
+    writer = SlackStreamWriter("C1", "1.0", "aguarde")
+    writer.finish("a|b")
+    assert slack.calls == [("update", "aguarde"), ("post", "novo-1")]
+    slack.calls.clear()
+    writer.finish("a|c")
+    assert slack.calls == [("update", "novo-1")]
+
+
+def test_resposta_final_menor_apaga_mensagens_que_sobraram(slack):
+    writer = SlackStreamWriter("C1", "1.0", "aguarde")
+    writer.finish("a|b|c")
+    slack.calls.clear()
+    writer.finish("a")
+    assert slack.calls == [("delete", "novo-1"), ("delete", "novo-2")]
+    assert writer.message_ts == ["aguarde"]
+
+
+def test_edicao_final_que_falha_vira_nova_mensagem(slack):
+    slack.fail_updates = True
+    writer = SlackStreamWriter("C1", "1.0", "aguarde")
+    writer.finish("a")
+    assert slack.calls == [("update", "aguarde"), ("post", "novo-1"), ("delete", "aguarde")]
+    assert writer.message_ts == ["novo-1"] and writer.sent == ["a"]
@@ -0,0 +1,276 @@
+# uso_analytics.py - Registro de uso da Livia em SQLite, com agregados diários e relatórios
+#
+# A Livia grava cada lote do registro de uso aqui (além do CSV). Os relatórios leem a tabela
+# uso_diario, atualizada incrementalmente a cada lote, então não dependem do tamanho do histórico.
+#
+# Uso:
+#   python uso_analytics.py importar registro_uso.20260901-080000.csv   # só histórico anterior à base:
+#       linhas gravadas pela Livia depois que a base existe já estão nela e seriam contadas duas vezes
+#   python uso_analytics.py resumo --desde 2026-10-01
+#   python uso_analytics.py usuarios-dia --desde 2026-10-01 --ate 2026-10-07
+#   python uso_analytics.py top-canais --mes 2026-10
+#   python uso_analytics.py top-usuarios --mes 2026-10 --limite 20
+#   python uso_analytics.py tokens-dia --desde 2026-10-01
+
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_DB = os.getenv("LIVIA_USO_DB", "registro_uso.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uso (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    dia TEXT NOT NULL,
+    user_id TEXT,
+    user_name TEXT,
+    channel_name TEXT,
+    prompt_type TEXT,
+    latency_ms INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    reasoning_tokens INTEGER
+);
+CREATE INDEX IF NOT EXISTS uso_timestamp ON uso (timestamp);
+CREATE INDEX IF NOT EXISTS uso_usuario ON uso (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS uso_canal ON uso (channel_name, timestamp);
+
+CREATE TABLE IF NOT EXISTS uso_diario (
+    dia TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    channel_name TEXT NOT NULL,
+    prompt_type TEXT NOT NULL,
+    user_name TEXT,
+    mensagens INTEGER NOT NULL DEFAULT 0,
+    latencia_total_ms INTEGER NOT NULL DEFAULT 0,
+    latencia_n INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    reasoning_tokens INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, user_id, channel_name, prompt_type)
+);
+CREATE INDEX IF NOT EXISTS uso_diario_canal ON uso_diario (channel_name, dia);
+CREATE INDEX IF NOT EXISTS uso_diario_usuario ON uso_diario (user_id, dia);
+
+CREATE TABLE IF NOT EXISTS importacoes (
+    arquivo TEXT PRIMARY KEY,
+    linhas INTEGER NOT NULL,
+    importado_em TEXT NOT NULL
+);
+"""
+
+ROLLUP_UPSERT = """
+INSERT INTO uso_diario (dia, user_id, channel_name, prompt_type, user_name, mensagens,
+                        latencia_total_ms, latencia_n, prompt_tokens, completion_tokens, reasoning_tokens)
+VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
+ON CONFLICT (dia, user_id, channel_name, prompt_type) DO UPDATE SET
+    user_name = excluded.user_name,
+    mensagens = mensagens + 1,
+    latencia_total_ms = latencia_total_ms + excluded.latencia_total_ms,
+    latencia_n = latencia_n + excluded.latencia_n,
+    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+    completion_tokens = completion_tokens + excluded.completion_tokens,
+    reasoning_tokens = reasoning_tokens + excluded.reasoning_tokens
+"""
+
+def to_int(value):
+    # Campos vazios do CSV viram None
+    if value is None or value == '':
+        return None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+class UsageStore:
+    """Tabela de uso com índices por data, usuário e canal, mais o agregado diário uso_diario"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def add_rows(self, rows):
+        """Grava linhas no formato do CSV (campos de USAGE_FIELDS) e atualiza o agregado, numa transação"""
+        records = []
+        rollups = []
+        for row in rows:
+            timestamp = row.get('timestamp') or ''
+            latency = to_int(row.get('latency_ms'))
+            record = (timestamp, timestamp[:10], row.get('user_id') or '', row.get('user_name'),
+                      row.get('channel_name') or '', row.get('prompt_type') or '', latency,
+                      to_int(row.get('prompt_tokens')), to_int(row.get('completion_tokens')),
+                      to_int(row.get('reasoning_tokens')))
+            records.append(record)
+            rollups.append((record[1], record[2], record[4], record[5], record[3],
+                            latency or 0, 1 if latency is not None else 0,
+                            record[7] or 0, record[8] or 0, record[9] or 0))
+        if not records:
+            return 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO uso (timestamp, dia, user_id, user_name, channel_name, prompt_type, latency_ms,"
+                    " prompt_tokens, completion_tokens, reasoning_tokens) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    records
+                )
+                self._conn.executemany(ROLLUP_UPSERT, rollups)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(records)
+
+    def import_csv(self, path, force=False, batch_rows=5000):
+        """Importa um CSV do registro de uso; arquivos já importados são pulados (a menos que force=True)"""
+        key = os.path.abspath(path)
+        if not force and self._conn.execute("SELECT 1 FROM importacoes WHERE arquivo = ?", (key,)).fetchone():
+            return None
+        total = 0
+        with open(path, newline='', encoding='utf-8') as csvfile:
+            batch = []
+            for row in csv.DictReader(csvfile):
+                batch.append(row)
+                if len(batch) >= batch_rows:
+                    total += self.add_rows(batch)
+                    batch = []
+            total += self.add_rows(batch)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO importacoes (arquivo, linhas, importado_em) VALUES (?, ?, ?)",
+                               (key, total, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        return total
+
+    def rebuild_rollups(self):
+        """Recalcula uso_diario a partir da tabela uso (para reparar o agregado)"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM uso_diario")
+            self._conn.execute(
+                "INSERT INTO uso_diario (dia, user_id, channel_name, prompt_type, user_name, mensagens,"
+                " latencia_total_ms, latencia_n, prompt_tokens, completion_tokens, reasoning_tokens)"
+                " SELECT dia, user_id, channel_name, prompt_type, MAX(user_name), COUNT(*),"
+                " COALESCE(SUM(latency_ms), 0), COUNT(latency_ms), COALESCE(SUM(prompt_tokens), 0),"
+                " COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(reasoning_tokens), 0)"
+                " FROM uso GROUP BY dia, user_id, channel_name, prompt_type"
+            )
+            self._conn.execute("COMMIT")
+
+    def query(self, sql, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            columns = [c[0] for c in cursor.description]
+            return columns, cursor.fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Relatórios: todos leem uso_diario filtrado pelo intervalo de dias [desde, ate]
+REPORTS = {
+    "resumo": (
+        "Totais do período",
+        "SELECT COUNT(DISTINCT dia) AS dias, SUM(mensagens) AS mensagens, COUNT(DISTINCT user_id) AS usuarios,"
+        " COUNT(DISTINCT channel_name) AS canais, SUM(prompt_tokens) AS prompt_tokens,"
+        " SUM(completion_tokens) AS completion_tokens, SUM(reasoning_tokens) AS reasoning_tokens,"
+        " CAST(SUM(latencia_total_ms) / NULLIF(SUM(latencia_n), 0) AS INTEGER) AS latencia_media_ms"
+        " FROM uso_diario WHERE dia BETWEEN ? AND ?"
+    ),
+    "usuarios-dia": (
+        "Mensagens por usuário por dia",
+        "SELECT dia, user_id, MAX(user_name) AS usuario, SUM(mensagens) AS mensagens"
+        " FROM uso_diario WHERE dia BETWEEN ? AND ? GROUP BY dia, user_id ORDER BY dia, mensagens DESC"
+    ),
+    "top-canais": (
+        "Canais com mais mensagens",
+        "SELECT channel_name AS canal, SUM(mensagens) AS mensagens, COUNT(DISTINCT user_id) AS usuarios,"
+        " SUM(prompt_tokens + completion_tokens) AS tokens"
+        " FROM uso_diario WHERE dia BETWEEN ? AND ? GROUP BY channel_name ORDER BY mensagens DESC LIMIT ?"
+    ),
+    "top-usuarios": (
+        "Usuários com mais mensagens",
+        "SELECT user_id, MAX(user_name) AS usuario, SUM(mensagens) AS mensagens,"
+        " SUM(prompt_tokens + completion_tokens) AS tokens"
+        " FROM uso_diario WHERE dia BETWEEN ? AND ? GROUP BY user_id ORDER BY mensagens DESC LIMIT ?"
+    ),
+    "tokens-dia": (
+        "Tokens e latência média por dia",
+        "SELECT dia, SUM(mensagens) AS mensagens, SUM(prompt_tokens) AS prompt_tokens,"
+        " SUM(completion_tokens) AS completion_tokens, SUM(reasoning_tokens) AS reasoning_tokens,"
+        " CAST(SUM(latencia_total_ms) / NULLIF(SUM(latencia_n), 0) AS INTEGER) AS latencia_media_ms"
+        " FROM uso_diario WHERE dia BETWEEN ? AND ? GROUP BY dia ORDER BY dia"
+    ),
+}
+
+def print_table(columns, rows):
+    cells = [[("" if v is None else str(v)) for v in row] for row in rows]
+    widths = [max([len(c)] + [len(row[i]) for row in cells]) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+def period(args):
+    # Converte --mes ou --desde/--ate num intervalo de dias (AAAA-MM-DD)
+    if args.mes:
+        return f"{args.mes}-01", f"{args.mes}-31"
+    return args.desde or "0000-00-00", args.ate or "9999-12-31"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Relatórios do registro de uso da Livia")
+    parser.add_argument("--db", default=DEFAULT_DB, help=f"banco SQLite (padrão: {DEFAULT_DB})")
+    commands = parser.add_subparsers(dest="comando", required=True)
+
+    importer = commands.add_parser("importar", help="importa CSVs do registro de uso anteriores à base (linhas não são deduplicadas)")
+    importer.add_argument("arquivos", nargs="+")
+    importer.add_argument("--forcar", action="store_true", help="importa de novo arquivos já importados")
+
+    commands.add_parser("reconstruir", help="recalcula os agregados diários a partir da tabela uso")
+
+    for name, (description, _) in REPORTS.items():
+        report = commands.add_parser(name, help=description)
+        report.add_argument("--desde", help="primeiro dia (AAAA-MM-DD)")
+        report.add_argument("--ate", help="último dia (AAAA-MM-DD)")
+        report.add_argument("--mes", help="mês inteiro (AAAA-MM)")
+        report.add_argument("--limite", type=int, default=10, help="linhas nos rankings")
+
+    args = parser.parse_args(argv)
+    store = UsageStore(args.db)
+    try:
+        if args.comando == "importar":
+            for path in args.arquivos:
+                imported = store.import_csv(path, force=args.forcar)
+                if imported is None:
+                    print(f"⏭️ {path}: já importado (use --forcar para importar de novo)")
+                else:
+                    print(f"✅ {path}: {imported} linhas importadas")
+            return 0
+        if args.comando == "reconstruir":
+            store.rebuild_rollups()
+            print("✅ Agregados diários recalculados")
+            return 0
+
+        description, sql = REPORTS[args.comando]
+        params = period(args)
+        if "LIMIT ?" in sql:
+            params += (args.limite,)
+        started_at = time.perf_counter()
+        columns, rows = store.query(sql, params)
+        print(f"📊 {description} ({params[0]} a {params[1]})")
+        print_table(columns, rows)
+        print(f"⏱️ {(time.perf_counter() - started_at) * 1000:.1f} ms")
+        return 0
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    sys.exit(main())